@@ -0,0 +1,348 @@
+"""Columnar analytics over sales and reviews with NumPy.
+
+The reports in `exercises4.md` join several tables and aggregate them with
+GROUP BY. SQLite stores the tables row by row, so every report reads all the
+columns of every row it touches, and the work grows with the size of
+`orders_items` and `product_reviews`.
+
+`AnalyticsSnapshot` instead loads only the columns that the reports need into
+NumPy arrays, one array per column. The dimensions are integer encoded:
+
+- products are encoded by their id, and lookup arrays indexed by product id
+  give the manufacturer code of a product,
+- manufacturers and countries are encoded as positions in their name arrays,
+- months are encoded as the number of months since 1970-01.
+
+With integer codes a GROUP BY becomes a call to `np.bincount`, which sums the
+values for each code in a single vectorised pass.
+
+Rows are appended to the snapshot by `refresh()`, which only reads rows that
+have been inserted since the previous refresh (detected with the SQLite
+`rowid`). Updated or deleted rows are not detected, create a new snapshot if
+rows have been changed.
+
+NumPy is an optional dependency, install it with `uv sync --extra analytics`.
+
+Example:
+
+    with Session() as session:
+        snapshot = AnalyticsSnapshot()
+        snapshot.refresh(session)
+        snapshot.sales_by_manufacturer()[:5]
+
+Run this file to compare the results with the SQL queries in
+`exercises4.md` and time both.
+"""
+
+import time
+
+from sqlalchemy import func, literal_column, select
+
+from models import (Country, Manufacturer, Order, OrderItem, Product,
+                    ProductCountry, ProductReview)
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError(
+        "The analytics engine requires numpy, install it with "
+        "`uv sync --extra analytics`") from e
+
+
+def _month_codes(timestamps):
+    """Converts datetimes to the number of months since 1970-01."""
+    return np.array(timestamps, dtype="datetime64[M]").astype(np.int64)
+
+
+def _year_month(code):
+    return 1970 + int(code) // 12, int(code) % 12 + 1
+
+
+def _group_sum(keys, weights=None):
+    """Sums `weights` (or counts rows) per distinct key, returning the
+    distinct keys and the sums."""
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    return uniq, np.bincount(inverse, weights=weights, minlength=len(uniq))
+
+
+class AnalyticsSnapshot:
+    def __init__(self):
+        # Dimensions, reloaded completely on every refresh since they are
+        # small.
+        self.product_names = np.array([], dtype=object)  # indexed by id
+        self.product_manufacturer = np.array([], dtype=np.int64)  # by id
+        self.manufacturer_names = np.array([], dtype=object)
+        self.country_names = np.array([], dtype=object)
+        # One entry per row in products_countries.
+        self.pc_product = np.array([], dtype=np.int64)
+        self.pc_country = np.array([], dtype=np.int64)
+
+        # Facts, one entry per row in orders_items.
+        self.sale_product = np.array([], dtype=np.int64)
+        self.sale_amount = np.array([], dtype=np.float64)
+        self.sale_month = np.array([], dtype=np.int64)
+        self._last_sale_rowid = 0
+
+        # Facts, one entry per row in product_reviews.
+        self.review_product = np.array([], dtype=np.int64)
+        self.review_rating = np.array([], dtype=np.float64)
+        self.review_month = np.array([], dtype=np.int64)
+        self.review_has_comment = np.array([], dtype=bool)
+        self._last_review_rowid = 0
+
+    def refresh(self, session):
+        """Reloads the dimensions and appends the sales and reviews that
+        were added since the last refresh."""
+        self._load_dimensions(session)
+        self._load_sales(session)
+        self._load_reviews(session)
+
+    def _load_dimensions(self, session):
+        manufacturers = session.execute(
+            select(Manufacturer.id, Manufacturer.name)
+            .order_by(Manufacturer.id)).all()
+        self.manufacturer_names = np.array(
+            [name for _, name in manufacturers], dtype=object)
+        manufacturer_code = {id: code
+                             for code, (id, _) in enumerate(manufacturers)}
+
+        products = session.execute(
+            select(Product.id, Product.name, Product.manufacturer_id)).all()
+        size = max((id for id, _, _ in products), default=0) + 1
+        self.product_names = np.full(size, None, dtype=object)
+        self.product_manufacturer = np.full(size, -1, dtype=np.int64)
+        for id, name, manufacturer_id in products:
+            self.product_names[id] = name
+            self.product_manufacturer[id] = manufacturer_code[manufacturer_id]
+
+        countries = session.execute(
+            select(Country.id, Country.name).order_by(Country.id)).all()
+        self.country_names = np.array(
+            [name for _, name in countries], dtype=object)
+        country_code = {id: code for code, (id, _) in enumerate(countries)}
+
+        pairs = session.execute(
+            select(ProductCountry.c.product_id,
+                   ProductCountry.c.country_id)).all()
+        self.pc_product = np.array([p for p, _ in pairs], dtype=np.int64)
+        self.pc_country = np.array([country_code[c] for _, c in pairs],
+                                   dtype=np.int64)
+
+    def _load_sales(self, session):
+        rowid = literal_column("orders_items.rowid")
+        rows = session.execute(
+            select(rowid, OrderItem.product_id, OrderItem.unit_price,
+                   OrderItem.quantity, Order.timestamp)
+            .join(OrderItem.order)
+            .where(rowid > self._last_sale_rowid)).all()
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        amount = (np.array(columns[2], dtype=np.float64)
+                  * np.array(columns[3], dtype=np.float64))
+        self.sale_product = np.concatenate(
+            [self.sale_product, np.array(columns[1], dtype=np.int64)])
+        self.sale_amount = np.concatenate([self.sale_amount, amount])
+        self.sale_month = np.concatenate(
+            [self.sale_month, _month_codes(columns[4])])
+        self._last_sale_rowid = max(columns[0])
+
+    def _load_reviews(self, session):
+        rowid = literal_column("product_reviews.rowid")
+        rows = session.execute(
+            select(rowid, ProductReview.product_id, ProductReview.rating,
+                   ProductReview.timestamp,
+                   ProductReview.comment.is_not(None))
+            .where(rowid > self._last_review_rowid)).all()
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        self.review_product = np.concatenate(
+            [self.review_product, np.array(columns[1], dtype=np.int64)])
+        self.review_rating = np.concatenate(
+            [self.review_rating, np.array(columns[2], dtype=np.float64)])
+        self.review_month = np.concatenate(
+            [self.review_month, _month_codes(columns[3])])
+        self.review_has_comment = np.concatenate(
+            [self.review_has_comment, np.array(columns[4], dtype=bool)])
+        self._last_review_rowid = max(columns[0])
+
+    def _per_product(self, products, weights=None):
+        """Sums `weights`, or counts rows, per product id."""
+        return np.bincount(products, weights=weights,
+                           minlength=len(self.product_names))
+
+    def sales_by_manufacturer(self):
+        """Total sale amount per manufacturer, highest first.
+
+        Same result as exercise 4.6 without the limit.
+        """
+        manufacturers = self.product_manufacturer[self.sale_product]
+        totals = np.bincount(manufacturers, weights=self.sale_amount,
+                             minlength=len(self.manufacturer_names))
+        sold = np.bincount(manufacturers,
+                           minlength=len(self.manufacturer_names)) > 0
+        order = np.argsort(-totals, kind="stable")
+        return [(self.manufacturer_names[m], float(totals[m]))
+                for m in order if sold[m]]
+
+    def sales_by_manufacturer_month(self):
+        """Total sale amount per manufacturer and month, as
+        `(manufacturer, year, month, amount)` sorted by manufacturer name
+        and month."""
+        manufacturers = self.product_manufacturer[self.sale_product]
+        offset = int(self.sale_month.min(initial=0))
+        months = self.sale_month - offset
+        n_months = int(months.max(initial=0)) + 1
+        keys, totals = _group_sum(manufacturers * n_months + months,
+                                  self.sale_amount)
+        result = [
+            (self.manufacturer_names[key // n_months],
+             *_year_month(key % n_months + offset), float(total))
+            for key, total in zip(keys, totals)
+        ]
+        return sorted(result, key=lambda r: (r[0], r[1], r[2]))
+
+    def rating_by_product(self, with_comment_only=False):
+        """Average rating and review count per product, as
+        `(product, average, count)` with the most reviewed first.
+
+        Same result as exercise 4.7, or 4.8 with `with_comment_only`.
+        """
+        mask = (self.review_has_comment if with_comment_only
+                else slice(None))
+        products = self.review_product[mask]
+        sums = self._per_product(products, self.review_rating[mask])
+        counts = self._per_product(products)
+        reviewed = np.flatnonzero(counts)
+        order = reviewed[np.argsort(-counts[reviewed], kind="stable")]
+        return [(self.product_names[p], float(sums[p] / counts[p]),
+                 int(counts[p])) for p in order]
+
+    def monthly_rating(self, product_name, year):
+        """Average rating of a product per month of a year, as
+        `(month, average)`.
+
+        Same result as exercise 4.9.
+        """
+        product_id = int(np.flatnonzero(self.product_names == product_name)[0])
+        first_month = (year - 1970) * 12
+        mask = ((self.review_product == product_id)
+                & (self.review_month >= first_month)
+                & (self.review_month < first_month + 12))
+        months, sums = _group_sum(self.review_month[mask],
+                                  self.review_rating[mask])
+        _, counts = _group_sum(self.review_month[mask])
+        return [(_year_month(m)[1], float(s / c))
+                for m, s, c in zip(months, sums, counts)]
+
+    def rating_by_manufacturer(self):
+        """Average rating per manufacturer, as `(manufacturer, average)`
+        from highest to lowest.
+
+        Same result as exercise 4.11.
+        """
+        sums = self._per_product(self.review_product, self.review_rating)
+        counts = self._per_product(self.review_product)
+        size = len(self.manufacturer_names)
+        known = self.product_manufacturer >= 0
+        m_sums = np.bincount(self.product_manufacturer[known],
+                             weights=sums[known], minlength=size)
+        m_counts = np.bincount(self.product_manufacturer[known],
+                               weights=counts[known], minlength=size)
+        return self._averages(self.manufacturer_names, m_sums, m_counts)
+
+    def rating_by_country(self):
+        """Average rating per country, as `(country, average)` from highest
+        to lowest. A review counts once for every country of its product.
+
+        Same result as exercise 4.12.
+        """
+        sums = self._per_product(self.review_product, self.review_rating)
+        counts = self._per_product(self.review_product)
+        size = len(self.country_names)
+        c_sums = np.bincount(self.pc_country,
+                             weights=sums[self.pc_product], minlength=size)
+        c_counts = np.bincount(self.pc_country,
+                               weights=counts[self.pc_product], minlength=size)
+        return self._averages(self.country_names, c_sums, c_counts)
+
+    @staticmethod
+    def _averages(names, sums, counts):
+        reviewed = np.flatnonzero(counts)
+        averages = sums[reviewed] / counts[reviewed]
+        order = np.argsort(-averages, kind="stable")
+        return [(names[reviewed[i]], float(averages[i])) for i in order]
+
+
+def sql_reports(session):
+    """The SQL versions of the reports, from the solutions in
+    `exercises4.md`."""
+    order_total = func.sum(OrderItem.quantity * OrderItem.unit_price)
+    avg_rating = func.avg(ProductReview.rating)
+    review_count = func.count(ProductReview.product_id)
+    month = ProductReview.month_key % 100
+    return {
+        "sales_by_manufacturer": session.execute(
+            select(Manufacturer.name, order_total)
+            .join(Manufacturer.products).join(Product.order_items)
+            .group_by(Manufacturer)).all(),
+        "rating_by_product": session.execute(
+            select(Product.name, avg_rating, review_count)
+            .join(Product.reviews).group_by(Product)).all(),
+        "monthly_rating": session.execute(
+            select(month, avg_rating)
+            .join(ProductReview.product)
+            .where(Product.name == "Commodore 64",
+                   ProductReview.month_key.between(202201, 202212))
+            .group_by(ProductReview.month_key)).all(),
+        "rating_by_manufacturer": session.execute(
+            select(Manufacturer.name, avg_rating)
+            .join(Manufacturer.products).join(Product.reviews)
+            .group_by(Manufacturer)).all(),
+        "rating_by_country": session.execute(
+            select(Country.name, avg_rating)
+            .join(Country.products).join(Product.reviews)
+            .group_by(Country)).all(),
+    }
+
+
+def snapshot_reports(snapshot):
+    return {
+        "sales_by_manufacturer": snapshot.sales_by_manufacturer(),
+        "rating_by_product": snapshot.rating_by_product(),
+        "monthly_rating": snapshot.monthly_rating("Commodore 64", 2022),
+        "rating_by_manufacturer": snapshot.rating_by_manufacturer(),
+        "rating_by_country": snapshot.rating_by_country(),
+    }
+
+
+def _normalized(rows):
+    return sorted(tuple(round(v, 6) if isinstance(v, float) else v
+                        for v in row) for row in rows)
+
+
+def main():
+    from db import Session
+
+    with Session() as session:
+        start = time.perf_counter()
+        snapshot = AnalyticsSnapshot()
+        snapshot.refresh(session)
+        print(f"Snapshot loaded in {time.perf_counter() - start:.3f}s")
+
+        start = time.perf_counter()
+        expected = sql_reports(session)
+        print(f"SQL reports: {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    actual = snapshot_reports(snapshot)
+    print(f"Snapshot reports: {time.perf_counter() - start:.3f}s")
+
+    for name in expected:
+        same = _normalized(expected[name]) == _normalized(actual[name])
+        print(f"{name}: {'OK' if same else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Archiving of old orders, reviews and page views.
+
+Old rows are rarely read, but they still make the database file and its
+indexes larger, which makes every query and backup slower. This module moves
+the rows older than a cutoff date to a separate *archive* SQLite database.
+The archive database is attached to the connections of the main database
+with `ATTACH DATABASE`, which makes its tables available under the
+`archive` schema name, so rows can be moved between the two files with
+plain INSERT ... SELECT statements.
+
+The rows are moved in batches, each batch in its own transaction, so the
+main database is never locked for long. Order items are moved together with
+their order.
+
+Deleting rows does not make the database file smaller, the free pages are
+kept for later use. If the database has `auto_vacuum` set to INCREMENTAL the
+free pages are given back to the file system with `PRAGMA
+incremental_vacuum` after the archiving, a few pages at a time.
+`enable_incremental_vacuum()` switches a database to INCREMENTAL, which
+requires a full VACUUM once.
+
+Queries read only the main database unless they opt in to the archive:
+
+    attach_on_connect(engine)
+    orders = with_archive(Order)
+    session.scalars(select(orders).where(orders.timestamp < cutoff))
+
+Usage: python archive.py 2022-01-01 [--batch-size 1000]
+"""
+
+import argparse
+import time
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import (Column, Index, MetaData, Table, delete, event,
+                        insert, literal_column, select, union_all)
+from sqlalchemy.orm import Session, aliased
+
+from models import (CALENDAR_KEYS_SQL, BlogView, Order, OrderItem,
+                    ProductReview)
+from online_rebuild import upgrade_table
+
+SCHEMA = "archive"
+
+# The archive tables have the same columns as the main tables, but no
+# foreign keys, since the rows they refer to (customers, products, ...) stay
+# in the main database.
+metadata = MetaData(schema=SCHEMA)
+
+
+def _archive_table(table):
+    columns = [Column(c.name, c.type, primary_key=c.primary_key,
+                      nullable=c.nullable) for c in table.columns]
+    indexes = [Index(f"ix_{table.name}_timestamp", "timestamp")
+               if "timestamp" in table.columns else
+               Index(f"ix_{table.name}_order_id", "order_id")]
+    return Table(table.name, metadata, *columns, *indexes)
+
+
+ARCHIVED = {
+    model: _archive_table(model.__table__)
+    for model in (Order, OrderItem, ProductReview, BlogView)
+}
+
+
+def default_path(engine):
+    """The archive is stored next to the main database by default, as
+    <name>_archive.sqlite."""
+    database = Path(engine.url.database)
+    return str(database.with_name(f"{database.stem}_archive.sqlite"))
+
+
+def attach_on_connect(engine, path=None):
+    """Attaches the archive to every new connection of `engine`, which is
+    needed to use `with_archive()` in queries. The connections already in
+    the pool are closed, so that all connections have the archive."""
+    path = path or default_path(engine)
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.execute(
+            f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+
+    engine.dispose()
+
+
+def create_tables(engine):
+    """Creates the archive tables. The tables of an archive created by an
+    earlier version get the new columns, such as the calendar keys, so that
+    the rows can be moved and read together with the main tables. The
+    archive must be attached to the connections of `engine`."""
+    with engine.connect() as connection:
+        metadata.create_all(connection)
+        connection.commit()
+        for table in metadata.sorted_tables:
+            upgrade_table(table, CALENDAR_KEYS_SQL, connection)
+
+
+def with_archive(model):
+    """Returns an alias of `model` that selects the rows of both the main
+    table and the archive table. It can be used in queries in the place of
+    the model, and returns instances of the model."""
+    union = union_all(select(model.__table__), select(ARCHIVED[model]))
+    return aliased(model, union.subquery())
+
+
+def _move(connection, model, where):
+    """Copies the rows of `model` matching `where` to the archive and
+    deletes them from the main table."""
+    table = model.__table__
+    connection.execute(
+        insert(ARCHIVED[model]).from_select(
+            table.columns.keys(), select(table).where(where)))
+    return connection.execute(delete(table).where(where)).rowcount
+
+
+def archive_rows(engine, model, cutoff, batch_size=1000):
+    """Moves the rows of `model` older than `cutoff` to the archive, one
+    batch per transaction, and returns the number of moved rows.
+
+    Batches are selected by the SQLite rowid, which every table has, so
+    tables with composite primary keys are handled in the same way.
+    """
+    table = model.__table__
+    rowid = literal_column(f"{table.name}.rowid")
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            batch = (select(rowid).where(table.c.timestamp < cutoff)
+                     .limit(batch_size).scalar_subquery())
+            if model is Order:
+                order_ids = select(table.c.id).where(rowid.in_(batch))
+                _move(connection, OrderItem,
+                      OrderItem.__table__.c.order_id.in_(order_ids))
+            count = _move(connection, model, rowid.in_(batch))
+        moved += count
+        if count < batch_size:
+            return moved
+
+
+def enable_incremental_vacuum(engine):
+    """Switches the database to `auto_vacuum = INCREMENTAL`. This rewrites
+    the whole database file with a VACUUM, so it is only done once."""
+    with engine.connect() as connection:
+        connection = connection.execution_options(
+            isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+    # The VACUUM may have changed the rowids of the reviews, which the review
+    # search table refers to, see search.py.
+    import search
+    with Session(engine) as session, session.begin():
+        search.rebuild(session)
+
+
+def incremental_vacuum(engine, pages_per_step=1000):
+    """Returns the free pages of the database to the file system, a few
+    pages per transaction. Returns the number of released pages, or None
+    if the database does not use incremental auto vacuum."""
+    released = 0
+    with engine.connect() as connection:
+        connection = connection.execution_options(
+            isolation_level="AUTOCOMMIT")
+        if connection.exec_driver_sql(
+                "PRAGMA main.auto_vacuum").scalar() != 2:
+            return None
+        free = connection.exec_driver_sql(
+            "PRAGMA main.freelist_count").scalar()
+        while free > 0:
+            connection.exec_driver_sql(
+                f"PRAGMA main.incremental_vacuum({pages_per_step})")
+            remaining = connection.exec_driver_sql(
+                "PRAGMA main.freelist_count").scalar()
+            if remaining == free:
+                break
+            released += free - remaining
+            free = remaining
+        return released
+
+
+def main():
+    from db import engine
+
+    parser = argparse.ArgumentParser(
+        description="Move old orders, reviews and page views to the archive")
+    parser.add_argument("cutoff", type=datetime.fromisoformat,
+                        help="rows older than this date are archived")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--archive", help="path of the archive database")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="switch the database to incremental vacuum "
+                        "first, this runs a full VACUUM once")
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum(engine)
+    attach_on_connect(engine, args.archive)
+    create_tables(engine)
+
+    for model in (Order, ProductReview, BlogView):
+        start = time.perf_counter()
+        moved = archive_rows(engine, model, args.cutoff, args.batch_size)
+        print(f"{model.__tablename__}: archived {moved} rows in "
+              f"{time.perf_counter() - start:.2f}s")
+
+    released = incremental_vacuum(engine)
+    if released is None:
+        print("The database does not use incremental vacuum, run with "
+              "--enable-incremental-vacuum to release the free space")
+    else:
+        print(f"Released {released} pages")
+
+
+if __name__ == "__main__":
+    main()
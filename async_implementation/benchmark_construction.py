@@ -0,0 +1,93 @@
+# Measures how many model objects per second can be created, with the
+# original init_relationships() listener that inspects the mapper on every
+# instantiation, with the current one that caches the relationships per
+# class, and with construct_many() that skips the listeners.
+#
+# Usage: python benchmark_construction.py [count]
+import asyncio
+import sys
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from db import Model, construct_many, init_relationships
+from models import BlogView, OrderItem
+
+
+def init_relationships_uncached(tgt, arg, kw):
+    # init_relationships() as it was before the cache was added.
+    mapper = inspect(tgt.__class__)
+    for arg in mapper.relationships:
+        if arg.collection_class is None and arg.uselist:
+            continue
+        if arg.key not in kw:
+            kw.setdefault(
+                arg.key, None if not arg.uselist else arg.collection_class())
+
+
+def rows(cls, count):
+    now = datetime.now()
+    session_id = uuid4()
+    if cls is BlogView:
+        return [{"article_id": i % 200 + 1, "sesion_id": session_id,
+                 "timestamp": now} for i in range(count)]
+    return [{"product_id": i % 100 + 1, "order_id": uuid4(),
+             "unit_price": 9.99, "quantity": 1} for i in range(count)]
+
+
+def measure(create, cls, data):
+    start = time.perf_counter()
+    objects = create(cls, data)
+    elapsed = time.perf_counter() - start
+    return len(objects) / elapsed
+
+
+def construct_with_init(cls, data):
+    return [cls(**row) for row in data]
+
+
+def construct_bulk(cls, data):
+    return list(construct_many(cls, data))
+
+
+async def check_flush(count):
+    """Makes sure that objects made by construct_many() are inserted."""
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(Model.metadata.create_all)
+    async with async_sessionmaker(engine)() as session:
+        session.add_all(construct_many(BlogView, rows(BlogView, count)))
+        await session.commit()
+        inserted = await session.scalar(select(func.count(BlogView.id)))
+    await engine.dispose()
+    return inserted
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    for cls in (BlogView, OrderItem):
+        data = rows(cls, count)
+        construct_with_init(cls, data[:10])  # configure the mappers
+
+        event.remove(Model, "init", init_relationships)
+        event.listen(Model, "init", init_relationships_uncached,
+                     propagate=True)
+        before = measure(construct_with_init, cls, data)
+        event.remove(Model, "init", init_relationships_uncached)
+        event.listen(Model, "init", init_relationships, propagate=True)
+
+        cached = measure(construct_with_init, cls, data)
+        bulk = measure(construct_bulk, cls, data)
+        print(f"{cls.__name__}: {before:,.0f} objects/s before, "
+              f"{cached:,.0f} with cached relationships, "
+              f"{bulk:,.0f} with construct_many()")
+
+    print(f"Inserted {asyncio.run(check_flush(1000))} of 1000 BlogView "
+          "objects made by construct_many()")
+
+
+if __name__ == "__main__":
+    main()
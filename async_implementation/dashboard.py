@@ -0,0 +1,195 @@
+"""Concurrent queries for dashboards.
+
+A dashboard shows many independent aggregates, such as the best selling
+manufacturers, the ratings by country and the page views per month. Run one
+after the other on one session, the page takes as long as all the queries
+together. `fan_out()` runs them at the same time instead, each on its own
+connection from the pool of the engine, so the page takes about as long as
+the slowest query:
+
+    panels = await fan_out({
+        "sales": select(Manufacturer.name, func.sum(...)).join(...),
+        "ratings": select(Country.name, func.avg(...)).join(...),
+    }, concurrency=4, timeout=2)
+    panels["sales"].rows
+
+Every query gets a `Panel` with its rows, its duration and, when it failed
+or took longer than its timeout, the error instead of the rows. One slow or
+failing panel does not fail the others. `report()` lists the panels from
+the slowest.
+
+`concurrency` limits the number of queries that run at the same time, and
+should not be larger than the pool of the engine. With SQLite each
+connection of aiosqlite runs in its own thread, and the queries run in
+parallel. A query that is still running at its timeout is interrupted
+with `sqlite3.Connection.interrupt()`, which frees its connection right
+away, instead of only no longer waiting for it.
+
+Running this file compares a dashboard run on one session with fan_out().
+
+Usage: python dashboard.py [--concurrency 4] [--runs 5]
+"""
+
+import argparse
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy.exc import OperationalError
+
+import db
+
+
+@dataclass
+class Panel:
+    rows: list | None
+    seconds: float
+    error: Exception | None = None
+
+
+def _interrupt(driver_connection, interrupted):
+    interrupted.append(True)
+    asyncio.ensure_future(driver_connection.interrupt())
+
+
+async def _query(engine, stmt, timeout):
+    async with engine.connect() as connection:
+        raw = await connection.get_raw_connection()
+        interrupted = []
+        timer = None
+        if hasattr(raw.driver_connection, "interrupt"):
+            timer = asyncio.get_running_loop().call_later(
+                timeout, _interrupt, raw.driver_connection, interrupted)
+            query = connection.execute(stmt)
+        else:
+            query = asyncio.wait_for(connection.execute(stmt), timeout)
+        try:
+            return (await query).all()
+        except OperationalError as error:
+            if interrupted:
+                raise TimeoutError(
+                    f"interrupted after {timeout} seconds") from error
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+
+async def fan_out(statements: dict[str, Any], engine=None, concurrency=4,
+                  timeout=10.0, timeouts=None) -> dict[str, Panel]:
+    """Runs the named statements concurrently, at most `concurrency` at a
+    time, and returns a `Panel` per name. `timeouts` sets the timeout in
+    seconds of some of the statements, the others get `timeout`."""
+    engine = engine or db.engine
+    timeouts = timeouts or {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(name, stmt):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                rows = await _query(engine, stmt,
+                                    timeouts.get(name, timeout))
+            except Exception as error:
+                return Panel(None, time.perf_counter() - start, error)
+            return Panel(rows, time.perf_counter() - start)
+
+    panels = await asyncio.gather(*(run(name, stmt)
+                                    for name, stmt in statements.items()))
+    return dict(zip(statements, panels))
+
+
+def report(panels):
+    """Returns a line per panel, from the slowest."""
+    lines = []
+    for name, panel in sorted(panels.items(), key=lambda p: -p[1].seconds):
+        result = (f"{len(panel.rows)} rows" if panel.error is None
+                  else f"failed: {panel.error}")
+        lines.append(f"{panel.seconds * 1000:>9.1f} ms  {name:<24}{result}")
+    return "\n".join(lines)
+
+
+def dashboard_statements():
+    """The statements of an example dashboard."""
+    from sqlalchemy import func, select
+
+    from models import (BlogArticle, BlogView, Country, Customer, Language,
+                        Manufacturer, Order, OrderItem, Product,
+                        ProductReview)
+
+    order_total = func.sum(OrderItem.quantity * OrderItem.unit_price)
+    avg_rating = func.avg(ProductReview.rating)
+    month = func.strftime("%Y-%m", BlogView.timestamp)
+    order_month = func.strftime("%Y-%m", Order.timestamp)
+    return {
+        "top_manufacturers": select(Manufacturer.name, order_total)
+        .join(Manufacturer.products).join(Product.order_items)
+        .group_by(Manufacturer.id).order_by(order_total.desc()).limit(10),
+        "top_products": select(Product.name, func.sum(OrderItem.quantity))
+        .join(Product.order_items).group_by(Product.id)
+        .order_by(func.sum(OrderItem.quantity).desc()).limit(10),
+        "top_customers": select(Customer.name, order_total)
+        .join(Customer.orders).join(Order.order_items)
+        .group_by(Customer.id).order_by(order_total.desc()).limit(10),
+        "monthly_sales": select(order_month, order_total)
+        .join(Order.order_items).group_by(order_month).order_by(order_month),
+        "rating_by_country": select(Country.name, avg_rating)
+        .join(Country.products).join(Product.reviews)
+        .group_by(Country.id).order_by(avg_rating.desc()),
+        "rating_by_manufacturer": select(Manufacturer.name, avg_rating)
+        .join(Manufacturer.products).join(Product.reviews)
+        .group_by(Manufacturer.id).order_by(avg_rating.desc()),
+        "best_rated_products": select(Product.name, avg_rating)
+        .join(Product.reviews).group_by(Product.id)
+        .having(func.count() >= 5).order_by(avg_rating.desc()).limit(10),
+        "monthly_views": select(month, func.count(BlogView.id))
+        .group_by(month).order_by(month),
+        "popular_articles": select(BlogArticle.title, func.count(BlogView.id))
+        .join(BlogArticle.views).group_by(BlogArticle.id)
+        .order_by(func.count(BlogView.id).desc()).limit(10),
+        "views_by_language": select(Language.name, func.count(BlogView.id))
+        .join(Language.blog_articles).join(BlogArticle.views)
+        .group_by(Language.id),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Compare a sequential dashboard with fan_out()")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    statements = dashboard_statements()
+
+    async def sequential():
+        async with db.Session() as session:
+            for stmt in statements.values():
+                (await session.execute(stmt)).all()
+
+    async def concurrent():
+        return await fan_out(statements, concurrency=args.concurrency)
+
+    await concurrent()  # open the connections of the pool
+    for name, run in (("One session", sequential),
+                      (f"fan_out(concurrency={args.concurrency})",
+                       concurrent)):
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            panels = await run()
+            times.append(time.perf_counter() - start)
+        print(f"{name}: {min(times) * 1000:.1f} ms "
+              f"(best of {args.runs})")
+    print(report(panels))
+
+    panels = await fan_out(statements, concurrency=args.concurrency,
+                           timeouts={"monthly_views": 0.001})
+    print("With a 1 ms timeout: monthly_views",
+          panels["monthly_views"].error)
+    await db.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
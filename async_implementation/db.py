@@ -1,7 +1,20 @@
+"""The database configuration, the engine and the sessions.
+
+Importing this module does not connect or read any configuration. The engine
+is created on the first use of `engine` or `Session`, from the configuration
+given to `configure()`, or from the DATABASE_URL environment variable (or
+.env file) if `configure()` is not called:
+
+    import db
+    db.configure(pragmas="bulk")
+    async with db.Session() as session:
+        ...
+"""
+
+import logging
 import os
-from dotenv import load_dotenv
 from sqlalchemy import MetaData, event, inspect
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
 
@@ -17,10 +30,107 @@ class Model(DeclarativeBase):
     )
 
 
-load_dotenv()
+# SQLite settings that are applied to every new connection, chosen with
+# configure(pragmas=...) or the SQLITE_PRAGMAS environment variable.
+PRAGMA_PROFILES = {
+    # The SQLite defaults.
+    "default": {},
+    # Readers and the writer do not block each other, and a commit does not
+    # wait for the data to reach the disk, only for the write-ahead log.
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "foreign_keys": "ON",
+        "busy_timeout": 5000,
+    },
+    # For the importers: the fastest writes, but the database may be
+    # corrupted if the computer crashes during the import.
+    "bulk": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "temp_store": "MEMORY",
+        "cache_size": -64000,
+    },
+}
+
+logger = logging.getLogger(__name__)
+
+_config = {}
+_engine = None
+_profiler = None
+
+
+def configure(url=None, pragmas=None, **engine_options):
+    """Sets the database URL, the PRAGMA profile and the options passed to
+    create_async_engine(), such as echo or pool_size.
+
+    If the engine is already in use it is disposed of without waiting for
+    its connections, and a new engine with the new configuration is created
+    on the next use. Call `await engine.dispose()` first to close the
+    connections cleanly.
+    """
+    global _engine
+    _config.clear()
+    _config.update(url=url, pragmas=pragmas, engine_options=engine_options)
+    if _engine is not None:
+        _engine.sync_engine.dispose(close=False)
+        _engine = None
+
+
+def get_engine():
+    """Returns the engine, creating it on the first call."""
+    global _engine, _profiler
+    if _engine is not None:
+        return _engine
+
+    from dotenv import load_dotenv
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from profiler import StatementProfiler
+
+    load_dotenv()
+    url = _config.get("url") or os.environ["DATABASE_URL"]
+    engine = create_async_engine(url, **_config.get("engine_options", {}))
+    # The URL of the engine is shown without the password.
+    logger.info("Database URL: %r", engine.url)
+
+    pragmas = PRAGMA_PROFILES[
+        _config.get("pragmas") or os.environ.get("SQLITE_PRAGMAS", "default")]
+    if pragmas:
+        @event.listens_for(engine.sync_engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            cursor.close()
+
+    # Timings per SQL statement, see profiler.py. Enabled from the start if
+    # SQL_PROFILE is set, or at any time with profiler.enable().
+    if _profiler is None:
+        _profiler = StatementProfiler(
+            engine, enabled=bool(os.environ.get("SQL_PROFILE")))
+    else:
+        # After configure(), `db.profiler` stays the same object.
+        _profiler.attach(engine)
+    Session.configure(bind=engine)
+    _engine = engine
+    return engine
+
 
-engine = create_async_engine(os.environ["DATABASE_URL"])
-Session = async_sessionmaker(engine, expire_on_commit=False)
+class _LazySessionmaker(async_sessionmaker):
+    """An async_sessionmaker that creates the engine when the first session
+    is made."""
+
+    def __call__(self, **local_kw):
+        get_engine()
+        return super().__call__(**local_kw)
+
+    def begin(self):
+        get_engine()
+        return super().begin()
+
+
+Session = _LazySessionmaker(expire_on_commit=False)
 """Setting expire_on_commit to False disables a default SQLAlchemy
 behavior that marks models as expired after the session is committed.
 Models that are marked as expired are implicitly refreshed from a
@@ -30,6 +140,36 @@ expired objects should not be used.
 """
 
 
+def __getattr__(name):
+    # `db.engine` and `db.profiler` are created on first use.
+    if name == "engine":
+        return get_engine()
+    if name == "profiler":
+        get_engine()
+        return _profiler
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# The relationships to initialize for each model class, as (key, collection
+# class) pairs with None as the collection class of scalar relationships.
+# Computed on the first instantiation of each class by
+# relationship_defaults().
+_relationship_defaults = {}
+
+
+def relationship_defaults(cls):
+    defaults = _relationship_defaults.get(cls)
+    if defaults is None:
+        defaults = []
+        for rel in inspect(cls).relationships:
+            if rel.collection_class is None and rel.uselist:
+                continue  # skip write-only and similar relationships
+            defaults.append(
+                (rel.key, rel.collection_class if rel.uselist else None))
+        defaults = _relationship_defaults[cls] = tuple(defaults)
+    return defaults
+
+
 @event.listens_for(Model, "init", propagate=True)
 def init_relationships(tgt, arg, kw):
     """This event listener triggers when a new Model is instantiated.
@@ -38,11 +178,36 @@ def init_relationships(tgt, arg, kw):
     in asynchronous context) in the case the object has a list style
     relationship that has not been initialized, the session is flushed,
     after which the list style attribute is accessed.
+
+    The relationships of a class are only looked up on the mapper the
+    first time the class is instantiated, see relationship_defaults().
+    """
+    for key, collection_class in relationship_defaults(tgt.__class__):
+        if key not in kw:
+            kw[key] = None if collection_class is None else collection_class()
+
+
+def construct(cls, **kw):
+    """Creates a model instance for a bulk import, without running the
+    constructor and the init listeners.
+
+    The attributes in `kw` are set as with the constructor, but the
+    relationships that are not given are not initialized, so they must not
+    be accessed after the object has been flushed. This is meant for
+    importers that create many objects and only add them to the session.
     """
-    mapper = inspect(tgt.__class__)
-    for arg in mapper.relationships:
-        if arg.collection_class is None and arg.uselist:
-            continue  # skip write-only and similar relationships
-        if arg.key not in kw:
-            kw.setdefault(
-                arg.key, None if not arg.uselist else arg.collection_class())
+    obj = cls._sa_class_manager.new_instance()
+    for key, value in kw.items():
+        setattr(obj, key, value)
+    return obj
+
+
+def construct_many(cls, rows):
+    """Yields model instances for a bulk import, created with `construct()`
+    from dicts of attribute values."""
+    new_instance = cls._sa_class_manager.new_instance
+    for row in rows:
+        obj = new_instance()
+        for key, value in row.items():
+            setattr(obj, key, value)
+        yield obj
@@ -3,7 +3,7 @@ import csv
 from datetime import datetime
 from pathlib import Path
 from sqlalchemy import select, delete
-from db import Session
+from db import Session, configure
 from models import BlogArticle, BlogAuthor, Product, BlogView, BlogSession, BlogUser
 
 
@@ -54,4 +54,5 @@ async def main():
 
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     asyncio.run(main())
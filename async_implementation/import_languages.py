@@ -2,7 +2,7 @@ import asyncio
 import csv
 from sqlalchemy import select
 from pathlib import Path
-from db import Session
+from db import Session, configure
 from models import BlogArticle, Language
 
 
@@ -54,4 +54,5 @@ async def main():
 
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     asyncio.run(main())
@@ -4,7 +4,7 @@ import csv
 
 from sqlalchemy import delete
 
-from db import Session
+from db import Session, configure
 from models import Country, Manufacturer, Product, ProductCountry
 
 
@@ -46,4 +46,5 @@ async def main():
 
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     asyncio.run(main())
@@ -5,7 +5,7 @@ from pathlib import Path
 
 from sqlalchemy import delete, select
 
-from db import Session
+from db import Session, configure
 from models import Customer, Product, ProductReview
 
 
@@ -40,4 +40,5 @@ async def main():
 
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     asyncio.run(main())
@@ -4,7 +4,7 @@ import sys
 from datetime import datetime
 from uuid import UUID
 from sqlalchemy import select, delete
-from db import Session
+from db import Session, configure, construct
 from models import BlogArticle, BlogUser, BlogView, BlogSession, Customer
 
 
@@ -62,7 +62,9 @@ async def main():
                     sys.exit(1)
                 all_articles[article.title] = article
 
-                view = BlogView(
+                # Views are only added, so they can skip the init listeners.
+                view = construct(
+                    BlogView,
                     article=article,
                     session=blog_session,
                     timestamp=datetime.strptime(
@@ -79,4 +81,5 @@ async def main():
 
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     asyncio.run(main())
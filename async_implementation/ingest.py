@@ -0,0 +1,315 @@
+"""Batched ingestion of page views.
+
+Storing every page view with its own session and commit costs one
+transaction, and with SQLite one sync of the file to disk, per view. The
+`ViewIngester` instead collects the views recorded by any number of
+coroutines in a queue, and a single writer task stores them in batches:
+every batch is one transaction with one multi-row INSERT per table.
+
+A batch is written when it has `max_batch` views, or when the oldest view
+in it has waited `max_delay` seconds, whichever comes first. When the
+writer cannot keep up, the queue fills up to `max_queue` views and
+`record()` waits for room in the queue, which slows the producers down to
+the rate the database can sustain (backpressure) instead of using more and
+more memory.
+
+    ingester = ViewIngester()
+    await ingester.start()
+    await ingester.record(article_id, session_id, user_id)
+    ...
+    failed = await ingester.stop()  # writes the views still in the queue
+    print(ingester.metrics.report())
+
+A batch that fails is retried `retries` times with a growing delay, for
+errors that pass, such as a locked database. The views of a batch that
+still fails are kept in `failed_views` and returned by `stop()`, so the
+caller can store them later. If the writer task itself dies, `record()` and
+`stop()` raise its exception instead of waiting for it.
+
+Users and sessions are created the first time they are seen, with INSERT OR
+IGNORE, so the caller does not have to create them.
+
+Running this file starts a load generator against a scratch database and
+prints the throughput and latencies it sustains.
+
+Usage: python ingest.py [--producers 50] [--events 100000]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+import db
+from models import BlogSession, BlogUser, BlogView
+
+
+class Metrics:
+    def __init__(self, samples=10000):
+        self.started = time.perf_counter()
+        self.events = 0
+        self.batches = 0
+        self.failed = 0
+        self.retries = 0
+        self.max_batch = 0
+        # The number of times record() had to wait for room in the queue.
+        self.backpressure_waits = 0
+        self.last_error = None
+        # Latest latencies in seconds: from record() to the commit of the
+        # view, and the duration of the batch writes.
+        self.latencies = deque(maxlen=samples)
+        self.write_times = deque(maxlen=samples)
+
+    @property
+    def throughput(self):
+        return self.events / (time.perf_counter() - self.started)
+
+    @staticmethod
+    def _percentiles(values):
+        if len(values) < 2:
+            return [values[0] if values else 0.0] * 3
+        q = statistics.quantiles(values, n=100)
+        return [q[49], q[94], q[98]]
+
+    def report(self):
+        p50, p95, p99 = (t * 1000 for t in self._percentiles(self.latencies))
+        write = statistics.mean(self.write_times) * 1000 \
+            if self.write_times else 0.0
+        mean_batch = self.events / self.batches if self.batches else 0
+        return (f"{self.events} views in {self.batches} batches "
+                f"(mean {mean_batch:.0f}, max {self.max_batch}), "
+                f"{self.throughput:,.0f} views/s, {self.failed} failed, "
+                f"{self.retries} retries, "
+                f"{self.backpressure_waits} backpressure waits\n"
+                f"latency p50 {p50:.1f} ms, p95 {p95:.1f} ms, "
+                f"p99 {p99:.1f} ms, mean batch write {write:.1f} ms"
+                + (f"\nlast error: {self.last_error}" if self.last_error
+                   else ""))
+
+
+class ViewIngester:
+    def __init__(self, engine=None, max_batch=1000, max_delay=0.05,
+                 max_queue=20000, retries=3, retry_delay=0.1):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = asyncio.Queue(max_queue)
+        self.metrics = Metrics()
+        # The views of the batches that could not be stored.
+        self.failed_views = []
+        self._writer = None
+
+    async def start(self):
+        if self.engine is None:
+            self.engine = db.engine
+        self.metrics = Metrics()
+        self.failed_views = []
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Writes the views that are in the queue, stops the writer and
+        returns the views that could not be stored. Raises the exception of
+        the writer if it has died."""
+        self._check_writer()
+        joined = asyncio.ensure_future(self.queue.join())
+        await asyncio.wait((joined, self._writer),
+                           return_when=asyncio.FIRST_COMPLETED)
+        if self._writer.done():
+            joined.cancel()
+            # The writer only ends by an exception.
+            self._writer.result()
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer = None
+        return self.failed_views
+
+    async def record(self, article_id, session_id, user_id, customer_id=None,
+                     timestamp=None, wait=False):
+        """Queues a page view. With `wait` the call returns when the view has
+        been committed, and raises if it could not be stored."""
+        self._check_writer()
+        view = {
+            "article_id": article_id,
+            "sesion_id": session_id,
+            "user_id": user_id,
+            "customer_id": customer_id,
+            "timestamp": timestamp or datetime.now(timezone.utc),
+        }
+        done = asyncio.get_running_loop().create_future() if wait else None
+        item = (view, time.perf_counter(), done)
+        if self.queue.full():
+            self.metrics.backpressure_waits += 1
+        await self.queue.put(item)
+        if done is not None:
+            await done
+
+    def _check_writer(self):
+        if self._writer is None:
+            raise RuntimeError("ingester not started")
+        if self._writer.done():
+            # Nothing would take the views from the queue.
+            self._writer.result()
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = batch[0][1] + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(),
+                                                    timeout))
+            except TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            views = [view for view, _, _ in batch]
+            start = time.perf_counter()
+            error = await self._write_batch(views)
+            if error is not None:
+                self.metrics.failed += len(batch)
+                self.metrics.last_error = error
+                self.failed_views.extend(views)
+            committed = time.perf_counter()
+
+            self.metrics.write_times.append(committed - start)
+            if error is None:
+                self.metrics.events += len(batch)
+                self.metrics.batches += 1
+                self.metrics.max_batch = max(self.metrics.max_batch,
+                                             len(batch))
+            for _, queued, done in batch:
+                self.metrics.latencies.append(committed - queued)
+                if done is not None and not done.done():
+                    if error is None:
+                        done.set_result(None)
+                    else:
+                        done.set_exception(error)
+                self.queue.task_done()
+
+    async def _write_batch(self, views):
+        """Writes a batch, and retries it with a doubling delay when it
+        fails. Returns the error of the last attempt, None on success."""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.metrics.retries += 1
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                await self._write(views)
+                return None
+            except Exception as e:
+                error = e
+        return error
+
+    async def _write(self, views):
+        users = {v["user_id"]: {"id": v["user_id"],
+                                "customer_id": v["customer_id"]}
+                 for v in views}
+        sessions = {v["sesion_id"]: {"id": v["sesion_id"],
+                                     "user_id": v["user_id"]}
+                    for v in views}
+        async with self.engine.begin() as connection:
+            await connection.execute(
+                insert(BlogUser).prefix_with("OR IGNORE"),
+                list(users.values()))
+            await connection.execute(
+                insert(BlogSession).prefix_with("OR IGNORE"),
+                list(sessions.values()))
+            await connection.execute(insert(BlogView), [
+                {"article_id": v["article_id"], "sesion_id": v["sesion_id"],
+                 "timestamp": v["timestamp"]} for v in views])
+
+
+async def load_generator(ingester, producers, events, articles=200,
+                         users=5000):
+    """Records `events` random page views from `producers` concurrent
+    coroutines, as fast as the ingester accepts them."""
+    import random
+    from uuid import uuid4
+
+    user_sessions = [(uuid4(), uuid4()) for _ in range(users)]
+
+    async def produce(count):
+        for _ in range(count):
+            user_id, session_id = random.choice(user_sessions)
+            await ingester.record(random.randint(1, articles), session_id,
+                                  user_id)
+
+    per_producer = events // producers
+    await asyncio.gather(*(produce(per_producer) for _ in range(producers)))
+    return per_producer * producers
+
+
+async def main():
+    from pathlib import Path
+
+    from sqlalchemy import select
+
+    from db import Model, construct
+    from models import BlogArticle, BlogAuthor
+
+    parser = argparse.ArgumentParser(
+        description="Measure the page view ingestion rate")
+    parser.add_argument("--producers", type=int, default=50)
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--max-batch", type=int, default=1000)
+    parser.add_argument("--max-delay", type=float, default=0.05)
+    parser.add_argument("--database", default="ingest_benchmark.sqlite",
+                        help="scratch database, it is deleted first")
+    args = parser.parse_args()
+
+    Path(args.database).unlink(missing_ok=True)
+    db.configure(url=f"sqlite+aiosqlite:///{args.database}", pragmas="wal")
+    async with db.engine.begin() as connection:
+        await connection.run_sync(Model.metadata.create_all)
+        await connection.execute(insert(BlogAuthor.__table__),
+                                 [{"id": 1, "name": "Load Generator"}])
+        await connection.execute(insert(BlogArticle.__table__), [
+            {"id": i, "title": f"Article {i}", "author_id": 1,
+             "timestamp": datetime.now(timezone.utc)}
+            for i in range(1, 201)])
+
+    ingester = ViewIngester(max_batch=args.max_batch,
+                            max_delay=args.max_delay)
+    await ingester.start()
+    sent = await load_generator(ingester, args.producers, args.events)
+    failed = await ingester.stop()
+    print(f"Sent {sent} views from {args.producers} producers, "
+          f"{len(failed)} could not be stored")
+    print(ingester.metrics.report())
+
+    # For comparison, one session and transaction per view.
+    async with db.Session() as session:
+        session_id = await session.scalar(select(BlogSession.id).limit(1))
+    count = 500
+    start = time.perf_counter()
+    for _ in range(count):
+        async with db.Session.begin() as session:
+            session.add(construct(BlogView, article_id=1,
+                                  sesion_id=session_id,
+                                  timestamp=datetime.now(timezone.utc)))
+    elapsed = time.perf_counter() - start
+    print(f"One transaction per view: {count / elapsed:,.0f} views/s")
+    await db.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
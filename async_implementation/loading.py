@@ -0,0 +1,245 @@
+"""Named loading profiles for the common ways the models are used.
+
+How related objects are loaded is decided in models.py once for all
+queries: the sync models lazy load everything, which costs one query per
+row when the relationships are used, and the async models always join or
+select the relationships in, which costs a join and extra queries even when
+only the name of a product is needed.
+
+A *profile* instead describes what a use case needs, and is applied per
+query:
+
+- "list", a list of names or titles: only the shown columns, and the
+  names of the many-to-one objects joined in,
+- "detail", one or a few objects shown with everything related,
+- "export", all columns of many objects, with the collections loaded with
+  one extra query each.
+
+Everything that is not in the profile is set to `raiseload()`, so a use
+case that needs more than its profile fails loudly instead of loading
+lazily.
+
+    q = select(Product).options(*profile(Product, "list"))
+    products = (await session.scalars(q)).unique().all()
+
+The profiles are written with attribute names instead of the model
+attributes, so this file works with both the sync and the async models.
+
+Running this file compares the number of database round trips and rows
+fetched for each profile with the default loading of the models.
+"""
+
+import asyncio
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import joinedload, load_only, raiseload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+# For each model a spec with:
+#   "columns": the columns to load, all of them when not given,
+#   "joined": relationships to load with a join, with their own spec,
+#   "selectin": relationships to load with a second query, with their spec.
+PROFILES = {
+    "list": {
+        "Product": {"columns": ["name", "year"],
+                    "joined": {"manufacturer": {"columns": ["name"]}}},
+        "Order": {"columns": ["timestamp", "total", "item_count"],
+                  "joined": {"customer": {"columns": ["name"]}}},
+        "BlogArticle": {"columns": ["title", "timestamp"],
+                        "joined": {"author": {"columns": ["name"]},
+                                   "language": {}}},
+    },
+    "detail": {
+        "Product": {"joined": {"manufacturer": {}},
+                    "selectin": {"countries": {}}},
+        "Order": {"joined": {"customer": {}},
+                  "selectin": {"order_items": {
+                      "joined": {"product": {"columns": ["name"]}}}}},
+        "BlogArticle": {"joined": {"author": {}, "language": {},
+                                   "product": {"columns": ["name"]},
+                                   "translation_of": {"columns": ["title"]}},
+                        "selectin": {"translations": {
+                            "columns": ["title", "language_id"]}}},
+    },
+    "export": {
+        "Product": {"joined": {"manufacturer": {"columns": ["name"]}},
+                    "selectin": {"countries": {"columns": ["name"]}}},
+        "Order": {"joined": {"customer": {}},
+                  "selectin": {"order_items": {}}},
+        "BlogArticle": {"joined": {"author": {"columns": ["name"]},
+                                   "language": {"columns": ["name"]}}},
+    },
+}
+
+
+def _options(model, spec):
+    """Returns the loader options of `spec`, relative to `model`."""
+    options = []
+    if "columns" in spec:
+        options.append(load_only(
+            *[getattr(model, name) for name in spec["columns"]]))
+    for strategy, loader in (("joined", joinedload),
+                             ("selectin", selectinload)):
+        for name, related_spec in spec.get(strategy, {}).items():
+            attribute = getattr(model, name)
+            related = attribute.property.mapper.class_
+            options.append(loader(attribute).options(
+                *_options(related, related_spec)))
+    options.append(raiseload("*"))
+    return options
+
+
+def profile(model, name):
+    """Returns the loader options of the profile `name` for `model`."""
+    try:
+        spec = PROFILES[name][model.__name__]
+    except KeyError:
+        raise ValueError(f"No {name!r} profile for {model.__name__}")
+    return _options(model, spec)
+
+
+def with_profile(stmt, name):
+    """Applies the profile `name` to a select() of a model."""
+    model = stmt.column_descriptions[0]["entity"]
+    return stmt.options(*profile(model, name))
+
+
+async def load_totals(session, orders):
+    """Loads the deferred `total` and `item_count` of the orders that do not
+    have them yet, with one query for all of them. Returns `orders`, so it
+    can wrap a query:
+
+        orders = await load_totals(session, (await session.scalars(q)).all())
+    """
+    missing = {order.id: order for order in orders
+               if {"total", "item_count"} & inspect(order).unloaded}
+    if missing:
+        Order = type(next(iter(missing.values())))
+        for id, total, item_count in await session.execute(
+                select(Order.id, Order.total, Order.item_count)
+                .where(Order.id.in_(missing))):
+            set_committed_value(missing[id], "total", total)
+            set_committed_value(missing[id], "item_count", item_count)
+    return orders
+
+
+class RoundTrips:
+    """Counts the statements sent to `engine` and the rows they return.
+
+    SQLite does not tell how many rows a SELECT returns, so each statement
+    is run again afterwards as `SELECT count(*) FROM (...)` to count them.
+    """
+
+    def __init__(self, engine):
+        self.engine = getattr(engine, "sync_engine", engine)
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    async def rows(self, engine):
+        rows = 0
+        async with engine.connect() as connection:
+            for statement, parameters in self.statements:
+                rows += (await connection.exec_driver_sql(
+                    f"SELECT count(*) FROM ({statement})", parameters
+                )).scalar()
+        return rows
+
+
+# What each use case reads from the objects in the benchmark.
+USES = {
+    "Product": {
+        "list": lambda p: (p.name, p.year, p.manufacturer.name),
+        "detail": lambda p: (p.name, p.cpu, p.manufacturer.name,
+                             [c.name for c in p.countries]),
+        "export": lambda p: (p.name, p.year, p.cpu, p.manufacturer.name,
+                             [c.name for c in p.countries]),
+    },
+    "Order": {
+        "list": lambda o: (o.timestamp, o.customer.name),
+        "detail": lambda o: (o.customer.address,
+                             [(i.product.name, i.quantity)
+                              for i in o.order_items]),
+        "export": lambda o: (o.customer.name, [(i.product_id, i.unit_price)
+                                               for i in o.order_items]),
+    },
+}
+
+
+async def main():
+    import time
+
+    from sqlalchemy.orm import undefer
+
+    from db import Session, engine
+    from models import Order, Product
+
+    queries = {
+        "Product": select(Product).order_by(Product.name),
+        "Order": select(Order).order_by(Order.timestamp).limit(500),
+    }
+    print(f"{'':<18}{'default':>16}{'profile':>16}")
+    print(f"{'':<18}{'trips':>8}{'rows':>8}{'trips':>8}{'rows':>8}")
+    for model_name, q in queries.items():
+        for name, use in USES[model_name].items():
+            results = []
+            for stmt in (q, with_profile(q, name)):
+                async with Session() as session:
+                    with RoundTrips(engine) as trips:
+                        for obj in (await session.scalars(stmt)).unique():
+                            use(obj)
+                results += [len(trips.statements), await trips.rows(engine)]
+            print(f"{model_name + ' ' + name:<18}"
+                  + "".join(f"{n:>8}" for n in results))
+
+    # The totals of orders: computed in Python from the order items, loaded
+    # with the orders, or loaded for the list with load_totals().
+    q = select(Order).order_by(Order.timestamp).limit(1000)
+
+    async def in_python(session):
+        return [(sum(i.unit_price * i.quantity for i in o.order_items),
+                 sum(i.quantity for i in o.order_items))
+                for o in (await session.scalars(q)).unique()]
+
+    # The models load the items of the orders eagerly, which is not needed
+    # when the totals are loaded.
+    no_items = q.options(raiseload("*"))
+
+    async def undeferred(session):
+        return [(o.total, o.item_count) for o in (await session.scalars(
+            no_items.options(undefer(Order.total), undefer(Order.item_count))
+        )).unique()]
+
+    async def batched(session):
+        orders = (await session.scalars(no_items)).unique().all()
+        return [(o.total, o.item_count)
+                for o in await load_totals(session, orders)]
+
+    print("Totals of 1000 orders")
+    expected = None
+    for name, run in (("in Python", in_python), ("undefer()", undeferred),
+                      ("load_totals()", batched)):
+        async with Session() as session:
+            with RoundTrips(engine) as trips:
+                start = time.perf_counter()
+                totals = [(round(total, 6), count)
+                          for total, count in await run(session)]
+                elapsed = time.perf_counter() - start
+        expected = expected or totals
+        print(f"{name:<18}{len(trips.statements):>8} trips"
+              f"{elapsed * 1000:>9.1f} ms"
+              f"{'' if totals == expected else '  DIFFERENT TOTALS'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
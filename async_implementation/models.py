@@ -2,8 +2,9 @@ from datetime import datetime, timezone
 from typing import Optional
 from uuid import UUID, uuid4
 
-from sqlalchemy import Column, ForeignKey, String, Table, Text
-from sqlalchemy.orm import Mapped, WriteOnlyMapped, mapped_column, relationship
+from sqlalchemy import Column, ForeignKey, String, Table, Text, func, select
+from sqlalchemy.orm import (Mapped, WriteOnlyMapped, column_property,
+                            mapped_column, relationship)
 
 from db import Model
 
@@ -130,8 +131,10 @@ class OrderItem(Model):
 
     product_id: Mapped[int] = mapped_column(
         ForeignKey("products.id"), primary_key=True)
+    # The primary key starts with product_id, so finding the items of an
+    # order needs its own index.
     order_id: Mapped[UUID] = mapped_column(
-        ForeignKey("orders.id"), primary_key=True)
+        ForeignKey("orders.id"), primary_key=True, index=True)
 
     product: Mapped["Product"] = relationship(
         lazy="joined", innerjoin=True, back_populates="order_items"
@@ -144,6 +147,23 @@ class OrderItem(Model):
     quantity: Mapped[int]
 
 
+# Deferred, and not loaded lazily with asyncio: name them in `undefer()` or
+# `load_only()`, or use `load_totals()` from loading.py.
+Order.total = column_property(
+    select(func.coalesce(func.sum(OrderItem.unit_price * OrderItem.quantity),
+                         0.0))
+    .where(OrderItem.order_id == Order.id)
+    .correlate_except(OrderItem)
+    .scalar_subquery(),
+    deferred=True)
+Order.item_count = column_property(
+    select(func.coalesce(func.sum(OrderItem.quantity), 0))
+    .where(OrderItem.order_id == Order.id)
+    .correlate_except(OrderItem)
+    .scalar_subquery(),
+    deferred=True)
+
+
 class ProductReview(Model):
     __tablename__ = "product_reviews"
 
@@ -0,0 +1,221 @@
+"""Profiling of the SQL statements sent to the database.
+
+`echo=True` logs every statement, which is too much output to find the slow
+ones and too slow to leave on. `StatementProfiler` instead keeps, for every
+statement *shape*, the number of calls, the total and maximum time, a
+latency histogram and the number of affected rows:
+
+    profiler = StatementProfiler(engine)   # an AsyncEngine or an Engine
+    profiler.enable()
+    ...
+    print(profiler.report(10))
+
+The shape of a statement is its SQL with the literal values replaced by `?`,
+and with lists of parameters such as `IN (?, ?, ?)` reduced to `IN (?...)`,
+so the same query with different values is counted as one statement.
+
+The profiler is hooked into the engine with the `before_cursor_execute`
+and `after_cursor_execute` events, for an async engine on its synchronous
+engine, where the events are sent. The events are only registered while the
+profiler is enabled, so a disabled profiler costs nothing, and an enabled
+one costs two timer calls, a dict lookup and a few additions per statement.
+`db.py` has a profiler for its engine, enabled when the `SQL_PROFILE`
+environment variable is set.
+
+SQLite does not report the number of rows returned by a SELECT, so the row
+counts are for INSERT, UPDATE and DELETE statements only.
+"""
+
+import asyncio
+import re
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+
+# Upper bounds of the histogram buckets in milliseconds, the last bucket
+# counts everything slower than 1 s.
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def normalise(statement):
+    """Returns the shape of a SQL statement."""
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _LIST.sub("(?...)", statement)
+    return _SPACE.sub(" ", statement).strip()
+
+
+@dataclass
+class StatementStats:
+    shape: str
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    rows: int = 0
+    histogram: list[int] = field(
+        default_factory=lambda: [0] * (len(BUCKETS) + 1))
+
+    @property
+    def mean(self):
+        return self.total / self.calls if self.calls else 0.0
+
+    def percentile(self, p):
+        """Returns the upper bound of the histogram bucket of the `p`
+        percentile in milliseconds, inf for the slowest bucket."""
+        rank = p / 100 * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.histogram):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class StatementProfiler:
+    def __init__(self, engine, enabled=False, max_shapes=1000):
+        self.engine = getattr(engine, "sync_engine", engine)
+        self.max_shapes = max_shapes
+        self.stats = {}
+        # Statement text to shape, so each distinct text is only
+        # normalised once.
+        self._shapes = {}
+        self._lock = threading.Lock()
+        self.enabled = False
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        if not self.enabled:
+            event.listen(self.engine, "before_cursor_execute", self._before)
+            event.listen(self.engine, "after_cursor_execute", self._after)
+            event.listen(self.engine, "handle_error", self._error)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            event.remove(self.engine, "before_cursor_execute", self._before)
+            event.remove(self.engine, "after_cursor_execute", self._after)
+            event.remove(self.engine, "handle_error", self._error)
+            self.enabled = False
+
+    def attach(self, engine):
+        """Profiles the statements of `engine` instead of the current
+        engine, keeping the stats and the enabled state."""
+        enabled = self.enabled
+        self.disable()
+        self.engine = getattr(engine, "sync_engine", engine)
+        if enabled:
+            self.enable()
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        conn.info.setdefault("profiler_start", []).append(
+            time.perf_counter())
+
+    def _error(self, context):
+        # A failed statement has no after_cursor_execute event.
+        if context.connection is not None:
+            starts = context.connection.info.get("profiler_start")
+            if starts:
+                starts.pop()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        starts = conn.info.get("profiler_start")
+        if not starts:
+            # The statement was started before the profiler was enabled.
+            return
+        elapsed = (time.perf_counter() - starts.pop()) * 1000
+        shape = self._shapes.get(statement)
+        if shape is None:
+            shape = normalise(statement)
+            if len(self._shapes) < self.max_shapes * 10:
+                self._shapes[statement] = shape
+        with self._lock:
+            stats = self.stats.get(shape)
+            if stats is None:
+                if len(self.stats) >= self.max_shapes:
+                    return
+                stats = self.stats[shape] = StatementStats(shape)
+            stats.calls += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            if cursor.rowcount > 0:
+                stats.rows += cursor.rowcount
+            stats.histogram[bisect_left(BUCKETS, elapsed)] += 1
+
+    def top(self, n=10, by="total"):
+        """Returns the stats of the `n` statements with the highest `by`,
+        one of "total", "mean", "max", "calls" or "rows"."""
+        with self._lock:
+            stats = list(self.stats.values())
+        return sorted(stats, key=lambda s: getattr(s, by), reverse=True)[:n]
+
+    def report(self, n=10, by="total"):
+        """Returns the `top()` statements as a printable table. Times are in
+        milliseconds, p50 and p95 are histogram bucket bounds."""
+        lines = [f"{'calls':>7} {'total':>9} {'mean':>8} {'p50':>6} "
+                 f"{'p95':>6} {'max':>8} {'rows':>7}  statement"]
+        for s in self.top(n, by):
+            shape = s.shape if len(s.shape) <= 80 else s.shape[:77] + "..."
+            lines.append(
+                f"{s.calls:>7} {s.total:>9.2f} {s.mean:>8.3f} "
+                f"{s.percentile(50):>6} {s.percentile(95):>6} "
+                f"{s.max:>8.3f} {s.rows:>7}  {shape}")
+        return "\n".join(lines)
+
+
+async def main():
+    from datetime import datetime
+
+    from sqlalchemy import func, select
+
+    from db import Session, engine, profiler
+    from models import BlogArticle, BlogView, Order, Product
+
+    profiler.enable()
+    async with Session() as session:
+        orders = (await session.scalars(select(Order).limit(200))).all()
+        for order in orders:
+            await session.refresh(order, ["order_items"])
+        await session.scalars(select(Product))
+        view_count = func.count(BlogView.id).label(None)
+        await session.execute(
+            select(BlogArticle, view_count)
+            .join(BlogArticle.views)
+            .where(BlogView.timestamp.between(datetime(2020, 3, 1),
+                                              datetime(2020, 4, 1)))
+            .group_by(BlogArticle))
+    print("Slowest in total:")
+    print(profiler.report(5))
+    print("\nMost frequent:")
+    print(profiler.report(5, by="calls"))
+
+    # The overhead of the profiler on a trivial query.
+    for enabled in (False, True):
+        profiler.enable() if enabled else profiler.disable()
+        async with engine.connect() as connection:
+            start = time.perf_counter()
+            for _ in range(10000):
+                (await connection.exec_driver_sql("SELECT 1")).all()
+            elapsed = time.perf_counter() - start
+        print(f"\n10000 x SELECT 1, profiler "
+              f"{'enabled' if enabled else 'disabled'}: {elapsed:.3f}s",
+              end="")
+    print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
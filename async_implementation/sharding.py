@@ -0,0 +1,359 @@
+"""Hash sharded storage of the blog users, sessions and page views.
+
+SQLite allows a single writer per database file, so the rate of page views
+that can be stored is limited by how fast one file can be written. In the
+sharded mode the `blog_users`, `blog_sessions` and `blog_views` rows are
+spread over several SQLite files instead, the *shards*, each with its own
+engine and its own writer.
+
+A user is assigned to a shard by a hash of the user id, and the sessions and
+page views of the user are stored in the same shard, so one user never spans
+two files. The catalog tables, such as `blog_articles` and `languages`, stay
+in the primary database (the one in `DATABASE_URL`).
+
+The page view reports cannot be computed by one query any more. They are
+computed as *partial aggregates* on every shard, for example the number of
+views per article, and the partial results are merged in Python by summing
+the counts. The filters that depend on the totals, such as "more than 40
+views", are applied after the merge. Anything that needs the catalog, such
+as the language of an article, is looked up in the primary database.
+
+Every shard has its own async engine and session maker, and the queries of
+a fan-out run on all shards concurrently.
+
+Example:
+
+    store = ShardedBlogStore.from_engine(engine, 4)
+    await store.create_all()
+    await store.add_views(views)
+    async with Session() as session:
+        await store.views_by_language(session, datetime(2022, 3, 1),
+                                      datetime(2022, 4, 1))
+
+Running this file copies the blog users, sessions and views of the primary
+database to the shards and compares the reports of `exercises5.md` computed
+from the shards with the ones computed from the primary database.
+
+Usage: python sharding.py [--shards 4] [--move]
+"""
+
+import argparse
+import asyncio
+import hashlib
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from uuid import UUID
+
+from sqlalchemy import (Column, ForeignKey, MetaData, Table, delete, func,
+                        insert, select)
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from models import BlogArticle, BlogSession, BlogUser, BlogView, Language
+
+SHARDED = (BlogUser, BlogSession, BlogView)
+
+# The shard tables have the same columns as the primary tables. Only the
+# foreign keys between the sharded tables are kept, since the catalog tables
+# and the customers are not in the shards.
+metadata = MetaData()
+
+
+def _shard_table(table):
+    columns = []
+    for c in table.columns:
+        fks = [ForeignKey(fk.target_fullname) for fk in c.foreign_keys
+               if fk.column.table in {m.__table__ for m in SHARDED}]
+        columns.append(Column(c.name, c.type, *fks,
+                              primary_key=c.primary_key,
+                              nullable=c.nullable, index=c.index))
+    return Table(table.name, metadata, *columns)
+
+
+for _model in SHARDED:
+    _shard_table(_model.__table__)
+
+
+def shard_for(user_id: UUID, shard_count: int) -> int:
+    """Returns the shard number of a user.
+
+    The id is hashed, instead of using the UUID as a number, so that users
+    are spread evenly even if the ids are not random, like UUID1 ids where
+    the lowest bits are the same for all ids made on one machine.
+    """
+    digest = hashlib.blake2b(user_id.bytes, digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+def shard_urls(url, shard_count):
+    """Returns the URLs of the shards of the database `url`, stored next to
+    it as <name>_shard<N>.sqlite."""
+    database = Path(url.database)
+    return [url.set(database=str(
+        database.with_name(f"{database.stem}_shard{n}.sqlite")))
+        for n in range(shard_count)]
+
+
+def merge_counts(partials):
+    """Merges per shard results of `(key..., count)` rows into a Counter
+    of the total count per key. A single key column gives plain keys,
+    several give tuples."""
+    totals = Counter()
+    for rows in partials:
+        for *key, count in rows:
+            totals[key[0] if len(key) == 1 else tuple(key)] += count
+    return totals
+
+
+class ShardedBlogStore:
+    def __init__(self, urls, **engine_options):
+        self.engines = [create_async_engine(url, **engine_options)
+                        for url in urls]
+        self.sessions = [async_sessionmaker(engine, expire_on_commit=False)
+                         for engine in self.engines]
+
+    @classmethod
+    def from_engine(cls, engine, shard_count, **engine_options):
+        """Creates a store with `shard_count` shards next to the database of
+        `engine`."""
+        return cls(shard_urls(engine.url, shard_count), **engine_options)
+
+    def __len__(self):
+        return len(self.engines)
+
+    async def create_all(self):
+        for engine in self.engines:
+            async with engine.begin() as connection:
+                await connection.run_sync(metadata.create_all)
+
+    async def clear(self):
+        """Deletes all the rows in the shards."""
+        for engine in self.engines:
+            async with engine.begin() as connection:
+                for table in reversed(metadata.sorted_tables):
+                    await connection.execute(delete(table))
+
+    async def dispose(self):
+        for engine in self.engines:
+            await engine.dispose()
+
+    def session_for(self, user_id):
+        """Returns a new session on the shard of the user."""
+        return self.sessions[shard_for(user_id, len(self))]()
+
+    async def add_views(self, views):
+        """Stores page views, given as dicts with the keys `user_id`,
+        `customer_id` (optional), `session_id`, `article_id` and
+        `timestamp`.
+
+        The views are grouped by shard, and every shard gets one
+        transaction with a multi-row insert per table, the shards are
+        written concurrently. Users and sessions that are already stored are
+        left as they are.
+        """
+        by_shard = {}
+        for view in views:
+            shard = shard_for(view["user_id"], len(self))
+            by_shard.setdefault(shard, []).append(view)
+
+        await asyncio.gather(*(self._add_shard_views(shard, rows)
+                               for shard, rows in by_shard.items()))
+
+    async def add_sessions(self, sessions):
+        """Stores users and sessions without views, given as dicts with the
+        keys `user_id`, `customer_id` (optional) and `session_id`, which is
+        None for a user without sessions. The shards are written
+        concurrently."""
+        by_shard = {}
+        for row in sessions:
+            shard = shard_for(row["user_id"], len(self))
+            by_shard.setdefault(shard, []).append(row)
+        await asyncio.gather(*(self._add_shard_sessions(shard, rows)
+                               for shard, rows in by_shard.items()))
+
+    async def _add_shard_sessions(self, shard, rows):
+        async with self.engines[shard].begin() as connection:
+            await _insert_sessions(connection, rows)
+
+    async def _add_shard_views(self, shard, rows):
+        async with self.engines[shard].begin() as connection:
+            await _insert_sessions(connection, rows)
+            await connection.execute(insert(BlogView.__table__), [
+                {"article_id": r["article_id"],
+                 "sesion_id": r["session_id"],
+                 "timestamp": r["timestamp"]} for r in rows])
+
+    async def _execute(self, Session, stmt):
+        async with Session() as session:
+            return (await session.execute(stmt)).all()
+
+    async def fan_out(self, stmt):
+        """Runs `stmt` on all shards concurrently and returns the rows of
+        each shard.
+
+        The statement must only use the sharded tables, and select columns
+        rather than model instances, since the relationships to the catalog
+        tables cannot be loaded from a shard.
+        """
+        return await asyncio.gather(*(self._execute(Session, stmt)
+                                      for Session in self.sessions))
+
+    async def _count_by(self, key, *where):
+        q = (select(key, func.count(BlogView.id))
+             .where(*where).group_by(key))
+        return merge_counts(await self.fan_out(q))
+
+    async def _articles(self, session, counts):
+        """Pairs the article ids of `counts` with their articles, loaded
+        from the primary database, most viewed first."""
+        articles = (await session.scalars(
+            select(BlogArticle).where(BlogArticle.id.in_(counts)))).all()
+        pairs = [(article, counts[article.id]) for article in articles]
+        return sorted(pairs, key=lambda pair: -pair[1])
+
+    async def popular_articles(self, session, start, end, min_views):
+        """Articles with more than `min_views` views in the range
+        (exercise 5.1)."""
+        counts = await self._count_by(BlogView.article_id,
+                                BlogView.timestamp.between(start, end))
+        popular = {id: n for id, n in counts.items() if n > min_views}
+        return await self._articles(session, popular)
+
+    async def views_by_language(self, session, start, end):
+        """Number of views per language in the range (exercise 5.3)."""
+        counts = await self._count_by(BlogView.article_id,
+                                BlogView.timestamp.between(start, end))
+        by_language = Counter()
+        for article_id, language_id in await session.execute(
+                select(BlogArticle.id, BlogArticle.language_id)
+                .where(BlogArticle.language_id.is_not(None))):
+            by_language[language_id] += counts.get(article_id, 0)
+        languages = (await session.scalars(
+            select(Language).where(Language.id.in_(by_language)))).all()
+        pairs = [(by_language[language.id], language)
+                 for language in languages if by_language[language.id]]
+        return sorted(pairs, key=lambda pair: -pair[0])
+
+    async def views_by_article_in(self, session, language_name):
+        """Number of views per article in a language (exercise 5.4)."""
+        article_ids = (await session.scalars(
+            select(BlogArticle.id).join(BlogArticle.language)
+            .where(Language.name == language_name))).all()
+        counts = await self._count_by(BlogView.article_id,
+                                BlogView.article_id.in_(article_ids))
+        return [(n, article) for article, n in await self._articles(session, counts)]
+
+    async def monthly_views(self, start, end):
+        """Number of views per month in the range (exercise 5.5)."""
+        month = func.extract("month", BlogView.timestamp)
+        counts = await self._count_by(month, BlogView.timestamp.between(start, end))
+        return sorted(counts.items())
+
+    async def daily_views(self, start, end):
+        """Number of views per day of the month in the range
+        (exercise 5.6)."""
+        day = func.extract("day", BlogView.timestamp)
+        counts = await self._count_by(day, BlogView.timestamp.between(start, end))
+        return sorted(counts.items())
+
+
+async def _insert_sessions(connection, rows):
+    """Inserts the users and the sessions of `rows`, leaving the ones that
+    are already stored as they are."""
+    user_rows = {r["user_id"]: {"id": r["user_id"],
+                                "customer_id": r.get("customer_id")}
+                 for r in rows}
+    session_rows = {r["session_id"]: {"id": r["session_id"],
+                                      "user_id": r["user_id"]}
+                    for r in rows if r["session_id"] is not None}
+    await connection.execute(
+        insert(BlogUser.__table__).prefix_with("OR IGNORE"),
+        list(user_rows.values()))
+    if session_rows:
+        await connection.execute(
+            insert(BlogSession.__table__).prefix_with("OR IGNORE"),
+            list(session_rows.values()))
+
+
+async def distribute_existing(session, store, move=False, batch_size=10000):
+    """Copies the blog users, sessions and views of the primary database
+    to the shards, and deletes them from the primary database when `move`
+    is True. Returns the number of copied views.
+
+    All the users and sessions are copied, also the ones without views, so
+    that nothing is lost when they are deleted."""
+    users = (select(BlogUser.id, BlogUser.customer_id, BlogSession.id)
+             .outerjoin(BlogSession, BlogSession.user_id == BlogUser.id)
+             .order_by(BlogUser.id)
+             .execution_options(yield_per=batch_size))
+    result = await session.stream(users)
+    async for partition in result.partitions():
+        await store.add_sessions(
+            {"user_id": user_id, "customer_id": customer_id,
+             "session_id": session_id}
+            for user_id, customer_id, session_id in partition)
+    q = (select(BlogSession.user_id, BlogUser.customer_id,
+                BlogView.sesion_id, BlogView.article_id, BlogView.timestamp)
+         .join(BlogView.session).join(BlogSession.user)
+         .order_by(BlogView.id))
+    copied = 0
+    result = await session.stream(q.execution_options(yield_per=batch_size))
+    async for partition in result.partitions():
+        await store.add_views(
+            {"user_id": user_id, "customer_id": customer_id,
+             "session_id": session_id, "article_id": article_id,
+             "timestamp": timestamp}
+            for user_id, customer_id, session_id, article_id, timestamp
+            in partition)
+        copied += len(partition)
+    if move:
+        for model in reversed(SHARDED):
+            await session.execute(delete(model))
+    return copied
+
+
+async def main():
+    from db import Session, engine
+
+    parser = argparse.ArgumentParser(
+        description="Copy the blog views to shards and compare the reports")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--move", action="store_true",
+                        help="delete the copied rows from the primary "
+                        "database")
+    args = parser.parse_args()
+
+    store = ShardedBlogStore.from_engine(engine, args.shards)
+    await store.create_all()
+    await store.clear()
+    async with Session() as session:
+        async with session.begin():
+            copied = await distribute_existing(session, store, args.move)
+        per_shard = [rows[0][0] for rows in await store.fan_out(
+            select(func.count(BlogView.id)))]
+        print(f"Copied {copied} views to {len(store)} shards: {per_shard}")
+
+        march_2020 = (datetime(2020, 3, 1), datetime(2020, 4, 1))
+        march_2022 = (datetime(2022, 3, 1), datetime(2022, 4, 1))
+        print("5.1", await store.popular_articles(session, *march_2020, 40))
+        print("5.3", await store.views_by_language(session, *march_2022))
+        print("5.4", (await store.views_by_article_in(session, "German"))[:3])
+        year_2022 = (datetime(2022, 1, 1), datetime(2023, 1, 1))
+        monthly = await store.monthly_views(*year_2022)
+        print("5.5", monthly)
+        print("5.6", await store.daily_views(datetime(2022, 2, 1),
+                                             datetime(2022, 3, 1)))
+
+        if not args.move:
+            month = func.extract("month", BlogView.timestamp)
+            q = (select(month, func.count(BlogView.id))
+                 .where(BlogView.timestamp.between(*year_2022))
+                 .group_by(month).order_by(month))
+            rows = await session.execute(q)
+            same = [tuple(row) for row in rows] == monthly
+            print("5.5 matches the primary database:", same)
+    await store.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,308 @@
+"""A single writer with concurrent readers for SQLite.
+
+SQLite allows one writer at a time. When coroutines that share an engine
+write concurrently, each of them takes a connection from the pool and
+starts its own transaction, and all but one wait on the database lock,
+until they fail with "database is locked". With the default rollback
+journal the readers also wait while a transaction is being committed.
+
+`WriteCoordinator` instead sends all the write transactions through one
+connection, in the order they were submitted, and the reads to a pool of
+read-only connections. The database is switched to WAL mode, so the
+readers see the last committed data while the writer writes:
+
+    coordinator = WriteCoordinator(url)
+    await coordinator.start()
+
+    async def add_view(session):
+        session.add(BlogView(article_id=1, sesion_id=session_id))
+
+    await coordinator.write(add_view)     # returns when committed
+    async with coordinator.reader() as session:
+        await session.scalar(select(func.count(BlogView.id)))
+
+    await coordinator.stop()
+
+A write is a function that gets an `AsyncSession` and makes its changes
+without committing. The writer takes all the writes that are waiting, up
+to `max_group`, and commits them together in one transaction (group
+commit), which saves a sync of the file per write, and lets the session
+insert the rows of all the writes with one statement per table. If the
+group fails, the writes are run again, each in a savepoint, so a write that
+raises is rolled back alone and its caller gets the error, while the others
+in the group are committed. A write function must therefore be safe to run
+a second time after its transaction was rolled back. `write()` returns what
+the function returned, once the transaction is committed.
+
+Running this file compares the coordinator with coroutines sharing a plain
+engine, under a mix of concurrent reads and writes.
+
+Usage: python writer.py [--database writer_benchmark.sqlite] [--workers 50]
+"""
+
+import argparse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+WRITER_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+}
+
+
+class WriteCoordinator:
+    def __init__(self, url, readers=4, max_group=100, **engine_options):
+        self.max_group = max_group
+        self.writer = create_async_engine(
+            url, poolclass=AsyncAdaptedQueuePool, pool_size=1,
+            max_overflow=0, **engine_options)
+        self.readers = create_async_engine(
+            url, poolclass=AsyncAdaptedQueuePool, pool_size=readers,
+            max_overflow=0, **engine_options)
+        self.WriteSession = async_sessionmaker(self.writer,
+                                               expire_on_commit=False)
+        self.ReadSession = async_sessionmaker(self.readers,
+                                              expire_on_commit=False)
+        self.queue = asyncio.Queue()
+        self._task = None
+        # The number of transactions and writes committed, for the group
+        # commit ratio.
+        self.commits = 0
+        self.writes = 0
+
+        @event.listens_for(self.writer.sync_engine, "connect")
+        def connect_writer(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in WRITER_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            cursor.close()
+            # The driver only starts transactions before INSERT, UPDATE and
+            # DELETE, which breaks savepoints. Let SQLAlchemy start them
+            # instead, see begin_writer().
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(self.writer.sync_engine, "begin")
+        def begin_writer(connection):
+            # Take the write lock at the start of the transaction, so that a
+            # transaction never has to wait for it halfway through.
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+        @event.listens_for(self.readers.sync_engine, "connect")
+        def connect_reader(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA query_only = ON")
+            cursor.execute("PRAGMA busy_timeout = 5000")
+            cursor.close()
+
+    async def start(self):
+        # Connect the writer first, which switches the database to WAL mode
+        # before the first reader connects.
+        async with self.writer.connect():
+            pass
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commits the writes that are waiting, stops the writer and closes
+        the connections."""
+        await self.queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await self.writer.dispose()
+        await self.readers.dispose()
+
+    async def write(self, fn):
+        """Runs `await fn(session)` in the writer, and returns its result
+        when it is committed."""
+        done = asyncio.get_running_loop().create_future()
+        await self.queue.put((fn, done))
+        return await done
+
+    @asynccontextmanager
+    async def reader(self):
+        """A session on one of the read-only connections. It waits for a
+        free connection when all of them are in use."""
+        async with self.ReadSession() as session:
+            yield session
+
+    async def read(self, fn):
+        """Returns `await fn(session)` run in a reader session."""
+        async with self.reader() as session:
+            return await fn(session)
+
+    async def _run(self):
+        while True:
+            group = [await self.queue.get()]
+            while len(group) < self.max_group:
+                try:
+                    group.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                results = await self._commit(group)
+            except Exception as error:
+                results = [error] * len(group)
+            for (_, done), result in zip(group, results):
+                if not done.cancelled():
+                    if isinstance(result, Exception):
+                        done.set_exception(result)
+                    else:
+                        done.set_result(result)
+                self.queue.task_done()
+
+    async def _commit(self, group):
+        """Runs the writes of `group` in one transaction. Returns the result
+        or the exception of each write."""
+        try:
+            async with self.WriteSession.begin() as session:
+                results = [await fn(session) for fn, _ in group]
+        except Exception:
+            if len(group) == 1:
+                raise
+            # Find the writes that fail by running them again, each in a
+            # savepoint.
+            results = await self._commit_isolated(group)
+        self.commits += 1
+        self.writes += len(group)
+        return results
+
+    async def _commit_isolated(self, group):
+        results = []
+        async with self.WriteSession.begin() as session:
+            for fn, _ in group:
+                try:
+                    async with session.begin_nested():
+                        results.append(await fn(session))
+                except Exception as error:
+                    results.append(error)
+        return results
+
+
+async def mixed_load(write, read, workers, operations, read_ratio):
+    """Runs `operations` reads and writes from `workers` concurrent
+    coroutines. Returns the throughput, the latencies of the reads and of
+    the writes in seconds, and the number of failed operations."""
+    import random
+
+    latencies = {"read": [], "write": []}
+    failed = 0
+
+    async def worker(count):
+        nonlocal failed
+        for _ in range(count):
+            kind = "read" if random.random() < read_ratio else "write"
+            start = time.perf_counter()
+            try:
+                await (read() if kind == "read" else write())
+            except Exception:
+                failed += 1
+                continue
+            latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(operations // workers)
+                           for _ in range(workers)))
+    elapsed = time.perf_counter() - start
+    done = len(latencies["read"]) + len(latencies["write"])
+    return done / elapsed, latencies, failed
+
+
+async def main():
+    import statistics
+    from datetime import datetime, timezone
+    from pathlib import Path
+    from uuid import uuid4
+
+    from sqlalchemy import func, insert, select
+
+    from db import Model, construct
+    from models import BlogArticle, BlogAuthor, BlogSession, BlogUser, \
+        BlogView
+
+    parser = argparse.ArgumentParser(
+        description="Compare the write coordinator with a shared engine")
+    parser.add_argument("--database", default="writer_benchmark.sqlite",
+                        help="scratch database, it is deleted first")
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--read-ratio", type=float, default=0.8)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        Path(args.database + suffix).unlink(missing_ok=True)
+    url = f"sqlite+aiosqlite:///{args.database}"
+    engine = create_async_engine(url)
+    async with engine.begin() as connection:
+        await connection.run_sync(Model.metadata.create_all)
+        await connection.execute(insert(BlogAuthor.__table__),
+                                 [{"id": 1, "name": "Benchmark"}])
+        await connection.execute(insert(BlogArticle.__table__), [
+            {"id": i, "title": f"Article {i}", "author_id": 1,
+             "timestamp": datetime.now(timezone.utc)}
+            for i in range(1, 101)])
+        user_id, session_id = uuid4(), uuid4()
+        await connection.execute(insert(BlogUser.__table__),
+                                 [{"id": user_id}])
+        await connection.execute(insert(BlogSession.__table__),
+                                 [{"id": session_id, "user_id": user_id}])
+
+    def new_view():
+        import random
+        return construct(BlogView, article_id=random.randint(1, 100),
+                         sesion_id=session_id,
+                         timestamp=datetime.now(timezone.utc))
+
+    async def count_views(session):
+        import random
+        return await session.scalar(
+            select(func.count(BlogView.id))
+            .where(BlogView.article_id == random.randint(1, 100)))
+
+    async def add_view(session):
+        session.add(new_view())
+
+    # Every coroutine with its own session on a shared engine.
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def shared_write():
+        async with Session.begin() as session:
+            await add_view(session)
+
+    async def shared_read():
+        async with Session() as session:
+            await count_views(session)
+
+    coordinator = WriteCoordinator(url)
+    await coordinator.start()
+
+    print(f"{args.workers} workers, {args.operations} operations, "
+          f"{args.read_ratio:.0%} reads")
+    for name, write, read in (
+            ("Shared engine", shared_write, shared_read),
+            ("Write coordinator", lambda: coordinator.write(add_view),
+             lambda: coordinator.read(count_views))):
+        throughput, latencies, failed = await mixed_load(
+            write, read, args.workers, args.operations, args.read_ratio)
+        p95 = {kind: statistics.quantiles(times, n=20)[18] * 1000
+               if len(times) > 1 else 0.0
+               for kind, times in latencies.items()}
+        print(f"{name}: {throughput:,.0f} operations/s, {failed} failed, "
+              f"p95 read {p95['read']:.1f} ms, "
+              f"p95 write {p95['write']:.1f} ms")
+    print(f"Group commit: {coordinator.writes} writes in "
+          f"{coordinator.commits} transactions")
+
+    await coordinator.stop()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+# Measures the startup time of short lived commands: importing the models,
+# and importing the models and creating the engine on first use.
+#
+# The wall clock times include starting Python and vary a lot between runs,
+# so the import times of the modules reported by `python -X importtime` are
+# shown too, as the median over the runs.
+#
+# Usage: python benchmark_startup.py [runs]
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = {
+    "import models": "import models",
+    "import models, first use of the engine":
+        "import models, db; db.engine",
+}
+
+
+def run(code, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times(runs):
+    """Returns the median cumulative import time in ms of every module that
+    is imported by `import models`."""
+    times = {}
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import models"],
+            check=True, capture_output=True, text=True)
+        for line in result.stderr.splitlines()[1:]:
+            _, _, cumulative, name = (p.strip() for p in
+                                      re.split(r"[:|]", line, maxsplit=3))
+            times.setdefault(name, []).append(int(cumulative) / 1000)
+    return {name: statistics.median(t) for name, t in times.items()
+            if len(t) == runs}
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    run("pass", 2)  # warm up the file system cache
+    baseline = statistics.median(run("pass", runs))
+    print(f"python -c pass: {baseline * 1000:.1f} ms (median of {runs})")
+    for name, code in COMMANDS.items():
+        times = run(code, runs)
+        median = statistics.median(times)
+        print(f"{name}: {median * 1000:.1f} ms, "
+              f"{(median - baseline) * 1000:.1f} ms more than python alone "
+              f"(min {min(times) * 1000:.1f} ms)")
+
+    times = import_times(runs)
+    print("Import times: " + ", ".join(
+        f"{name} {times[name]:.1f} ms"
+        for name in ("sqlalchemy", "db", "models") if name in times))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Bitmap index of the countries where products were made.
+
+The country queries in `exercises3.md` join products, countries and the
+`products_countries` join table, and several of them need GROUP BY and
+HAVING on top of that. The set of products made in a country can instead be
+kept in memory as a bitmap, a Python integer where bit `n` is set when the
+product with id `n` was made in the country. Python integers can have any
+number of bits, and the bitwise operators work on all of them at once:
+
+- products made in the UK *or* the USA are `uk | usa`,
+- products made jointly in the UK *and* the USA are `uk & usa`,
+- products made in the UK but *not* the USA are `uk & ~usa`.
+
+The same is done for the products of each manufacturer, so "how many
+countries has this manufacturer made products in" is the number of
+countries whose bitmap has any bit in common with the manufacturer bitmap.
+
+The index is loaded from the `products_countries` table with `refresh()`,
+and can be kept up to date with `add()` and `discard()` when products and
+countries are linked or unlinked.
+
+The query functions below are the solutions to exercise 3. Each takes an
+optional index, if it is given the bitmaps are used to find the matching
+products and only the final rows are read from the database, otherwise the
+query is done with SQL joins.
+
+    index = CountryIndex()
+    with Session() as session:
+        index.refresh(session)
+        products_made_in(session, ["UK", "USA"], index)
+"""
+
+from sqlalchemy import func, not_, select
+
+from models import Country, Manufacturer, Product, ProductCountry
+
+
+def _ids(bitmap):
+    """Returns the positions of the set bits in `bitmap`."""
+    ids = []
+    while bitmap:
+        lowest = bitmap & -bitmap
+        ids.append(lowest.bit_length() - 1)
+        bitmap ^= lowest
+    return ids
+
+
+class CountryIndex:
+    def __init__(self):
+        self.countries = {}  # country name -> bitmap of product ids
+        self.manufacturers = {}  # manufacturer id -> bitmap of product ids
+        self.all_products = 0
+        self._country_names = {}  # country id -> country name
+
+    def refresh(self, session):
+        """Rebuilds the index from the database."""
+        self._country_names = dict(
+            session.execute(select(Country.id, Country.name)).all())
+        self.countries = dict.fromkeys(self._country_names.values(), 0)
+        self.manufacturers = {}
+        self.all_products = 0
+        for product_id, manufacturer_id in session.execute(
+                select(Product.id, Product.manufacturer_id)):
+            bit = 1 << product_id
+            self.manufacturers[manufacturer_id] = (
+                self.manufacturers.get(manufacturer_id, 0) | bit)
+            self.all_products |= bit
+        for product_id, country_id in session.execute(
+                select(ProductCountry.c.product_id,
+                       ProductCountry.c.country_id)):
+            self.countries[self._country_names[country_id]] |= 1 << product_id
+
+    def add(self, product, country):
+        """Records that `product` was made in `country`."""
+        bit = 1 << product.id
+        self.countries[country.name] = self.countries.get(country.name, 0) | bit
+        self.manufacturers[product.manufacturer_id] = (
+            self.manufacturers.get(product.manufacturer_id, 0) | bit)
+        self.all_products |= bit
+
+    def discard(self, product, country):
+        """Records that `product` is no longer linked to `country`."""
+        self.countries[country.name] = (
+            self.countries.get(country.name, 0) & ~(1 << product.id))
+
+    def any_of(self, country_names):
+        """Bitmap of the products made in at least one of the countries."""
+        bitmap = 0
+        for name in country_names:
+            bitmap |= self.countries.get(name, 0)
+        return bitmap
+
+    def all_of(self, country_names):
+        """Bitmap of the products made in all of the countries."""
+        bitmap = self.all_products
+        for name in country_names:
+            bitmap &= self.countries.get(name, 0)
+        return bitmap
+
+    def outside_of(self, country_names):
+        """Bitmap of the products made in at least one country that is not
+        one of the given countries."""
+        return self.any_of(set(self.countries) - set(country_names))
+
+    def country_counts(self, products=None):
+        """Number of countries for each manufacturer, only counting the
+        products in the `products` bitmap if it is given."""
+        counts = {}
+        for manufacturer_id, bitmap in self.manufacturers.items():
+            if products is not None:
+                bitmap &= products
+            counts[manufacturer_id] = sum(
+                1 for c in self.countries.values() if c & bitmap)
+        return counts
+
+    def product_counts(self, products):
+        """Number of products in the `products` bitmap for each
+        manufacturer."""
+        return {manufacturer_id: (bitmap & products).bit_count()
+                for manufacturer_id, bitmap in self.manufacturers.items()}
+
+
+def _products(session, bitmap):
+    return session.scalars(
+        select(Product).where(Product.id.in_(_ids(bitmap)))
+        .order_by(Product.name)).all()
+
+
+def _manufacturers(session, ids):
+    return session.scalars(
+        select(Manufacturer).where(Manufacturer.id.in_(ids))
+        .order_by(Manufacturer.name)).all()
+
+
+def products_made_in(session, country_names, index=None):
+    """Products made in any of the countries (exercise 3.1)."""
+    if index is not None:
+        return _products(session, index.any_of(country_names))
+    return session.scalars(
+        select(Product).join(Product.countries)
+        .where(Country.name.in_(country_names))
+        .distinct().order_by(Product.name)).all()
+
+
+def products_not_only_made_in(session, country_names, index=None):
+    """Products made in some other country than the given ones, including
+    the ones made jointly with one of the given countries (exercise 3.2)."""
+    if index is not None:
+        return _products(session, index.outside_of(country_names))
+    return session.scalars(
+        select(Product).join(Product.countries)
+        .where(not_(Country.name.in_(country_names)))
+        .distinct().order_by(Product.name)).all()
+
+
+def products_made_jointly_in(session, country_names, index=None):
+    """Products made in all of the countries (exercise 3.8)."""
+    if index is not None:
+        return _products(session, index.all_of(country_names))
+    return session.scalars(
+        select(Product).join(Product.countries)
+        .where(Country.name.in_(country_names))
+        .group_by(Product)
+        .having(func.count(Country.id) == len(set(country_names)))
+        .order_by(Product.name)).all()
+
+
+def manufacturers_with_products_in(session, country_names, min_products,
+                                   index=None):
+    """Manufacturers with more than `min_products` products made in any of
+    the countries (exercise 3.6)."""
+    if index is not None:
+        counts = index.product_counts(index.any_of(country_names))
+        return _manufacturers(
+            session, [m for m, n in counts.items() if n > min_products])
+    product_count = func.count(Product.id.distinct())
+    return session.scalars(
+        select(Manufacturer).join(Manufacturer.products)
+        .join(Product.countries)
+        .where(Country.name.in_(country_names))
+        .group_by(Manufacturer)
+        .having(product_count > min_products)
+        .order_by(Manufacturer.name)).all()
+
+
+def manufacturers_in_several_countries(session, index=None):
+    """Manufacturers that have products in more than one country
+    (exercise 3.7)."""
+    if index is not None:
+        counts = index.country_counts()
+        return _manufacturers(session, [m for m, n in counts.items() if n > 1])
+    country_count = func.count(Country.id.distinct())
+    return session.scalars(
+        select(Manufacturer).join(Manufacturer.products)
+        .join(Product.countries)
+        .group_by(Manufacturer)
+        .having(country_count > 1)
+        .order_by(Manufacturer.name)).all()
@@ -0,0 +1,51 @@
+"""Rule based classification of the free text `Product.cpu` column.
+
+The `cpu` column contains values such as "6502", "6502C", "65C02", "8501
+(6502)" or "Z80 compatible", so finding all products based on a CPU family
+requires a `LIKE` filter that cannot use an index, and that has to know all
+the ways the family is written. Instead each product is linked to rows in
+the `cpu_families` table, found by matching the `cpu` text against the rules
+below, through the `products_cpu_families` join table.
+
+Some products have more than one CPU, for example "6502, Z80" or
+"8502 (6502) / Z80", and are linked to every family that is mentioned:
+
+    select(Product).where(Product.cpu_families.any(CpuFamily.name == "Z80"))
+"""
+
+import re
+
+# (family, pattern) pairs. The families of a text are the ones with a match,
+# in the order of their first match in the text, and on a tie in the order
+# of this list.
+FAMILY_RULES = [
+    ("Z80", re.compile(r"Z80", re.IGNORECASE)),
+    # 6502 and its variants and clones, such as the 6510 and 8501 used by
+    # Commodore, and the Apple II which was built around the 6502.
+    ("6502", re.compile(
+        r"65(0\d|1\d|C\d\d|SC\d\d)|85\d\d|CM630|Apple II", re.IGNORECASE)),
+    ("6809", re.compile(r"6809")),
+    ("6800", re.compile(r"680[0-3](?!\d)")),
+    ("68000", re.compile(r"680[0-6]0|68008")),
+    ("x86", re.compile(r"80[1-3]?86|8088")),
+    ("8080", re.compile(r"8080")),
+    ("ARM", re.compile(r"ARM", re.IGNORECASE)),
+    ("1802", re.compile(r"1802")),
+    ("TMS9900", re.compile(r"TMS ?9900", re.IGNORECASE)),
+    ("F8", re.compile(r"F8(?!\d)")),
+    ("PDP-11", re.compile(r"PDP[ -]?11", re.IGNORECASE)),
+    ("DDP-16", re.compile(r"DDP[ -]?16", re.IGNORECASE)),
+]
+
+
+def classify_cpu(cpu):
+    """Returns the names of the CPU families mentioned in a `cpu` text, an
+    empty list if no rule matches."""
+    if not cpu:
+        return []
+    matches = []
+    for family, pattern in FAMILY_RULES:
+        match = pattern.search(cpu)
+        if match is not None:
+            matches.append((match.start(), family))
+    return [family for _, family in sorted(matches, key=lambda m: m[0])]
@@ -1,7 +1,21 @@
+"""The database configuration, the engine and the sessions.
+
+Importing this module has no side effects, so that importing the models is
+fast for short lived commands. The engine is created on the first use of
+`engine` or `Session`, from the configuration given to `configure()`, or
+from the DATABASE_URL environment variable (or .env file) if `configure()`
+is not called:
+
+    import db
+    db.configure(pragmas="bulk", pool_size=1)
+    with db.Session() as session:
+        ...
+"""
+
+import logging
 import os
 
-from dotenv import load_dotenv
-from sqlalchemy import MetaData, create_engine
+from sqlalchemy import MetaData
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
 
@@ -21,19 +35,123 @@ class Model(DeclarativeBase):
     )
 
 
-load_dotenv()
+# SQLite settings that are applied to every new connection, chosen with
+# configure(pragmas=...) or the SQLITE_PRAGMAS environment variable.
+PRAGMA_PROFILES = {
+    # The SQLite defaults.
+    "default": {},
+    # Readers and the writer do not block each other, and a commit does not
+    # wait for the data to reach the disk, only for the write-ahead log.
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "foreign_keys": "ON",
+        "busy_timeout": 5000,
+    },
+    # For the importers: the fastest writes, but the database may be
+    # corrupted if the computer crashes during the import.
+    "bulk": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "temp_store": "MEMORY",
+        "cache_size": -64000,
+    },
+}
+
+logger = logging.getLogger(__name__)
+
+_config = {}
+_engine = None
+_profiler = None
+
+
+def configure(url=None, pragmas=None, **engine_options):
+    """Sets the database URL, the PRAGMA profile and the options passed to
+    create_engine(), such as echo, pool_size or max_overflow.
+
+    If the engine is already in use it is disposed, and a new engine with the
+    new configuration is created on the next use.
+    """
+    global _engine
+    _config.clear()
+    _config.update(url=url, pragmas=pragmas, engine_options=engine_options)
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+def get_engine():
+    """Returns the engine, creating it on the first call."""
+    global _engine, _profiler
+    if _engine is not None:
+        return _engine
+
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine, event
 
-print(f"Database URL: {os.environ['DATABASE_URL']}")
+    from profiler import StatementProfiler
+
+    load_dotenv()
+    url = _config.get("url") or os.environ["DATABASE_URL"]
+
+    # The engine manages connections to a database.
+    # Some nice to know options are:
+    #   echo = True, to have SQLAlchemy log every SQL statement
+    #   pool_size=<N>, set a custom size for the connection pool (default 5)
+    #   max_overflow=<N>, max number of connections that can be created during spikes (default 10)
+    engine = create_engine(url, **_config.get("engine_options", {}))
+    # The URL of the engine is shown without the password.
+    logger.info("Database URL: %r", engine.url)
+
+    pragmas = PRAGMA_PROFILES[
+        _config.get("pragmas") or os.environ.get("SQLITE_PRAGMAS", "default")]
+    if pragmas:
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            for name, value in pragmas.items():
+                dbapi_connection.execute(f"PRAGMA {name} = {value}")
+
+    # For less output than echo = True, the profiler collects timings per
+    # statement, see profiler.py. It is enabled from the start if SQL_PROFILE
+    # is set, and can be switched with profiler.enable() and
+    # profiler.disable(). print(profiler.report()) shows the statements that
+    # took the most time.
+    if _profiler is None:
+        _profiler = StatementProfiler(
+            engine, enabled=bool(os.environ.get("SQL_PROFILE")))
+    else:
+        # After configure(), `db.profiler` stays the same object.
+        _profiler.attach(engine)
+    Session.configure(bind=engine)
+    _engine = engine
+    return engine
+
+
+class _LazySessionmaker(sessionmaker):
+    """A sessionmaker that creates the engine when the first session is
+    made."""
+
+    def __call__(self, **local_kw):
+        get_engine()
+        return super().__call__(**local_kw)
+
+    def begin(self):
+        get_engine()
+        return super().begin()
 
-# The engine manages connections to a database.
-# Some nice to know options are:
-#   echo = True, to have SQLAlchemy log every SQL statement
-#   pool_size=<N>, set a custom size for the connection pool (default 5)
-#   max_overflow=<N>, max number of connections that can be created during spikes (default 10)
-engine = create_engine(os.environ["DATABASE_URL"])
 
 # The session maintains the list of new, read, modified, and deleted model instances
 # Changes are passed on to the database in the context of a transaction when the
 # session is flushed. When the session is committed the changes are permanently
 # written to the db.
-Session = sessionmaker(engine)
+Session = _LazySessionmaker()
+
+
+def __getattr__(name):
+    # `db.engine` and `db.profiler` are created on first use.
+    if name == "engine":
+        return get_engine()
+    if name == "profiler":
+        get_engine()
+        return _profiler
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
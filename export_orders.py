@@ -0,0 +1,168 @@
+# Exports orders with their line items and customers to a CSV or JSONL file
+#
+# Usage: python export_orders.py orders_export.jsonl
+#        python export_orders.py orders_export.csv --batch-size 5000
+import argparse
+import csv
+import json
+import sys
+import time
+from itertools import groupby
+from operator import attrgetter
+
+from sqlalchemy import select
+
+from db import Session
+from models import Customer, Order, OrderItem, Product
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+CSV_FIELDS = [
+    "order_id",
+    "timestamp",
+    "customer_id",
+    "customer_name",
+    "address",
+    "phone",
+    "product_id",
+    "product_name",
+    "unit_price",
+    "quantity",
+]
+
+
+def order_rows_query():
+    """Selects one row per line item together with its order and customer.
+
+    Only plain columns are selected, not model instances. This means that
+    nothing is added to the identity map of the session, and the memory used
+    does not grow with the number of exported rows. All the line items of an
+    order are adjacent since the rows are sorted on the order, so the items
+    can be grouped per order while streaming without any extra queries.
+
+    The items are outer joined, so an order without items is exported too,
+    as a single row with empty item columns.
+    """
+    return (
+        select(
+            Order.id.label("order_id"),
+            Order.timestamp,
+            Customer.id.label("customer_id"),
+            Customer.name.label("customer_name"),
+            Customer.address,
+            Customer.phone,
+            OrderItem.product_id,
+            Product.name.label("product_name"),
+            OrderItem.unit_price,
+            OrderItem.quantity,
+        )
+        .join(Order.customer)
+        .outerjoin(Order.order_items)
+        .outerjoin(OrderItem.product)
+        .order_by(Order.timestamp, Order.id)
+    )
+
+
+def csv_row(row):
+    return {
+        **row._asdict(),
+        "order_id": row.order_id.hex,
+        "customer_id": row.customer_id.hex,
+        "timestamp": row.timestamp.isoformat(sep=" "),
+    }
+
+
+def item_count(rows):
+    """The number of line items in the rows of one order. An order without
+    items has a single row without a product."""
+    return sum(row.product_id is not None for row in rows)
+
+
+def order_document(rows):
+    """Builds one JSON document from the rows of a single order."""
+    first = rows[0]
+    return {
+        "id": first.order_id.hex,
+        "timestamp": first.timestamp.isoformat(sep=" "),
+        "customer": {
+            "id": first.customer_id.hex,
+            "name": first.customer_name,
+            "address": first.address,
+            "phone": first.phone,
+        },
+        "items": [
+            {
+                "product_id": row.product_id,
+                "product_name": row.product_name,
+                "unit_price": row.unit_price,
+                "quantity": row.quantity,
+            }
+            for row in rows if row.product_id is not None
+        ],
+    }
+
+
+def export_orders(session, f, fmt="jsonl", batch_size=1000):
+    """Streams all orders to the open file `f` and returns the number of
+    orders and line items written.
+
+    The `yield_per` execution option makes SQLAlchemy fetch the rows from
+    the database cursor in batches of `batch_size` rows instead of buffering
+    the complete result before returning the first row.
+    """
+    result = session.execute(
+        order_rows_query().execution_options(yield_per=batch_size))
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+
+    orders = items = 0
+    for _, order_rows in groupby(result, key=attrgetter("order_id")):
+        order_rows = list(order_rows)
+        if writer is not None:
+            writer.writerows(csv_row(row) for row in order_rows)
+        else:
+            f.write(json.dumps(order_document(order_rows)) + "\n")
+        orders += 1
+        items += item_count(order_rows)
+    return orders, items
+
+
+def peak_memory_mb():
+    """The peak memory of the process, or None where it is not known."""
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux, in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export orders with line items and customers")
+    parser.add_argument("output", help="file to write, .csv or .jsonl")
+    parser.add_argument("--format", choices=["csv", "jsonl"],
+                        help="defaults to the extension of the output file")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    fmt = args.format or ("csv" if args.output.endswith(".csv") else "jsonl")
+
+    start = time.perf_counter()
+    with Session() as session:
+        with open(args.output, "w", newline="") as f:
+            orders, items = export_orders(session, f, fmt, args.batch_size)
+    elapsed = time.perf_counter() - start
+
+    print(f"Exported {orders} orders with {items} line items in "
+          f"{elapsed:.2f}s ({orders / elapsed:.0f} orders/s)")
+    peak = peak_memory_mb()
+    if peak is not None:
+        print(f"Peak memory: {peak:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
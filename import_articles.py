@@ -2,13 +2,15 @@ import csv
 from datetime import datetime
 from pathlib import Path
 from sqlalchemy import select, delete
-from db import Session
+import search
+from db import Session, configure
 from models import BlogArticle, BlogAuthor, Product, BlogView, BlogSession, BlogUser
+from translations import refresh_translation_groups
 
 
 def main():
     with Session() as session:
-        with session.begin():
+        with session.begin(), search.bulk_load(session):
             session.execute(delete(BlogView))
             session.execute(delete(BlogSession))
             session.execute(delete(BlogUser))
@@ -16,7 +18,7 @@ def main():
             session.execute(delete(BlogAuthor))
 
         with Session() as session:
-            with session.begin():
+            with session.begin(), search.bulk_load(session):
                 all_authors = {}
                 all_products = {}
 
@@ -51,6 +53,9 @@ def main():
                         )
                         session.add(article)
 
+                refresh_translation_groups(session)
+
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     main()
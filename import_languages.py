@@ -1,8 +1,9 @@
 import csv
 from sqlalchemy import select
 from pathlib import Path
-from db import Session
+from db import Session, configure
 from models import BlogArticle, Language
+from translations import refresh_translation_groups
 
 
 def main():
@@ -48,6 +49,9 @@ def main():
                         if article is not None:
                             article.translation_of = translation_of
 
+            refresh_translation_groups(session)
+
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     main()
@@ -4,7 +4,7 @@ from pathlib import Path
 
 from sqlalchemy import delete, select
 
-from db import Session
+from db import Session, configure
 from models import Customer, Order, OrderItem, Product
 
 
@@ -88,4 +88,5 @@ def main():
 
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     main()
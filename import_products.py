@@ -3,17 +3,21 @@ import csv
 
 from sqlalchemy import delete
 
-from db import Session
-from models import Country, Manufacturer, Product, ProductCountry
+from cpu_families import classify_cpu
+from db import Session, configure
+from models import Country, CpuFamily, Manufacturer, Product, ProductCountry, \
+    ProductCpuFamily
 
 
 def main():
     with Session() as session:
         with session.begin():
             session.execute(delete(ProductCountry))
+            session.execute(delete(ProductCpuFamily))
             session.execute(delete(Product))
             session.execute(delete(Manufacturer))
             session.execute(delete(Country))
+            session.execute(delete(CpuFamily))
 
     with Session() as session:
         with session.begin():
@@ -21,6 +25,7 @@ def main():
                 reader = csv.DictReader(f)
                 all_manufacturers = {}
                 all_countries = {}
+                all_cpu_families = {}
 
                 for row in reader:
                     row["year"] = int(row["year"])
@@ -36,6 +41,13 @@ def main():
 
                     all_manufacturers[manufacturer].products.append(p)
 
+                    for family in classify_cpu(p.cpu):
+                        if family not in all_cpu_families:
+                            cf = CpuFamily(name=family)
+                            session.add(cf)
+                            all_cpu_families[family] = cf
+                        p.cpu_families.append(all_cpu_families[family])
+
                     for country in countries:
                         if country not in all_countries:
                             c = Country(name=country)
@@ -45,4 +57,5 @@ def main():
 
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     main()
@@ -4,17 +4,18 @@ from pathlib import Path
 
 from sqlalchemy import delete, select
 
-from db import Session
+import search
+from db import Session, configure
 from models import Customer, Product, ProductReview
 
 
 def main():
     with Session() as session:
-        with session.begin():
+        with session.begin(), search.bulk_load(session):
             session.execute(delete(ProductReview))
 
     with Session() as session:
-        with session.begin():
+        with session.begin(), search.bulk_load(session):
             with Path("reviews.csv").open() as f:
                 reader = csv.DictReader(f)
 
@@ -39,4 +40,5 @@ def main():
 
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     main()
@@ -3,7 +3,7 @@ import sys
 from datetime import datetime
 from uuid import UUID
 from sqlalchemy import select, delete
-from db import Session
+from db import Session, configure
 from models import BlogArticle, BlogUser, BlogView, BlogSession, Customer
 
 
@@ -75,4 +75,5 @@ def main():
 
 
 if __name__ == "__main__":
+    configure(pragmas="bulk")
     main()
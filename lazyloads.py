@@ -0,0 +1,158 @@
+"""Detection of N+1 lazy loads.
+
+Most relationships in models.py use the default lazy loading, so the
+related objects are loaded with a SELECT the first time the attribute is
+accessed. In a loop over query results this is one extra SELECT per row
+(the "N+1 queries" problem), which is easy to miss because nothing in the
+code shows that a query is run:
+
+    for product in session.scalars(select(Product)):
+        print(product.manufacturer.name, product.countries)
+
+The async implementation cannot lazy load at all, an implicit query raises
+an error there. `LazyLoadDetector` gives the same visibility to the sync
+code. While it is active, every lazy load that runs a query is counted per
+relationship and per call site, that is the first line outside of
+SQLAlchemy that accessed the attribute:
+
+    with LazyLoadDetector() as detector:
+        handle_request()
+    print(detector.report())
+
+In strict mode every lazy load raises `LazyLoadError` instead, which is
+meant for tests, to make sure that the queries load everything they need
+with `selectinload()`, `joinedload()` and the like:
+
+    with LazyLoadDetector(strict=True):
+        run_report()
+
+Many-to-one relationships whose object is already in the session are not
+counted, since they are found in the identity map without a query. The
+counts of each session are also kept in `session.info["lazy_loads"]`, for
+the unit of work that caused them.
+"""
+
+import os
+import sys
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_current = ContextVar("lazy_load_detector", default=None)
+_installed = False
+_SQLALCHEMY = str(Path(sqlalchemy.__file__).parent)
+
+
+class LazyLoadError(Exception):
+    pass
+
+
+def _call_site():
+    """Returns "file:line" of the innermost frame that is not in
+    SQLAlchemy, starting from the caller of `_on_execute()`."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(_SQLALCHEMY):
+            return f"{os.path.relpath(filename)}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "?"
+
+
+def _on_execute(orm_execute_state):
+    detector = _current.get()
+    if detector is None or orm_execute_state.lazy_loaded_from is None:
+        return
+    relationship = str(orm_execute_state.loader_strategy_path.prop)
+    site = _call_site()
+    if detector.strict:
+        raise LazyLoadError(
+            f"lazy load of {relationship} at {site}, load it with the "
+            "query instead, for example with selectinload()")
+    detector.loads[relationship, site] += 1
+    orm_execute_state.session.info.setdefault(
+        "lazy_loads", Counter())[relationship, site] += 1
+
+
+class LazyLoadDetector:
+    def __init__(self, strict=False, threshold=2):
+        self.strict = strict
+        # The number of lazy loads from one call site that is reported as
+        # an N+1 problem.
+        self.threshold = threshold
+        self.loads = Counter()
+        self._token = None
+
+    def __enter__(self):
+        global _installed
+        if not _installed:
+            # Listening on the Session class covers every session.
+            event.listen(Session, "do_orm_execute", _on_execute)
+            _installed = True
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current.reset(self._token)
+
+    @property
+    def total(self):
+        return self.loads.total()
+
+    def n_plus_one(self):
+        """Returns `(relationship, call site, count)` of the call sites
+        that lazy loaded a relationship at least `threshold` times, the
+        most frequent first."""
+        return [(relationship, site, count)
+                for (relationship, site), count in self.loads.most_common()
+                if count >= self.threshold]
+
+    def report(self):
+        lines = [f"{self.total} lazy loads"]
+        for relationship, site, count in self.n_plus_one():
+            lines.append(f"{count:>6} x {relationship} at {site}")
+        return "\n".join(lines)
+
+
+def main():
+    from sqlalchemy import select
+    from sqlalchemy.orm import selectinload
+
+    from db import Session
+    from models import Order, OrderItem, Product
+
+    def products_report(session, options=()):
+        for product in session.scalars(select(Product).options(*options)):
+            product.manufacturer.name, len(product.countries)
+
+    def orders_report(session, options=()):
+        q = select(Order).order_by(Order.timestamp).limit(100)
+        for order in session.scalars(q.options(*options)):
+            for item in order.order_items:
+                item.product.name
+
+    with Session() as session, LazyLoadDetector() as detector:
+        products_report(session)
+        orders_report(session)
+    print(detector.report())
+
+    try:
+        with Session() as session, LazyLoadDetector(strict=True):
+            orders_report(session)
+    except LazyLoadError as error:
+        print("Strict mode:", error)
+
+    with Session() as session, LazyLoadDetector(strict=True):
+        products_report(session, [selectinload(Product.manufacturer),
+                                  selectinload(Product.countries)])
+        orders_report(session, [selectinload(Order.order_items)
+                                .selectinload(OrderItem.product)])
+    print("With selectinload() there are no lazy loads")
+
+
+if __name__ == "__main__":
+    main()
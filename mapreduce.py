@@ -0,0 +1,278 @@
+"""Date range reports computed in parallel by a pool of processes.
+
+A report over a year, such as the monthly sales or the monthly page views of
+2022, is one large query, and SQLite runs a query on a single core. This
+module splits the date range of a report into months or weeks (map), runs
+the query of every part in a `ProcessPoolExecutor`, and merges the partial
+results (reduce):
+
+    with report_pool(workers=4) as executor:
+        rows = run_report("monthly_sales", datetime(2022, 1, 1),
+                          datetime(2023, 1, 1), "week", executor)
+
+Every worker process opens its own read-only connection to the database,
+so the parts are read in parallel, and the processes do not share the GIL.
+
+A report is a `RangeReport`: the timestamp column that is split, the
+columns to group by, and the aggregates, each with the combiner that merges
+the partial results of the parts:
+
+- "sum", "count": the partial sums and counts are added,
+- "min", "max": the smallest or largest of the partial results,
+- "avg": each part returns the sum and the count, and the average is their
+  total sum divided by their total count, so it is exact however the rows
+  are split.
+
+The reports are in `REPORTS`, by name, since the workers build their
+queries themselves: SQL expressions are not sent to the workers.
+
+Running this file compares the reports with the same report run as one
+query, and times both.
+
+Usage: python mapreduce.py 2022-01-01 2023-01-01 [--period week] [--workers 4]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, func, select
+
+from models import BlogArticle, BlogView, Manufacturer, Order, OrderItem, \
+    Product
+
+COMBINERS = ("sum", "count", "min", "max", "avg")
+
+
+@dataclass
+class RangeReport:
+    timestamp: object
+    keys: list
+    # The aggregates as name: (combiner, expression).
+    aggregates: dict
+    # The joins from the table of `timestamp`, as select_from() arguments.
+    joins: list = field(default_factory=list)
+
+    def query(self, start, end):
+        """The query of the partial results from `start` up to `end`."""
+        columns = []
+        for combiner, expression in self.aggregates.values():
+            if combiner == "avg":
+                columns += [func.sum(expression), func.count(expression)]
+            elif combiner == "count":
+                columns.append(func.count(expression))
+            elif combiner in COMBINERS:
+                columns.append(getattr(func, combiner)(expression))
+            else:
+                raise ValueError(f"Unknown combiner {combiner!r}")
+        q = select(*self.keys, *columns)
+        for join in self.joins:
+            q = q.join(*join) if isinstance(join, tuple) else q.join(join)
+        return (q.where(self.timestamp >= start, self.timestamp < end)
+                .group_by(*self.keys))
+
+
+def monthly_sales():
+    amount = OrderItem.quantity * OrderItem.unit_price
+    return RangeReport(
+        timestamp=Order.timestamp,
+        keys=[Order.month_key],
+        aggregates={"revenue": ("sum", amount),
+                    "items": ("count", OrderItem.product_id),
+                    "average_price": ("avg", OrderItem.unit_price),
+                    "largest_item": ("max", amount)},
+        joins=[Order.order_items])
+
+
+def sales_by_manufacturer():
+    amount = OrderItem.quantity * OrderItem.unit_price
+    return RangeReport(
+        timestamp=Order.timestamp,
+        keys=[Manufacturer.name],
+        aggregates={"revenue": ("sum", amount),
+                    "average_item": ("avg", amount),
+                    "first_order": ("min", Order.timestamp),
+                    "last_order": ("max", Order.timestamp)},
+        joins=[Order.order_items, OrderItem.product, Product.manufacturer])
+
+
+def monthly_views():
+    return RangeReport(
+        timestamp=BlogView.timestamp,
+        keys=[BlogView.month_key],
+        aggregates={"views": ("count", BlogView.id)})
+
+
+def views_by_language():
+    return RangeReport(
+        timestamp=BlogView.timestamp,
+        keys=[BlogArticle.language_id],
+        aggregates={"views": ("count", BlogView.id),
+                    "first_view": ("min", BlogView.timestamp),
+                    "last_view": ("max", BlogView.timestamp)},
+        joins=[BlogView.article])
+
+
+REPORTS = {
+    "monthly_sales": monthly_sales,
+    "sales_by_manufacturer": sales_by_manufacturer,
+    "monthly_views": monthly_views,
+    "views_by_language": views_by_language,
+}
+
+
+def split_range(start, end, period="month"):
+    """Returns the (start, end) pairs of the months or the weeks (starting
+    on Monday) that cover [start, end), cut to [start, end)."""
+    parts = []
+    lo = start
+    while lo < end:
+        if period == "month":
+            hi = (datetime(lo.year + 1, 1, 1) if lo.month == 12
+                  else datetime(lo.year, lo.month + 1, 1))
+        elif period == "week":
+            monday = datetime(lo.year, lo.month, lo.day) - timedelta(
+                days=lo.weekday())
+            hi = monday + timedelta(weeks=1)
+        else:
+            raise ValueError(f"Unknown period {period!r}")
+        parts.append((lo, min(hi, end)))
+        lo = hi
+    return parts
+
+
+def merge(report, partials):
+    """Merges the partial results of the parts of `report` into rows of
+    the keys and the aggregates."""
+    n_keys = len(report.keys)
+    combiners = [combiner for combiner, _ in report.aggregates.values()]
+    merged = {}
+    for rows in partials:
+        for row in rows:
+            key, values = tuple(row[:n_keys]), row[n_keys:]
+            state = merged.get(key)
+            if state is None:
+                state = merged[key] = [None] * len(combiners)
+            i = 0
+            for j, combiner in enumerate(combiners):
+                if combiner == "avg":
+                    total, count = values[i], values[i + 1]
+                    i += 2
+                    old = state[j] or (0, 0)
+                    state[j] = (old[0] + (total or 0), old[1] + count)
+                    continue
+                value = values[i]
+                i += 1
+                if state[j] is None or value is None:
+                    state[j] = value if state[j] is None else state[j]
+                elif combiner in ("sum", "count"):
+                    state[j] = state[j] + value
+                elif combiner == "min":
+                    state[j] = min(state[j], value)
+                else:
+                    state[j] = max(state[j], value)
+    result = []
+    for key, state in sorted(merged.items(),
+                             key=lambda item: [(k is None, k)
+                                               for k in item[0]]):
+        values = [(s[0] / s[1] if s[1] else None) if c == "avg" else s
+                  for c, s in zip(combiners, state)]
+        result.append((*key, *values))
+    return result
+
+
+# The engine of a worker process, created by _init_worker().
+_engine = None
+
+
+def _init_worker(url):
+    global _engine
+    _engine = create_engine(url)
+
+    @event.listens_for(_engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA query_only = ON")
+
+
+def _run_part(name, start, end):
+    report = REPORTS[name]()
+    with _engine.connect() as connection:
+        return [tuple(row) for row in
+                connection.execute(report.query(start, end))]
+
+
+def report_pool(url=None, workers=None):
+    """Returns a process pool for run_report(), with `workers` processes
+    connected to the database `url`, one per CPU by default. Starting the
+    processes takes time, so a pool should be used for many reports."""
+    if url is None:
+        from db import engine
+        url = engine.url
+    if not isinstance(url, str):
+        url = url.render_as_string(hide_password=False)
+    return ProcessPoolExecutor(workers or os.cpu_count(),
+                               initializer=_init_worker, initargs=(url,))
+
+
+def run_report(name, start, end, period="month", executor=None):
+    """Runs the report `name` over [start, end), one query per month or
+    week, in the pool `executor` made by report_pool(), or in a new pool."""
+    if executor is None:
+        with report_pool() as executor:
+            return run_report(name, start, end, period, executor)
+    report = REPORTS[name]()
+    parts = split_range(start, end, period)
+    partials = executor.map(_run_part, [name] * len(parts), *zip(*parts))
+    return merge(report, partials)
+
+
+def run_single(session, name, start, end):
+    """Runs the report `name` over [start, end) as one query, merged like
+    the partial results of a single part."""
+    report = REPORTS[name]()
+    return merge(report, [session.execute(report.query(start, end)).all()])
+
+
+def main():
+    from db import Session, engine
+
+    parser = argparse.ArgumentParser(
+        description="Run the date range reports in a process pool")
+    parser.add_argument("start", type=datetime.fromisoformat)
+    parser.add_argument("end", type=datetime.fromisoformat)
+    parser.add_argument("--period", choices=("month", "week"),
+                        default="month")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--reports", nargs="+", default=list(REPORTS))
+    args = parser.parse_args()
+
+    print(f"{len(split_range(args.start, args.end, args.period))} parts, "
+          f"{args.workers} workers")
+    with report_pool(engine.url, args.workers) as executor:
+        for name in args.reports:
+            start = time.perf_counter()
+            with Session() as session:
+                single = run_single(session, name, args.start, args.end)
+            single_time = time.perf_counter() - start
+
+            run_report(name, args.start, args.end, args.period, executor)
+            start = time.perf_counter()
+            parallel = run_report(name, args.start, args.end, args.period,
+                                  executor)
+            parallel_time = time.perf_counter() - start
+
+            same = len(single) == len(parallel) and all(
+                all(abs(a - b) < 1e-6 if isinstance(a, float) else a == b
+                    for a, b in zip(r1, r2))
+                for r1, r2 in zip(single, parallel))
+            print(f"{name}: {len(parallel)} rows, one query "
+                  f"{single_time * 1000:.1f} ms, process pool "
+                  f"{parallel_time * 1000:.1f} ms, "
+                  f"{'same results' if same else 'DIFFERENT RESULTS'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Measures the migrations on populated databases.
+
+The migrations are written and tested against empty or small databases, so
+it is not known how long they take on a database with years of orders and
+page views. This harness runs every migration, upgrade and downgrade, on
+databases filled with generated rows at several scale factors, and reports
+for each revision:
+
+- the duration of the migration,
+- the lock time: how long other programs could not write to the database,
+  measured by a thread that tries to start a write transaction every few
+  milliseconds while the migration runs, and the longest single wait,
+- the growth of the database file, including the write-ahead log.
+
+For each scale factor a new database is created. Before every upgrade the
+empty tables are filled with `scale` times the rows in `ROWS`, generated
+from the reflected schema, so the migration runs on data in all the tables
+that exist at that revision. After the upgrade the tables created by the
+migration are filled too, and the downgrade is measured, and the database
+is upgraded again for the next revision.
+
+The sync migrations in `migrations/` and the async migrations in
+`async_implementation/migrations/` are run in their own processes, since
+both trees have their own `db` and `models` modules.
+
+Usage: python migration_benchmark.py [--scales 1 10] [--tree .]
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+# The number of rows generated per table at scale 1, DEFAULT_ROWS for the
+# tables that are not listed.
+ROWS = {
+    "blog_views": 20000,
+    "orders_items": 10000,
+    "orders": 4000,
+    "product_reviews": 5000,
+    "blog_sessions": 4000,
+    "blog_users": 2000,
+    "customers": 1000,
+    "blog_articles": 500,
+    "products": 200,
+}
+DEFAULT_ROWS = 50
+
+# Tables that are not filled: the tables of Alembic and of the full-text
+# search, which are filled by triggers, and single row state tables.
+SKIP = ("alembic_version", "search_fts_suspended", "blog_view_counter_state")
+
+TREES = (".", "async_implementation")
+
+
+class LockProbe:
+    """Measures how long the database is locked for writers, by trying to
+    start a write transaction every `interval` seconds in a thread."""
+
+    def __init__(self, path, interval=0.002):
+        self.path = path
+        self.interval = interval
+        self.locked = 0.0
+        self.longest = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        connection = sqlite3.connect(self.path, timeout=0,
+                                     isolation_level=None)
+        since = None
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute("ROLLBACK")
+                if since is not None:
+                    self._add(now - since)
+                    since = None
+            except sqlite3.OperationalError:
+                if since is None:
+                    since = now
+            time.sleep(self.interval)
+        if since is not None:
+            self._add(time.perf_counter() - since)
+        connection.close()
+
+    def _add(self, span):
+        self.locked += span
+        self.longest = max(self.longest, span)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def file_size(path):
+    return sum(p.stat().st_size
+               for p in (Path(path), Path(f"{path}-wal")) if p.exists())
+
+
+def _value(column, i, rng, start):
+    """A generated value for a column that is not a foreign key."""
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = str
+    if python_type is bool:
+        return rng.random() < 0.5
+    if python_type is int:
+        return rng.randint(1, 5)
+    if python_type is float:
+        return round(rng.uniform(1, 1000), 2)
+    if python_type is datetime:
+        return start + timedelta(seconds=rng.randint(0, 3 * 365 * 86400))
+    if python_type is date:
+        return (start + timedelta(days=rng.randint(0, 3 * 365))).date()
+    if python_type is uuid.UUID or getattr(column.type, "length", None) == 32:
+        return uuid.UUID(int=rng.getrandbits(128)).hex
+    length = getattr(column.type, "length", None) or 64
+    return f"{column.name} {i}"[:length]
+
+
+def populate(path, scale, seed=0):
+    """Fills the empty tables of the database with generated rows. Returns
+    the names of the tables that were filled."""
+    from sqlalchemy import MetaData, create_engine, func, insert, select
+
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    engine = create_engine(f"sqlite:///{path}")
+    metadata = MetaData()
+    filled = []
+    with engine.begin() as connection:
+        metadata.reflect(connection)
+        for table in metadata.sorted_tables:
+            if table.name in SKIP or "_fts" in table.name:
+                continue
+            if connection.scalar(select(func.count()).select_from(table)):
+                continue
+            keys = {}
+            for fk in table.foreign_keys:
+                referred = fk.column
+                if referred.table is table:
+                    continue
+                keys[fk.parent.name] = connection.scalars(
+                    select(referred).limit(100000)).all()
+            autoincrement = [c.name for c in table.primary_key.columns
+                             if len(table.primary_key.columns) == 1
+                             and c.type.python_type is int]
+            count = ROWS.get(table.name, DEFAULT_ROWS) * scale
+            rows = []
+            for i in range(count):
+                row = {}
+                for column in table.columns:
+                    if column.name in autoincrement:
+                        continue
+                    if column.name in keys:
+                        choices = keys[column.name]
+                        row[column.name] = (
+                            rng.choice(choices) if choices and not (
+                                column.nullable and rng.random() < 0.2)
+                            else None)
+                    elif column.foreign_keys:
+                        row[column.name] = None  # refers to its own table
+                    else:
+                        row[column.name] = _value(column, i, rng, start)
+                rows.append(row)
+            for n in range(0, len(rows), 10000):
+                connection.execute(insert(table).prefix_with("OR IGNORE"),
+                                   rows[n:n + 10000])
+            filled.append(table.name)
+    engine.dispose()
+    return filled
+
+
+def measure(path, fn):
+    """Runs `fn` and returns the seconds, the lock time, the longest lock
+    and the file size before and after."""
+    size = file_size(path)
+    with LockProbe(path) as probe:
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+    return elapsed, probe.locked, probe.longest, size, file_size(path)
+
+
+def benchmark_tree(tree, scales):
+    """Runs the migrations of `tree` at every scale, in this process."""
+    from alembic import command
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    name = tree
+    tree = Path(tree).resolve()
+    os.chdir(tree)
+    sys.path.insert(0, str(tree))
+    import db
+
+    # No alembic.ini, so env.py does not set up the logging of Alembic.
+    config = Config()
+    config.set_main_option("script_location", str(tree / "migrations"))
+    revisions = [r.revision for r in
+                 reversed(list(ScriptDirectory.from_config(config)
+                               .walk_revisions()))]
+    is_async = (tree / "migrations" / "env.py").read_text().count(
+        "async_engine_from_config") > 0
+    driver = "sqlite+aiosqlite" if is_async else "sqlite"
+
+    print(f"{name}: {len(revisions)} revisions")
+    print(f"{'scale':>5}  {'revision':<14}{'':<10}{'seconds':>9}"
+          f"{'locked':>9}{'longest':>9}{'size MB':>16}")
+    durations = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in scales:
+            path = Path(directory) / f"scale{scale}.sqlite"
+            db.configure(url=f"{driver}:///{path}")
+            previous = "base"
+            for revision in revisions:
+                populate(path, scale)
+                results = [("upgrade", measure(
+                    path, lambda: command.upgrade(config, revision)))]
+                populate(path, scale)
+                results.append(("downgrade", measure(
+                    path, lambda: command.downgrade(config, previous))))
+                command.upgrade(config, revision)
+                for direction, (seconds, locked, longest, before,
+                                after) in results:
+                    durations[revision, direction, scale] = seconds
+                    print(f"{scale:>5}  {revision:<14}{direction:<10}"
+                          f"{seconds:>9.3f}{locked:>9.3f}{longest:>9.3f}"
+                          f"{before / 1e6:>8.1f} -> {after / 1e6:<5.1f}")
+                previous = revision
+
+    if len(scales) > 1:
+        # How the duration grows with the data: 1.0 per scale step is
+        # linear, and a production upgrade takes about the duration at the
+        # largest scale times the ratio of the sizes.
+        small, large = min(scales), max(scales)
+        print(f"Duration growth from scale {small} to {large}, relative to "
+              f"linear growth ({large / small:g}x):")
+        for revision in revisions:
+            ratios = [
+                durations[revision, direction, large]
+                / durations[revision, direction, small] / (large / small)
+                for direction in ("upgrade", "downgrade")]
+            print(f"       {revision:<14}upgrade {ratios[0]:.2f}, "
+                  f"downgrade {ratios[1]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the migrations on populated databases")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--tree", choices=TREES,
+                        help="only the migrations of this tree")
+    args = parser.parse_args()
+
+    if args.tree is not None:
+        benchmark_tree(args.tree, args.scales)
+        return
+    for tree in TREES:
+        subprocess.run([sys.executable, str(Path(__file__).resolve()),
+                        "--tree", tree,
+                        "--scales", *map(str, args.scales)],
+                       cwd=Path(__file__).parent, check=True)
+
+
+if __name__ == "__main__":
+    main()
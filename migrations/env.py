@@ -1,3 +1,4 @@
+import re
 from logging.config import fileConfig
 
 from alembic import context
@@ -27,6 +28,19 @@ config.set_main_option(
     "sqlalchemy.url", engine.url.render_as_string(hide_password=False)
 )
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keeps autogenerate from dropping the tables that are not part of the
+    models: the full-text search tables, the shadow tables created by FTS5
+    and `search_fts_suspended`, and the monthly page view tables created by
+    view_partitions.py.
+    """
+    if type_ == "table" and reflected:
+        if "_fts" in name or re.match(r"^blog_views_\d{6}$", name):
+            return False
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -51,6 +65,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -72,7 +87,10 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata, render_as_batch=True
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=True,
+            include_object=include_object,
         )
 
         with context.begin_transaction():
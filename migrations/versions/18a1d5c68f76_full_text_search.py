@@ -0,0 +1,117 @@
+"""full-text search
+
+Revision ID: 18a1d5c68f76
+Revises: f068e2daa468
+Create Date: 2026-10-19 09:12:44.310526
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '18a1d5c68f76'
+down_revision: Union[str, Sequence[str], None] = 'f068e2daa468'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Alembic cannot autogenerate virtual tables and triggers, so this migration
+# is written by hand. See search.py for a description of the tables.
+TRIGGERS = [
+    """
+    CREATE TRIGGER blog_articles_fts_insert AFTER INSERT ON blog_articles
+    WHEN NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        INSERT INTO blog_articles_fts (rowid, title)
+        VALUES (new.id, new.title);
+    END""",
+    """
+    CREATE TRIGGER blog_articles_fts_delete AFTER DELETE ON blog_articles
+    WHEN NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        INSERT INTO blog_articles_fts (blog_articles_fts, rowid, title)
+        VALUES ('delete', old.id, old.title);
+    END""",
+    """
+    CREATE TRIGGER blog_articles_fts_update
+    AFTER UPDATE OF title ON blog_articles
+    WHEN NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        INSERT INTO blog_articles_fts (blog_articles_fts, rowid, title)
+        VALUES ('delete', old.id, old.title);
+        INSERT INTO blog_articles_fts (rowid, title)
+        VALUES (new.id, new.title);
+    END""",
+    """
+    CREATE TRIGGER product_reviews_fts_insert
+    AFTER INSERT ON product_reviews
+    WHEN new.comment IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        INSERT INTO product_reviews_fts (comment, product_id, customer_id)
+        VALUES (new.comment, new.product_id, new.customer_id);
+    END""",
+    """
+    CREATE TRIGGER product_reviews_fts_delete
+    AFTER DELETE ON product_reviews
+    WHEN old.comment IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        DELETE FROM product_reviews_fts
+        WHERE product_id = old.product_id
+        AND customer_id = old.customer_id;
+    END""",
+    """
+    CREATE TRIGGER product_reviews_fts_update
+    AFTER UPDATE OF comment ON product_reviews
+    WHEN NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        DELETE FROM product_reviews_fts
+        WHERE product_id = old.product_id
+        AND customer_id = old.customer_id;
+        INSERT INTO product_reviews_fts (comment, product_id, customer_id)
+        SELECT new.comment, new.product_id, new.customer_id
+        WHERE new.comment IS NOT NULL;
+    END""",
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # While this table has a row the triggers do nothing, see
+    # search.bulk_load().
+    op.execute(
+        "CREATE TABLE search_fts_suspended (id INTEGER NOT NULL PRIMARY KEY)")
+    op.execute(
+        "CREATE VIRTUAL TABLE blog_articles_fts USING fts5("
+        "title, content='blog_articles', content_rowid='id', "
+        "tokenize='porter unicode61')"
+    )
+    op.execute(
+        "CREATE VIRTUAL TABLE product_reviews_fts USING fts5("
+        "comment, product_id UNINDEXED, customer_id UNINDEXED, "
+        "tokenize='porter unicode61')"
+    )
+    for trigger in TRIGGERS:
+        op.execute(trigger)
+
+    # Index the rows that already exist.
+    op.execute(
+        "INSERT INTO blog_articles_fts (blog_articles_fts) VALUES ('rebuild')")
+    op.execute(
+        "INSERT INTO product_reviews_fts (comment, product_id, customer_id) "
+        "SELECT comment, product_id, customer_id FROM product_reviews "
+        "WHERE comment IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in ['product_reviews_fts_update', 'product_reviews_fts_delete',
+                 'product_reviews_fts_insert', 'blog_articles_fts_update',
+                 'blog_articles_fts_delete', 'blog_articles_fts_insert']:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.execute("DROP TABLE IF EXISTS product_reviews_fts")
+    op.execute("DROP TABLE IF EXISTS blog_articles_fts")
+    op.execute("DROP TABLE IF EXISTS search_fts_suspended")
@@ -0,0 +1,57 @@
+"""calendar keys
+
+Revision ID: 64c17b37c484
+Revises: dab3c25c6c98
+Create Date: 2026-10-19 18:08:57.659579
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from online_rebuild import rebuild_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '64c17b37c484'
+down_revision: Union[str, Sequence[str], None] = 'dab3c25c6c98'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The values of the new columns for the existing rows, see models.py.
+KEYS = {
+    'day_key': "CAST(strftime('%Y%m%d', timestamp) AS INTEGER)",
+    'month_key': "CAST(strftime('%Y%m', timestamp) AS INTEGER)",
+}
+
+# The tables, with the entity id that the keys are indexed with.
+TABLES = {
+    'orders': 'customer_id',
+    'product_reviews': 'product_id',
+    'blog_views': 'article_id',
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The columns are NOT NULL, which SQLite cannot add to a table with rows,
+    # so the tables are rebuilt with the keys computed from the timestamps,
+    # in chunks, see online_rebuild.py.
+    for name, entity_id in TABLES.items():
+        table = sa.Table(name, sa.MetaData(), autoload_with=op.get_bind())
+        for key in KEYS:
+            table.append_column(sa.Column(key, sa.Integer(), nullable=False))
+            sa.Index(f'ix_{name}_{key}_{entity_id}',
+                     table.c[key], table.c[entity_id])
+        rebuild_table(table, expressions=KEYS)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # SQLite drops the columns in place, which keeps the triggers of the
+    # tables, such as the full-text search triggers of product_reviews.
+    for name, entity_id in reversed(TABLES.items()):
+        for key in reversed(KEYS):
+            op.drop_index(f'ix_{name}_{key}_{entity_id}', table_name=name)
+            op.drop_column(name, key)
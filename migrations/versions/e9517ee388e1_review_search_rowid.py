@@ -0,0 +1,120 @@
+"""review search rowid
+
+Revision ID: e9517ee388e1
+Revises: 53085d3eb473
+Create Date: 2026-10-19 18:21:50.265591
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9517ee388e1'
+down_revision: Union[str, Sequence[str], None] = '53085d3eb473'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The review search table was keyed on product_id and customer_id, which are
+# UNINDEXED columns of the search table, so the triggers scanned the whole
+# search table for every review that was deleted or updated. The search rows
+# now have the rowid of their review, and are deleted by rowid.
+SEARCH_TABLE = (
+    "CREATE VIRTUAL TABLE product_reviews_fts USING fts5("
+    "comment, product_id UNINDEXED, customer_id UNINDEXED, "
+    "tokenize='porter unicode61')"
+)
+
+TRIGGERS = [
+    """
+    CREATE TRIGGER product_reviews_fts_insert
+    AFTER INSERT ON product_reviews
+    WHEN new.comment IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        INSERT INTO product_reviews_fts
+        (rowid, comment, product_id, customer_id)
+        VALUES (new.rowid, new.comment, new.product_id, new.customer_id);
+    END""",
+    """
+    CREATE TRIGGER product_reviews_fts_delete
+    AFTER DELETE ON product_reviews
+    WHEN old.comment IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        DELETE FROM product_reviews_fts WHERE rowid = old.rowid;
+    END""",
+    """
+    CREATE TRIGGER product_reviews_fts_update
+    AFTER UPDATE OF comment ON product_reviews
+    WHEN NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        DELETE FROM product_reviews_fts WHERE rowid = old.rowid;
+        INSERT INTO product_reviews_fts
+        (rowid, comment, product_id, customer_id)
+        SELECT new.rowid, new.comment, new.product_id, new.customer_id
+        WHERE new.comment IS NOT NULL;
+    END""",
+]
+
+# The triggers of migration 18a1d5c68f76, for the downgrade.
+OLD_TRIGGERS = [
+    """
+    CREATE TRIGGER product_reviews_fts_insert
+    AFTER INSERT ON product_reviews
+    WHEN new.comment IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        INSERT INTO product_reviews_fts (comment, product_id, customer_id)
+        VALUES (new.comment, new.product_id, new.customer_id);
+    END""",
+    """
+    CREATE TRIGGER product_reviews_fts_delete
+    AFTER DELETE ON product_reviews
+    WHEN old.comment IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        DELETE FROM product_reviews_fts
+        WHERE product_id = old.product_id
+        AND customer_id = old.customer_id;
+    END""",
+    """
+    CREATE TRIGGER product_reviews_fts_update
+    AFTER UPDATE OF comment ON product_reviews
+    WHEN NOT EXISTS (SELECT 1 FROM search_fts_suspended)
+    BEGIN
+        DELETE FROM product_reviews_fts
+        WHERE product_id = old.product_id
+        AND customer_id = old.customer_id;
+        INSERT INTO product_reviews_fts (comment, product_id, customer_id)
+        SELECT new.comment, new.product_id, new.customer_id
+        WHERE new.comment IS NOT NULL;
+    END""",
+]
+
+
+def _recreate(triggers, with_rowid):
+    for name in ['product_reviews_fts_update', 'product_reviews_fts_delete',
+                 'product_reviews_fts_insert']:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.execute("DROP TABLE IF EXISTS product_reviews_fts")
+    op.execute(SEARCH_TABLE)
+    for trigger in triggers:
+        op.execute(trigger)
+    rowid = "rowid, " if with_rowid else ""
+    op.execute(
+        f"INSERT INTO product_reviews_fts ({rowid}comment, product_id, "
+        f"customer_id) SELECT {rowid}comment, product_id, customer_id "
+        "FROM product_reviews WHERE comment IS NOT NULL"
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _recreate(TRIGGERS, with_rowid=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _recreate(OLD_TRIGGERS, with_rowid=False)
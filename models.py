@@ -1,9 +1,11 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from typing import Optional
 from uuid import UUID, uuid4
 
-from sqlalchemy import Column, ForeignKey, String, Table, Text
-from sqlalchemy.orm import Mapped, WriteOnlyMapped, mapped_column, relationship
+from sqlalchemy import (Column, ForeignKey, Index, String, Table, Text, event,
+                        func, select)
+from sqlalchemy.orm import (Mapped, WriteOnlyMapped, column_property,
+                            mapped_column, relationship)
 
 from db import Model
 
@@ -31,6 +33,65 @@ ProductCountry = Table(
 )
 
 
+# The CPU families of the products, see cpu_families.py.
+ProductCpuFamily = Table(
+    "products_cpu_families",
+    Model.metadata,
+    Column("product_id", ForeignKey("products.id"),
+           primary_key=True, nullable=False),
+    Column("cpu_family_id", ForeignKey("cpu_families.id"),
+           primary_key=True, nullable=False, index=True),
+)
+
+
+# Orders, product reviews and blog views are reported by day and by month.
+# Grouping by `strftime()` or `extract()` of the timestamp computes the
+# expression for every row and cannot use an index, so these tables also
+# store the day and the month of the timestamp as integers, 20220315 and
+# 202203 for 2022-03-15, in indexed `day_key` and `month_key` columns:
+#
+#     select(BlogView.month_key, func.count())
+#     .where(BlogView.month_key.between(202201, 202212))
+#     .group_by(BlogView.month_key)
+#
+# The keys are computed from the timestamp when a row is inserted, also with
+# `insert()` on the table, and when the timestamp of an object is changed.
+# The month number of a key is `month_key % 100`, the day number is
+# `day_key % 100`.
+def to_day_key(timestamp):
+    return timestamp.year * 10000 + timestamp.month * 100 + timestamp.day
+
+
+def to_month_key(timestamp):
+    return timestamp.year * 100 + timestamp.month
+
+
+# The keys computed from the timestamp in SQL, for the rows of tables that
+# were created before the keys and are not upgraded by the migrations, such
+# as the tables of sharding.py and view_partitions.py.
+CALENDAR_KEYS_SQL = {
+    "day_key": "CAST(strftime('%Y%m%d', timestamp) AS INTEGER)",
+    "month_key": "CAST(strftime('%Y%m', timestamp) AS INTEGER)",
+}
+
+
+def _from_timestamp(to_key):
+    def default(context):
+        return to_key(context.get_current_parameters()["timestamp"])
+    return default
+
+
+def _calendar_keys(model):
+    """Keeps the keys of `model` up to date when the timestamp of an object
+    is set."""
+    @event.listens_for(model.timestamp, "set")
+    def set_keys(target, value, oldvalue, initiator):
+        if value is not None:
+            target.day_key = to_day_key(value)
+            target.month_key = to_month_key(value)
+    return model
+
+
 class Product(Model):
     __tablename__ = "products"
 
@@ -58,6 +119,12 @@ class Product(Model):
         secondary=ProductCountry, back_populates="products"
     )
     cpu: Mapped[Optional[str]] = mapped_column(String(32))
+    # The free text `cpu` column is classified into CPU families when the
+    # product is imported, see cpu_families.py. A product with more than one
+    # CPU has more than one family. Filtering on a family is an indexed join
+    # instead of a `LIKE` scan over `cpu`.
+    cpu_families: Mapped[list["CpuFamily"]] = relationship(
+        secondary="products_cpu_families", back_populates="products")
 
     # The relationship between orders and products is, as products and
     # countries, a many-to-many relationship. But since the orderitems table
@@ -119,13 +186,34 @@ class Country(Model):
         return f'Country({self.id}, "{self.name}")'
 
 
+class CpuFamily(Model):
+    __tablename__ = "cpu_families"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(32), index=True, unique=True)
+
+    products: WriteOnlyMapped["Product"] = relationship(
+        secondary="products_cpu_families", back_populates="cpu_families")
+
+    def __repr__(self):
+        return f'CpuFamily({self.id}, "{self.name}")'
+
+
+@_calendar_keys
 class Order(Model):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_day_key_customer_id", "day_key", "customer_id"),
+        Index("ix_orders_month_key_customer_id", "month_key", "customer_id"),
+    )
 
     id: Mapped[UUID] = mapped_column(default=uuid4, primary_key=True)
     timestamp: Mapped[datetime] = mapped_column(
         default=lambda: datetime.now(timezone.utc), index=True
     )
+    day_key: Mapped[int] = mapped_column(default=_from_timestamp(to_day_key))
+    month_key: Mapped[int] = mapped_column(
+        default=_from_timestamp(to_month_key))
     customer_id: Mapped[UUID] = mapped_column(
         ForeignKey("customers.id"), index=True)
     customer: Mapped["Customer"] = relationship(back_populates="orders")
@@ -170,8 +258,10 @@ class OrderItem(Model):
 
     product_id: Mapped[int] = mapped_column(
         ForeignKey("products.id"), primary_key=True)
+    # The primary key starts with product_id, so finding the items of an
+    # order needs its own index.
     order_id: Mapped[UUID] = mapped_column(
-        ForeignKey("orders.id"), primary_key=True)
+        ForeignKey("orders.id"), primary_key=True, index=True)
 
     product: Mapped["Product"] = relationship(back_populates="order_items")
     order: Mapped["Order"] = relationship(back_populates="order_items")
@@ -180,8 +270,34 @@ class OrderItem(Model):
     quantity: Mapped[int]
 
 
+# The value of an order and its number of items are correlated subqueries
+# on `orders_items`, so they can also be used in filters and ordering. They
+# are deferred: name them in `undefer()` or `load_only()`, or use
+# `load_totals()` from loading.py for a list of orders.
+Order.total = column_property(
+    select(func.coalesce(func.sum(OrderItem.unit_price * OrderItem.quantity),
+                         0.0))
+    .where(OrderItem.order_id == Order.id)
+    .correlate_except(OrderItem)
+    .scalar_subquery(),
+    deferred=True)
+Order.item_count = column_property(
+    select(func.coalesce(func.sum(OrderItem.quantity), 0))
+    .where(OrderItem.order_id == Order.id)
+    .correlate_except(OrderItem)
+    .scalar_subquery(),
+    deferred=True)
+
+
+@_calendar_keys
 class ProductReview(Model):
     __tablename__ = "product_reviews"
+    __table_args__ = (
+        Index("ix_product_reviews_day_key_product_id",
+              "day_key", "product_id"),
+        Index("ix_product_reviews_month_key_product_id",
+              "month_key", "product_id"),
+    )
 
     product_id: Mapped[int] = mapped_column(
         ForeignKey("products.id"), primary_key=True)
@@ -191,6 +307,9 @@ class ProductReview(Model):
     timestamp: Mapped[datetime] = mapped_column(
         default=lambda: datetime.now(timezone.utc), index=True
     )
+    day_key: Mapped[int] = mapped_column(default=_from_timestamp(to_day_key))
+    month_key: Mapped[int] = mapped_column(
+        default=_from_timestamp(to_month_key))
     rating: Mapped[int]
     comment: Mapped[str | None] = mapped_column(Text)
 
@@ -214,6 +333,14 @@ class BlogArticle(Model):
         remote_side=id, back_populates="translations")
     translations: Mapped[list["BlogArticle"]] = relationship(
         back_populates="translation_of")
+    # Following `translation_of` from article to article to find all the
+    # versions of an article needs one query per step. Instead the id of the
+    # root article (the one that is not a translation) is stored on every
+    # article of the group, and the root stores the number of translations
+    # in the group. Both are maintained by translations.py.
+    translation_group_id: Mapped[int | None] = mapped_column(index=True)
+    translation_count: Mapped[int] = mapped_column(
+        default=0, server_default="0", index=True)
     title: Mapped[str] = mapped_column(String(128), index=True)
     author_id: Mapped[int] = mapped_column(
         ForeignKey("blog_authors.id"), index=True)
@@ -281,19 +408,50 @@ class BlogSession(Model):
         return f"BlogSession({self.id.hex})"
 
 
+@_calendar_keys
 class BlogView(Model):
     __tablename__ = "blog_views"
+    __table_args__ = (
+        Index("ix_blog_views_day_key_article_id", "day_key", "article_id"),
+        Index("ix_blog_views_month_key_article_id",
+              "month_key", "article_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     article_id: Mapped[int] = mapped_column(ForeignKey("blog_articles.id"))
     sesion_id: Mapped[UUID] = mapped_column(ForeignKey("blog_sessions.id"))
     timestamp: Mapped[datetime] = mapped_column(
         default=lambda: datetime.now(timezone.utc), index=True)
+    day_key: Mapped[int] = mapped_column(default=_from_timestamp(to_day_key))
+    month_key: Mapped[int] = mapped_column(
+        default=_from_timestamp(to_month_key))
 
     article: Mapped["BlogArticle"] = relationship(back_populates="views")
     session: Mapped["BlogSession"] = relationship(back_populates="views")
 
 
+class BlogViewCounter(Model):
+    """The number of views of an article on a day, maintained by
+    view_counters.py from the rows in `blog_views`."""
+    __tablename__ = "blog_view_counters"
+
+    article_id: Mapped[int] = mapped_column(
+        ForeignKey("blog_articles.id"), primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True, index=True)
+    language_id: Mapped[int | None] = mapped_column(
+        ForeignKey("languages.id"), index=True)
+    views: Mapped[int]
+
+
+class BlogViewCounterState(Model):
+    """A single row with the id of the last `blog_views` row that is
+    included in `blog_view_counters`."""
+    __tablename__ = "blog_view_counter_state"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    last_view_id: Mapped[int]
+
+
 class Language(Model):
     __tablename__ = "languages"
 
@@ -0,0 +1,322 @@
+"""Online rebuilds of large tables, for migrations.
+
+SQLite can only add columns to a table, and a migration with
+`batch_alter_table()` that changes a column copies the whole table with a
+single INSERT ... SELECT in the transaction of the migration. While it runs
+nothing else can write to the database, which for `blog_views` or `orders`
+can be a long time.
+
+`rebuild_table()` copies the table in chunks instead, each chunk in its own
+short transaction, so other programs can write between the chunks:
+
+1. the new table is created as `<name>__new`, without its indexes,
+2. triggers on the old table apply every insert, update and delete to the
+   new table, so the rows written during the copy are not lost,
+3. the rows are copied in chunks of `chunk_size` rows in primary key order,
+   with INSERT OR REPLACE, since a trigger may have copied a row already,
+4. in one last transaction the old table is dropped, the new table is
+   renamed, and the indexes and the other triggers of the table (such as
+   the full-text search triggers) are created.
+
+Only the last step locks the database for longer than a chunk, for the
+time it takes to build the indexes.
+
+In a migration the new table is described with `sa.Table`, and the new
+columns get their values from SQL `expressions` over the old columns. The
+other columns are copied as they are:
+
+    from online_rebuild import rebuild_table
+
+    def upgrade():
+        rebuild_table(
+            sa.Table("blog_views", sa.MetaData(),
+                     sa.Column("id", sa.Integer(), primary_key=True),
+                     ...,
+                     sa.Column("day", sa.Integer(), nullable=False),
+                     sa.Index("ix_blog_views_day", "day")),
+            expressions={"day": "CAST(strftime('%Y%m%d', timestamp) AS INTEGER)"})
+
+The migration must not have other changes to the same table, since
+`rebuild_table()` commits the transaction of the migration before it
+starts, see Alembic's `autocommit_block()`. Foreign keys are not checked
+while the tables are swapped, they are checked with
+`PRAGMA foreign_key_check` at the end.
+
+The rowids of the rows are kept, also for tables without an INTEGER
+PRIMARY KEY, where the rowid is not a column, so that tables that refer to
+the rows by rowid, like the external content full-text search tables, stay
+valid.
+
+The async implementation has a copy of this file for its migrations, which
+run on a synchronous connection too.
+
+Running this file rebuilds `blog_views` of the database in DATABASE_URL
+while another thread adds views, and checks that no view is lost.
+"""
+
+import re
+import time
+
+from sqlalchemy import inspect, schema
+
+# The start of a CREATE TRIGGER statement, up to the name of the trigger.
+_CREATE_TRIGGER = re.compile(
+    r"^\s*CREATE\s+TRIGGER\s+(IF\s+NOT\s+EXISTS\s+)?", re.IGNORECASE)
+
+
+def _quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def _has_hidden_rowid(connection, table):
+    """Whether the rows of `table` have a rowid that is not one of its
+    columns. An INTEGER PRIMARY KEY column is the rowid itself."""
+    if not table.dialect_options["sqlite"]["with_rowid"]:
+        return False
+    pk = list(table.primary_key.columns)
+    return not (len(pk) == 1 and pk[0].type.compile(
+        dialect=connection.dialect).upper() == "INTEGER")
+
+
+def _print_progress(table, copied, total):
+    print(f"{table}: {copied}/{total} rows copied")
+
+
+def rebuild_table(table, expressions=None, chunk_size=10000, pause=0.0,
+                  progress=None, connection=None):
+    """Rebuilds `table.name` with the definition of `table`, see the module
+    documentation. Returns the number of rows copied by the chunks.
+
+    `pause` is the number of seconds to wait between the chunks, which
+    leaves more time to the other writers. `progress`, if given, is called
+    after every chunk with the table name, the rows copied and the rows in
+    the table.
+
+    In a migration the connection of the migration is used. Outside of a
+    migration, pass a `connection` that is not in a transaction.
+    """
+    if connection is None:
+        from alembic import op
+        with op.get_context().autocommit_block():
+            return _rebuild(op.get_bind(), table, expressions or {},
+                            chunk_size, pause, progress)
+    connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+    return _rebuild(connection, table, expressions or {}, chunk_size, pause,
+                    progress)
+
+
+def _rebuild(connection, table, expressions, chunk_size, pause, progress):
+    def sql(statement, parameters=None):
+        return connection.exec_driver_sql(statement, parameters or ())
+
+    name = table.name
+    new_name = f"{name}__new"
+    old = _quote(connection, name)
+    new = _quote(connection, new_name)
+    # The tables of an attached database, such as an archive, are qualified
+    # with its schema name, except in the triggers, where the tables are
+    # always in the database of the trigger.
+    prefix = f"{_quote(connection, table.schema)}." if table.schema else ""
+    pk = [_quote(connection, c.name) for c in table.primary_key.columns]
+    if not pk:
+        raise ValueError(f"{name} has no primary key")
+    columns = [_quote(connection, c.name) for c in table.columns]
+    values = [expressions.get(c.name, _quote(connection, c.name))
+              for c in table.columns]
+    if _has_hidden_rowid(connection, table):
+        columns.insert(0, "rowid")
+        values.insert(0, "rowid")
+    def copy(into, source):
+        return (f"INSERT OR REPLACE INTO {into} ({', '.join(columns)}) "
+                f"SELECT {', '.join(values)} FROM {source}")
+
+    # The other triggers are dropped with the old table, and created again
+    # on the new one.
+    triggers = [row[0] for row in sql(
+        f"SELECT sql FROM {prefix}sqlite_master WHERE type = 'trigger' "
+        "AND tbl_name = ? AND name NOT LIKE ?", (name, f"{name}__rebuild%"))]
+    if prefix:
+        triggers = [_CREATE_TRIGGER.sub(lambda m: m[0] + prefix, trigger)
+                    for trigger in triggers]
+
+    # 1. The new table, without its indexes, which would have the same
+    # names as the indexes of the old table.
+    metadata = schema.MetaData()
+    new_table = table.to_metadata(metadata, name=new_name)
+    # The tables that the foreign keys refer to must be in the metadata to
+    # compile the CREATE TABLE, only with the referred columns.
+    for fk in new_table.foreign_keys:
+        referred, column = fk.target_fullname.rsplit(".", 1)
+        referred_table = metadata.tables.get(referred)
+        if referred_table is None:
+            referred_table = schema.Table(referred, metadata)
+        if column not in referred_table.c:
+            referred_table.append_column(schema.Column(
+                column, table.c[fk.parent.name].type))
+    for index in list(new_table.indexes):
+        new_table.indexes.discard(index)
+    sql(str(schema.CreateTable(new_table).compile(connection)))
+
+    # 2. Triggers that copy the changes made during the copy.
+    def match(prefix):
+        return " AND ".join(f"{c} = {prefix}.{c}" for c in pk)
+
+    for event, actions in (
+            ("INSERT", [f"{copy(new, old)} WHERE {match('NEW')};"]),
+            ("UPDATE", [f"DELETE FROM {new} WHERE {match('OLD')};",
+                        f"{copy(new, old)} WHERE {match('NEW')};"]),
+            ("DELETE", [f"DELETE FROM {new} WHERE {match('OLD')};"])):
+        trigger = _quote(connection, f"{name}__rebuild_{event.lower()}")
+        sql(f"CREATE TRIGGER {prefix}{trigger} AFTER {event} ON {old} "
+            f"BEGIN {' '.join(actions)} END")
+
+    # 3. The rows in chunks, each chunk in its own transaction. The last key
+    # of a chunk is looked up first, so the chunk is copied with a range
+    # condition on the primary key.
+    total = sql(f"SELECT count(*) FROM {prefix}{old}").scalar()
+    order = ", ".join(pk)
+    key = f"({order})" if len(pk) > 1 else order
+    last = None
+    copied = 0
+    while True:
+        after = (f"WHERE {key} > ({', '.join('?' * len(pk))})"
+                 if last is not None else "")
+        end = sql(f"SELECT {order} FROM {prefix}{old} {after} "
+                  f"ORDER BY {order} "
+                  f"LIMIT 1 OFFSET {chunk_size - 1}", last).first()
+        through = (f"{key} <= ({', '.join('?' * len(pk))})"
+                   if end is not None else "1")
+        where = " AND ".join(filter(None, [after.removeprefix("WHERE "),
+                                           through]))
+        result = sql(f"{copy(prefix + new, prefix + old)} WHERE {where}",
+                     tuple(last or ()) + tuple(end or ()))
+        copied += result.rowcount
+        # The last chunk is empty when the rows fill the chunks exactly,
+        # its progress would be the same as the one of the chunk before.
+        if progress is not None and (result.rowcount or last is None):
+            progress(name, copied, total)
+        if end is None:
+            break
+        last = tuple(end)
+        time.sleep(pause)
+
+    # 4. The swap. Dropping the old table would delete the rows that refer
+    # to it if the foreign keys were enforced.
+    foreign_keys = sql("PRAGMA foreign_keys").scalar()
+    sql("PRAGMA foreign_keys = OFF")
+    sql("BEGIN IMMEDIATE")
+    try:
+        sql(f"DROP TABLE {prefix}{old}")
+        sql(f"ALTER TABLE {prefix}{new} RENAME TO {old}")
+        for index in table.indexes:
+            sql(str(schema.CreateIndex(index).compile(connection)))
+        for trigger in triggers:
+            sql(trigger)
+        problems = sql(f"PRAGMA {prefix}foreign_key_check({old})").all()
+        if problems:
+            raise RuntimeError(
+                f"{len(problems)} rows of {name} break a foreign key")
+        sql("COMMIT")
+    except Exception:
+        sql("ROLLBACK")
+        raise
+    finally:
+        sql(f"PRAGMA foreign_keys = {foreign_keys}")
+    return copied
+
+
+def upgrade_table(table, expressions, connection, **options):
+    """Brings a table that is not managed by the migrations up to the
+    definition of `table`: when columns are missing the table is rebuilt
+    with `rebuild_table()`, which computes them from `expressions`, and the
+    missing indexes are created. `connection` must not be in a transaction,
+    `options` are passed to `rebuild_table()`."""
+    existing = {c["name"] for c in inspect(connection).get_columns(
+        table.name, schema=table.schema)}
+    missing = [c.name for c in table.columns if c.name not in existing]
+    # The inspection began a transaction.
+    connection.rollback()
+    if missing:
+        rebuild_table(table, {name: expressions[name] for name in missing},
+                      connection=connection, **options)
+        return
+    connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def main():
+    import sqlite3
+    import threading
+    from datetime import datetime, timezone
+    from pathlib import Path
+
+    from sqlalchemy import (Column, Integer, MetaData, create_engine, func,
+                            insert, select)
+
+    from db import engine
+    from models import BlogView
+
+    # The rebuild runs on a copy of the database.
+    path = Path(engine.url.database)
+    copy_path = path.with_name(f"{path.stem}_rebuild.sqlite")
+    with sqlite3.connect(path) as source, \
+            sqlite3.connect(copy_path) as target:
+        source.backup(target)
+    scratch = create_engine(engine.url.set(database=str(copy_path)))
+
+    # blog_views with a `day` column, as an example of a change.
+    table = BlogView.__table__.to_metadata(MetaData())
+    table.append_column(Column("day", Integer))
+    views = BlogView.__table__
+
+    with scratch.connect() as connection:
+        before = connection.scalar(select(func.count()).select_from(views))
+        article_id, sesion_id = connection.execute(
+            select(views.c.article_id, views.c.sesion_id).limit(1)).one()
+
+    # Views added while the table is rebuilt.
+    stop = threading.Event()
+    added = 0
+
+    def writer():
+        nonlocal added
+        while not stop.is_set():
+            with scratch.begin() as connection:
+                connection.execute(insert(views).values(
+                    article_id=article_id, sesion_id=sesion_id,
+                    timestamp=datetime.now(timezone.utc)))
+            added += 1
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    start = time.perf_counter()
+    try:
+        with scratch.connect() as connection:
+            rebuild_table(table, expressions={
+                "day": "CAST(strftime('%Y%m%d', timestamp) AS INTEGER)"},
+                chunk_size=1000, pause=0.02, progress=_print_progress,
+                connection=connection)
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        thread.join()
+
+    with scratch.connect() as connection:
+        after = connection.scalar(select(func.count()).select_from(views))
+        # The views added after the swap have no day, since the writer does
+        # not know about the new column.
+        wrong_days = connection.exec_driver_sql(
+            "SELECT count(*) FROM blog_views "
+            "WHERE day != CAST(strftime('%Y%m%d', timestamp) AS INTEGER)"
+        ).scalar()
+    scratch.dispose()
+    copy_path.unlink()
+    print(f"Rebuilt blog_views in {elapsed:.2f} s: {before} views before, "
+          f"{added} added during the rebuild, {after} after, "
+          f"{wrong_days} with a wrong day")
+
+
+if __name__ == "__main__":
+    main()
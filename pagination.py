@@ -0,0 +1,118 @@
+"""Keyset (seek) pagination for the time ordered tables.
+
+OFFSET based pagination asks the database to produce and then throw away all
+the rows before the requested page, so the deeper the page the slower the
+query. Keyset pagination instead remembers where the previous page ended and
+asks for the rows that come after that position. With an index on the sort
+column the database can seek directly to that position, so every page costs
+the same regardless of how deep it is.
+
+The rows are ordered by `timestamp` and then by the primary key, the primary
+key is needed as a tie breaker since several rows may share the same
+timestamp. This works for `Order`, `ProductReview` and `BlogView`, which all
+have an indexed `timestamp` column.
+
+The position is handed to the caller as an opaque cursor string, which is
+passed back to get the next page.
+
+Example, the newest orders of a customer, 20 at a time:
+
+    with Session() as session:
+        customer = session.scalar(select(Customer))
+        page = paginate(session, customer.orders.select())
+        while page.next_cursor is not None:
+            page = paginate(session, customer.orders.select(), page.next_cursor)
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, NamedTuple
+
+from sqlalchemy import Select, inspect, tuple_
+from sqlalchemy.orm import Session
+
+
+class Page(NamedTuple):
+    items: list[Any]
+    # None when there are no more rows after this page.
+    next_cursor: str | None
+
+
+def _entity(stmt: Select):
+    entity = stmt.column_descriptions[0]["entity"]
+    if entity is None:
+        raise ValueError("The statement must select a mapped class")
+    return entity
+
+
+def _key_names(entity) -> list[str]:
+    """The attributes that define the order, timestamp first and then the
+    primary key columns as tie breakers."""
+    mapper = inspect(entity)
+    return ["timestamp", *[mapper.get_property_by_column(c).key
+                           for c in mapper.primary_key]]
+
+
+def encode_cursor(entity, obj) -> str:
+    """Encodes the position of `obj` as an opaque cursor."""
+    values = []
+    for name in _key_names(entity):
+        value = getattr(obj, name)
+        values.append(value.isoformat() if isinstance(value, datetime)
+                      else str(value))
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(entity, cursor: str) -> list[Any]:
+    """Decodes a cursor created by `encode_cursor` back to column values."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    names = _key_names(entity)
+    if not isinstance(values, list) or len(values) != len(names):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    decoded = [datetime.fromisoformat(values[0])]
+    for name, value in zip(names[1:], values[1:]):
+        decoded.append(getattr(entity, name).type.python_type(value))
+    return decoded
+
+
+def page_query(stmt: Select, cursor: str | None = None, page_size: int = 20,
+               descending: bool = True) -> Select:
+    """Adds the keyset filter, ordering and limit to `stmt`.
+
+    The statement can be any select of `Order`, `ProductReview` or
+    `BlogView`, including the ones returned by `select()` on a write-only
+    relationship such as `Customer.orders` or `BlogArticle.views`. One extra
+    row is requested to find out if there is a next page.
+    """
+    entity = _entity(stmt)
+    columns = [getattr(entity, name) for name in _key_names(entity)]
+    if cursor is not None:
+        position = tuple_(*columns)
+        values = tuple_(*decode_cursor(entity, cursor))
+        stmt = stmt.where(position < values if descending
+                          else position > values)
+    order = [c.desc() for c in columns] if descending else columns
+    return stmt.order_by(*order).limit(page_size + 1)
+
+
+def make_page(entity, rows: list[Any], page_size: int) -> Page:
+    """Trims the extra row requested by `page_query` and creates the cursor
+    for the next page."""
+    if len(rows) <= page_size:
+        return Page(rows, None)
+    rows = rows[:page_size]
+    return Page(rows, encode_cursor(entity, rows[-1]))
+
+
+def paginate(session: Session, stmt: Select, cursor: str | None = None,
+             page_size: int = 20, descending: bool = True) -> Page:
+    """Returns one page of the rows selected by `stmt`, starting after the
+    position given by `cursor`, or from the beginning if no cursor is given.
+    """
+    q = page_query(stmt, cursor, page_size, descending)
+    rows = list(session.scalars(q))
+    return make_page(_entity(stmt), rows, page_size)
@@ -0,0 +1,284 @@
+"""Read/write routing of sessions to snapshot replicas.
+
+Long running reports and the importers compete for the same SQLite file.
+With the routing session made by `routing_sessionmaker()` the writes go to
+the primary database, and the reads go to a *replica*, a snapshot copy of
+the primary database in a file of its own:
+
+    replicas = ReplicaSet(engine, count=2, max_staleness=30)
+    replicas.refresh()
+    ReadSession = routing_sessionmaker(replicas)
+    with ReadSession() as session:
+        session.scalars(select(Product)).all()   # read from a replica
+
+The replicas are copied with the SQLite online backup API, which makes a
+consistent copy of the primary database while it is in use. A replica is
+updated with `refresh()`, which can be called after commits
+(`refresh_after_commit=True`) or on a schedule with `start(interval)`.
+
+A replica is behind the primary database from the first commit after its
+last refresh. The *staleness* of a replica is the number of seconds since
+that commit, and 0 when nothing has been committed since the refresh. Reads
+only go to replicas that are less than `max_staleness` seconds behind,
+otherwise they go to the primary database, so the staleness of a read is
+bounded. `status()` returns the staleness of every replica and how many
+reads were sent to each.
+
+A transaction reads from one replica, picked at its first read, so its
+reads see one snapshot. Within a transaction that has written anything, the
+reads go to the primary database, so the session sees its own changes. Use
+`max_staleness=0` to also see the changes of earlier transactions.
+
+Commits are noticed through the primary engine once the database has
+committed them, so changes written by other processes are not seen until
+the replicas are refreshed.
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import cycle
+from pathlib import Path
+
+from sqlalchemy import (Delete, Insert, TextClause, Update, create_engine,
+                        event)
+from sqlalchemy.orm import Session, sessionmaker
+
+
+def _writes(statement):
+    """Whether an SQL statement can change the database."""
+    return statement.lstrip()[:6].upper() not in ("SELECT", "PRAGMA")
+
+
+def replica_urls(url, count):
+    """Returns the URLs of the replicas of the database `url`, stored next
+    to it as <name>_replica<N>.sqlite."""
+    database = Path(url.database)
+    return [url.set(database=str(
+        database.with_name(f"{database.stem}_replica{n}.sqlite")))
+        for n in range(count)]
+
+
+class Replica:
+    def __init__(self, url, **engine_options):
+        self.url = url
+        self.engine = create_engine(url, **engine_options)
+        self.refreshed_at = None
+        # The number of primary commits included in the snapshot.
+        self.commits = None
+        self.reads = 0
+
+        @event.listens_for(self.engine, "connect")
+        def connect(dbapi_connection, connection_record):
+            # Writes to a replica would be lost on the next refresh.
+            dbapi_connection.execute("PRAGMA query_only = ON")
+
+
+class ReplicaSet:
+    def __init__(self, primary, count=1, max_staleness=5.0,
+                 refresh_after_commit=False, **engine_options):
+        self.primary = primary
+        self.replicas = [Replica(url, **engine_options)
+                         for url in replica_urls(primary.url, count)]
+        self.max_staleness = max_staleness
+        self.refresh_after_commit = refresh_after_commit
+        self.primary_reads = 0
+        # The commits on the primary engine, and the time of each one that
+        # is not yet in all replicas.
+        self.commits = 0
+        self._commit_times = {}
+        self._next = cycle(self.replicas)
+        self._lock = threading.Lock()
+        self._stop = None
+        # The pooled connections with a transaction that has written.
+        self._writing = set()
+        event.listen(primary, "before_cursor_execute", self._on_execute)
+        event.listen(primary, "rollback", self._on_rollback)
+        # The "commit" event runs before the database commits, so the
+        # commits are counted by wrapping the commit of the dialect.
+        self._dialect_commit = primary.dialect.do_commit
+        primary.dialect.do_commit = self._do_commit
+
+    def _on_execute(self, connection, cursor, statement, parameters, context,
+                    executemany):
+        # Only the transactions that write anything make the replicas
+        # stale.
+        if _writes(statement):
+            self._writing.add(id(connection.connection))
+
+    def _on_rollback(self, connection):
+        self._writing.discard(id(connection.connection))
+
+    def _do_commit(self, dbapi_connection):
+        self._dialect_commit(dbapi_connection)
+        if id(dbapi_connection) not in self._writing:
+            return
+        self._writing.discard(id(dbapi_connection))
+        with self._lock:
+            self.commits += 1
+            self._commit_times[self.commits] = time.monotonic()
+        if self.refresh_after_commit:
+            self.refresh()
+
+    def refresh(self):
+        """Copies the primary database to every replica."""
+        source = sqlite3.connect(self.primary.url.database)
+        try:
+            for replica in self.replicas:
+                with self._lock:
+                    commits = self.commits
+                target = sqlite3.connect(replica.url.database)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                replica.commits = commits
+                replica.refreshed_at = datetime.now(timezone.utc)
+        finally:
+            source.close()
+        with self._lock:
+            oldest = min(replica.commits for replica in self.replicas)
+            for commit in [c for c in self._commit_times if c <= oldest]:
+                del self._commit_times[commit]
+
+    def staleness(self, replica):
+        """Seconds since the first commit that is not in the replica, 0 if
+        it is up to date, and None if it has never been refreshed."""
+        if replica.commits is None:
+            return None
+        with self._lock:
+            first_missing = self._commit_times.get(replica.commits + 1)
+        if first_missing is None:
+            return 0.0
+        return time.monotonic() - first_missing
+
+    def read_engine(self):
+        """Returns the engine of the next replica that is fresh enough, or
+        the primary engine if there is none."""
+        for _ in range(len(self.replicas)):
+            replica = next(self._next)
+            staleness = self.staleness(replica)
+            if staleness is not None and (
+                    staleness == 0 or staleness < self.max_staleness):
+                replica.reads += 1
+                return replica.engine
+        self.primary_reads += 1
+        return self.primary
+
+    def status(self):
+        return {
+            "primary_reads": self.primary_reads,
+            "replicas": [{
+                "database": replica.url.database,
+                "refreshed_at": replica.refreshed_at,
+                "staleness": self.staleness(replica),
+                "reads": replica.reads,
+            } for replica in self.replicas],
+        }
+
+    def start(self, interval):
+        """Refreshes the replicas every `interval` seconds in a background
+        thread, until `stop()` is called."""
+        self._stop = threading.Event()
+
+        def run(stop):
+            while not stop.wait(interval):
+                self.refresh()
+
+        threading.Thread(target=run, args=(self._stop,), daemon=True).start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def dispose(self):
+        self.stop()
+        event.remove(self.primary, "before_cursor_execute", self._on_execute)
+        event.remove(self.primary, "rollback", self._on_rollback)
+        self.primary.dialect.do_commit = self._dialect_commit
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+class RoutingSession(Session):
+    """A session that sends the reads to the replicas of `replicas` and
+    everything else to the primary database."""
+
+    def __init__(self, replicas, **kw):
+        kw["bind"] = replicas.primary
+        super().__init__(**kw)
+        self.replicas = replicas
+        self.wrote = False
+        # The replica of the current transaction.
+        self.read_engine = None
+
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        if self._flushing or isinstance(clause, (Insert, Update, Delete)) or (
+                isinstance(clause, TextClause) and _writes(clause.text)):
+            self.wrote = True
+        if self.wrote:
+            return self.replicas.primary
+        if self.read_engine is None:
+            self.read_engine = self.replicas.read_engine()
+        return self.read_engine
+
+    def commit(self):
+        super().commit()
+        self._end_transaction()
+
+    def rollback(self):
+        super().rollback()
+        self._end_transaction()
+
+    def close(self):
+        super().close()
+        self._end_transaction()
+
+    def _end_transaction(self):
+        self.wrote = False
+        self.read_engine = None
+
+
+def routing_sessionmaker(replicas, **kw):
+    """Returns a session maker like `db.Session`, for sessions that read
+    from the replicas."""
+    return sessionmaker(class_=RoutingSession, replicas=replicas, **kw)
+
+
+def main():
+    from sqlalchemy import false, func, select, update
+
+    from db import Session, engine
+    from models import BlogView, Order
+
+    replicas = ReplicaSet(engine, count=2, max_staleness=0.5)
+    start = time.perf_counter()
+    replicas.refresh()
+    print(f"Refreshed {len(replicas.replicas)} replicas in "
+          f"{time.perf_counter() - start:.2f}s")
+    ReadSession = routing_sessionmaker(replicas)
+
+    with ReadSession() as session:
+        for _ in range(4):
+            session.scalar(select(func.count(BlogView.id)))
+        print(session.scalar(select(func.count(Order.id))), "orders")
+
+    # A write on the primary makes the replicas stale, after
+    # `max_staleness` the reads go to the primary until the next refresh.
+    with Session() as session:
+        with session.begin():
+            session.execute(update(Order).where(false())
+                            .values(timestamp=Order.timestamp))
+    time.sleep(0.6)
+    with ReadSession() as session:
+        session.scalar(select(func.count(Order.id)))
+    print(replicas.status())
+    replicas.refresh()
+    print(replicas.status())
+    replicas.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Full-text search over article titles and review comments.
+
+A `LIKE '%word%'` filter cannot use an index, so SQLite has to scan every row
+of the table. SQLite has a full-text search extension called FTS5, which
+stores an inverted index that maps every word to the rows containing it. The
+search tables are created and kept in sync with triggers by the
+`full-text search` and `review search rowid` migrations:
+
+- `blog_articles_fts` indexes `blog_articles.title`. It is an *external
+  content* table, which means that it only stores the index and reads the
+  text from `blog_articles`, using `blog_articles.id` as its rowid.
+- `product_reviews_fts` indexes `product_reviews.comment` for the reviews
+  that have a comment. The reviews table has a composite primary key, so the
+  search table stores the text together with the `product_id` and
+  `customer_id` of the review, which the searches join on. A search row has
+  the rowid of its review, so that the triggers find the search row of a
+  deleted or updated review by rowid instead of scanning the search table.
+  `product_reviews` has no INTEGER PRIMARY KEY, and a VACUUM may change its
+  rowids, so `rebuild()` must be run after a VACUUM.
+
+Queries use the FTS5 query syntax, for example `spectrum`, `"zx spectrum"`
+(a phrase), `amiga OR atari` or `comp*` (a prefix). Words are stemmed with
+the porter stemmer, so `games` also matches `game`. The results are ranked
+with the bm25 algorithm, best match first.
+
+The search tables are virtual tables that are not part of `Model.metadata`,
+they are described here with a separate `MetaData` so that
+`Model.metadata.create_all()` and Alembic autogenerate leave them alone.
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import Column, Float, Integer, MetaData, Table, Text, select
+from sqlalchemy import Uuid, and_, literal_column
+
+from models import BlogArticle, ProductReview
+
+metadata = MetaData()
+
+ArticleSearch = Table(
+    "blog_articles_fts",
+    metadata,
+    Column("rowid", Integer, primary_key=True),
+    Column("title", Text),
+    # Hidden column with the bm25 score of a match, lower is better.
+    Column("rank", Float),
+)
+
+ReviewSearch = Table(
+    "product_reviews_fts",
+    metadata,
+    Column("rowid", Integer, primary_key=True),
+    Column("comment", Text),
+    Column("product_id", Integer),
+    Column("customer_id", Uuid),
+    Column("rank", Float),
+)
+
+
+def rebuild(session):
+    """Repopulates both search tables from the content tables in one go."""
+    connection = session.connection()
+    connection.exec_driver_sql(
+        "INSERT INTO blog_articles_fts (blog_articles_fts) VALUES ('rebuild')")
+    connection.exec_driver_sql("DELETE FROM product_reviews_fts")
+    connection.exec_driver_sql(
+        "INSERT INTO product_reviews_fts "
+        "(rowid, comment, product_id, customer_id) "
+        "SELECT rowid, comment, product_id, customer_id FROM product_reviews "
+        "WHERE comment IS NOT NULL")
+
+
+@contextmanager
+def bulk_load(session):
+    """Suspends the sync triggers while rows are loaded, and rebuilds the
+    search tables once at the end.
+
+    Updating the index row by row from the triggers is much slower than
+    building it in one pass when a large number of rows are inserted or
+    deleted. The triggers are suspended by adding a row to the
+    `search_fts_suspended` table, which the triggers check before doing
+    anything. Dropping and recreating the triggers would not be safe, since
+    the sqlite3 driver commits DDL statements immediately, so they would stay
+    dropped if the load fails. An inserted row on the other hand disappears
+    with the rest of the transaction on a rollback, and is never visible to
+    other connections.
+
+    This must be used inside a transaction:
+
+        with session.begin(), search.bulk_load(session):
+            ...
+    """
+    connection = session.connection()
+    connection.exec_driver_sql(
+        "INSERT INTO search_fts_suspended DEFAULT VALUES")
+    yield
+    # Pending objects must be written before the index is built from the
+    # tables.
+    session.flush()
+    rebuild(session)
+    connection.exec_driver_sql("DELETE FROM search_fts_suspended")
+
+
+def _match(table, query):
+    return literal_column(table.name).op("MATCH")(query)
+
+
+def search_articles(session, query, language_id=None, limit=20):
+    """Returns the articles with titles matching `query`, best match first,
+    optionally only the ones in the language with id `language_id`."""
+    q = (select(BlogArticle)
+         .join(ArticleSearch, ArticleSearch.c.rowid == BlogArticle.id)
+         .where(_match(ArticleSearch, query))
+         .order_by(ArticleSearch.c.rank)
+         .limit(limit))
+    if language_id is not None:
+        q = q.where(BlogArticle.language_id == language_id)
+    return session.scalars(q).all()
+
+
+def search_reviews(session, query, limit=20):
+    """Returns the reviews with comments matching `query`, best match
+    first."""
+    q = (select(ProductReview)
+         .join(ReviewSearch, and_(
+             ReviewSearch.c.product_id == ProductReview.product_id,
+             ReviewSearch.c.customer_id == ProductReview.customer_id))
+         .where(_match(ReviewSearch, query))
+         .order_by(ReviewSearch.c.rank)
+         .limit(limit))
+    return session.scalars(q).all()
@@ -0,0 +1,217 @@
+"""Materialised translation groups for blog articles.
+
+`BlogArticle.translation_of` links a translation to the article it was
+translated from. An article and all its translations form a *translation
+group*, and the article that is not a translation of anything is the root of
+the group. Finding the group from the `translation_of` links alone requires
+either a recursive query or one lazy load per article, and finding the
+article with the most translations requires a GROUP BY over the whole table.
+
+Instead two columns are stored on every article:
+
+- `translation_group_id`, the id of the root article of its group,
+- `translation_count`, the number of translations in the group on the root
+  article, and 0 on the translations.
+
+With these all versions of an article are found with one query on the
+indexed `translation_group_id` column. The columns are kept up to date by a
+flush event of the sessions: when articles are added, deleted or re-linked,
+only the groups they leave and join are computed again, in a few queries
+per flush. The event is registered when this module is imported, as done by
+the importers. Changes made with `insert()` or `update()` statements bypass
+the flush, and need `refresh_translation_groups()`, which computes all the
+groups again. `translation_family_cte()` finds the same articles by
+following the links with recursive CTEs, and `stale_translation_groups()`
+uses it to check that the stored columns are up to date.
+"""
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import BlogArticle
+
+
+def _group_roots(root_ids=None):
+    """A recursive CTE with the id of every article and the id of the root
+    of its translation group, only of the groups of `root_ids` if given.
+
+    It starts from the root articles and then repeatedly adds the articles
+    that are translations of the ones already found.
+    """
+    roots = (select(BlogArticle.id, BlogArticle.id.label("root_id"))
+             .where(BlogArticle.translation_of_id.is_(None)))
+    if root_ids is not None:
+        roots = roots.where(BlogArticle.id.in_(root_ids))
+    roots = roots.cte("roots", recursive=True)
+    translation = aliased(BlogArticle)
+    return roots.union_all(
+        select(translation.id, roots.c.root_id)
+        .join(roots, translation.translation_of_id == roots.c.id))
+
+
+def _computed_groups(session, root_ids=None):
+    """Returns `{article id: (group id, translation count)}` computed from
+    the `translation_of` links."""
+    roots = _group_roots(root_ids)
+    group_size = func.count().over(partition_by=roots.c.root_id)
+    groups = {}
+    for id, root_id, size in session.execute(
+            select(roots.c.id, roots.c.root_id, group_size)):
+        groups[id] = (root_id, size - 1 if id == root_id else 0)
+    return groups
+
+
+def _changed_groups(session, root_ids=None):
+    """Returns the articles where the stored group columns differ from the
+    ones computed from the `translation_of` links, as the values to
+    update. With `root_ids` only the articles that are or were in the
+    groups of these roots are compared."""
+    computed = _computed_groups(session, root_ids)
+    q = select(BlogArticle.id, BlogArticle.translation_group_id,
+               BlogArticle.translation_count)
+    if root_ids is not None:
+        q = q.where(BlogArticle.id.in_(computed)
+                    | BlogArticle.translation_group_id.in_(root_ids))
+    changes = []
+    for id, group_id, count in session.execute(q):
+        new_group_id, new_count = computed.get(id, (None, 0))
+        if (new_group_id, new_count) != (group_id, count):
+            changes.append({"id": id, "translation_group_id": new_group_id,
+                            "translation_count": new_count})
+    return changes
+
+
+def refresh_translation_groups(session):
+    """Updates `translation_group_id` and `translation_count` of the
+    articles where they differ from the `translation_of` links, and returns
+    the number of updated articles.
+
+    The groups of all articles are computed in a single query, and only the
+    changed articles are written back, with one executemany UPDATE.
+    """
+    session.flush()
+    changes = _changed_groups(session)
+    if changes:
+        session.execute(update(BlogArticle), changes)
+    return len(changes)
+
+
+def _root_ids(session, article_ids):
+    """Returns the ids of the roots of the groups of the articles, found by
+    following the `translation_of` links up."""
+    ancestors = (select(BlogArticle.id, BlogArticle.translation_of_id)
+                 .where(BlogArticle.id.in_(article_ids))
+                 .cte("ancestors", recursive=True))
+    parent = aliased(BlogArticle)
+    ancestors = ancestors.union(
+        select(parent.id, parent.translation_of_id)
+        .join(ancestors, parent.id == ancestors.c.translation_of_id))
+    return set(session.scalars(
+        select(ancestors.c.id)
+        .where(ancestors.c.translation_of_id.is_(None))).all())
+
+
+@event.listens_for(Session, "after_flush")
+def _update_changed_groups(session, flush_context):
+    """Computes the groups that the flushed articles joined or left
+    again."""
+    changed = []
+    root_ids = set()
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if not isinstance(obj, BlogArticle):
+            continue
+        state = inspect(obj)
+        if obj in session.new or any(
+                state.attrs[name].history.has_changes()
+                for name in ("translation_of", "translation_of_id")):
+            changed.append(obj)
+        elif obj not in session.deleted:
+            continue
+        # The group the article was in before.
+        old_group_id = state.attrs.translation_group_id.loaded_value
+        if isinstance(old_group_id, int):
+            root_ids.add(old_group_id)
+    live = [obj.id for obj in changed if obj not in session.deleted]
+    if live:
+        root_ids |= _root_ids(session, live)
+    if not root_ids:
+        return
+    changes = _changed_groups(session, root_ids)
+    if not changes:
+        return
+    session.execute(update(BlogArticle), changes)
+    # The articles in the session get the new values too. The new articles
+    # are only added to the identity map after the flush.
+    articles = {obj.id: obj for obj in changed}
+    for change in changes:
+        article = articles.get(change["id"]) or session.identity_map.get(
+            session.identity_key(BlogArticle, change["id"]))
+        if article is not None:
+            for name in ("translation_group_id", "translation_count"):
+                set_committed_value(article, name, change[name])
+
+
+def translation_family(session, article):
+    """Returns all versions of `article`, the root article first."""
+    if article.translation_group_id is None:
+        # Not in a group yet, for example when the groups are out of date
+        # after an insert() statement.
+        return translation_family_cte(session, article)
+    q = (select(BlogArticle)
+         .where(BlogArticle.translation_group_id
+                == article.translation_group_id)
+         .order_by(BlogArticle.translation_of_id.is_not(None),
+                   BlogArticle.id))
+    return session.scalars(q).all()
+
+
+def translation_family_cte(session, article):
+    """Returns the same articles as `translation_family()`, found by
+    following the `translation_of` links with recursive CTEs instead of
+    the stored group id.
+
+    The first CTE walks from the article up to the root, and the second
+    walks from the root down to all translations.
+    """
+    ancestors = (select(BlogArticle.id, BlogArticle.translation_of_id)
+                 .where(BlogArticle.id == article.id)
+                 .cte("ancestors", recursive=True))
+    parent = aliased(BlogArticle)
+    ancestors = ancestors.union(
+        select(parent.id, parent.translation_of_id)
+        .join(ancestors, parent.id == ancestors.c.translation_of_id))
+    root_id = (select(ancestors.c.id)
+               .where(ancestors.c.translation_of_id.is_(None))
+               .scalar_subquery())
+
+    family = (select(BlogArticle.id)
+              .where(BlogArticle.id == root_id)
+              .cte("family", recursive=True))
+    child = aliased(BlogArticle)
+    family = family.union(
+        select(child.id)
+        .join(family, child.translation_of_id == family.c.id))
+
+    q = (select(BlogArticle)
+         .where(BlogArticle.id.in_(select(family.c.id)))
+         .order_by(BlogArticle.translation_of_id.is_not(None),
+                   BlogArticle.id))
+    return session.scalars(q).all()
+
+
+def most_translated(session):
+    """Returns the article with the most translations, the first one
+    alphabetically on a tie (exercise 5.2)."""
+    q = (select(BlogArticle)
+         .where(BlogArticle.translation_count > 0)
+         .order_by(BlogArticle.translation_count.desc(), BlogArticle.title)
+         .limit(1))
+    return session.scalar(q)
+
+
+def stale_translation_groups(session):
+    """Returns the ids of the articles where the stored group columns do not
+    match the `translation_of` links, an empty list when all are up to
+    date."""
+    return [change["id"] for change in _changed_groups(session)]
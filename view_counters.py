@@ -0,0 +1,365 @@
+"""Write-behind counters of the blog page views.
+
+The number of views of an article is asked for much more often than the
+views are added, and counting them from `blog_views` is an aggregate over
+all the views of the article every time. `ViewCounters` instead keeps the
+counts in memory, per article, language and day, so reading a count does
+not run a query:
+
+    counters = ViewCounters()
+    counters.load()                 # read the counters, replay new views
+    counters.install()              # count the views committed from now on
+    counters.start(interval=10)     # flush every 10 seconds
+    ...
+    counters.views(article_id=42)
+    counters.views(language_id=1, start=date(2022, 3, 1))
+
+The counts are stored in `blog_view_counters` behind the writes (write
+behind): `flush()` adds the views to the table every `interval` seconds in
+one transaction, instead of updating a counter row in the transaction of
+every view.
+
+The counters are never the only copy of the data. `flush()` does not store
+the counts that were added in memory, it counts the `blog_views` rows that
+were added since the last flush, up to the id stored in
+`blog_view_counter_state`, and stores both in the same transaction. After a
+crash, the views that were committed but not flushed are therefore
+counted again by `load()`, and the views added by other programs, such as
+the importers, are counted too. The in-memory counts of the views that are
+not flushed yet are only used for reading.
+
+After a flush the table matches the views exactly, which `reconcile()`
+checks. Views that are deleted, for example by archive.py, are not
+subtracted; `rebuild()` counts everything again.
+
+Only one `ViewCounters` per database must flush, since the flushes of two
+processes could count the same views twice.
+"""
+
+import threading
+from collections import Counter
+from datetime import date
+
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import BlogArticle, BlogView, BlogViewCounter, BlogViewCounterState
+
+
+def _day(day_key):
+    """The date of a day key, see models.to_day_key()."""
+    return date(day_key // 10000, day_key // 100 % 100, day_key % 100)
+
+
+def _count_by_day(session, *where):
+    """Returns (article id, language id, day, views) of the views in
+    `where`. The views are grouped by their indexed day key instead of the
+    date of their timestamp, which SQLite would compute for every row."""
+    rows = session.execute(
+        select(BlogView.article_id, BlogArticle.language_id,
+               BlogView.day_key, func.count())
+        .join(BlogView.article)
+        .where(*where)
+        .group_by(BlogView.article_id, BlogView.day_key))
+    return [(article_id, language_id, _day(day_key), views)
+            for article_id, language_id, day_key, views in rows]
+
+
+class ViewCounters:
+    def __init__(self, sessionmaker=None):
+        if sessionmaker is None:
+            from db import Session as sessionmaker
+        self.Session = sessionmaker
+        self._lock = threading.Lock()
+        # The flushed counts per (article id, language id, day), and the
+        # totals per article, language and day.
+        self._counts = Counter()
+        self._articles = Counter()
+        self._languages = Counter()
+        self._days = Counter()
+        # The views committed since the last flush, by view id, and their
+        # counts.
+        self._pending = {}
+        self._pending_counts = Counter()
+        self._language_of = {}
+        self.last_view_id = 0
+        self._stop = None
+
+    def load(self):
+        """Reads the stored counters, and counts the views that were added
+        after the last flush."""
+        with self.Session() as session:
+            rows = session.execute(select(
+                BlogViewCounter.article_id, BlogViewCounter.language_id,
+                BlogViewCounter.day, BlogViewCounter.views)).all()
+            last_view_id = session.scalar(
+                select(BlogViewCounterState.last_view_id)) or 0
+            languages = dict(session.execute(
+                select(BlogArticle.id, BlogArticle.language_id)).all())
+        with self._lock:
+            self._counts.clear()
+            self._articles.clear()
+            self._languages.clear()
+            self._days.clear()
+            for article_id, language_id, day, views in rows:
+                self._add((article_id, language_id, day), views)
+            self._language_of = languages
+            self.last_view_id = last_view_id
+        self.flush()
+
+    def _add(self, key, views):
+        article_id, language_id, day = key
+        self._counts[key] += views
+        self._articles[article_id] += views
+        self._languages[language_id] += views
+        self._days[day] += views
+
+    def _language(self, article_id):
+        if article_id not in self._language_of:
+            with self.Session() as session:
+                self._language_of[article_id] = session.scalar(
+                    select(BlogArticle.language_id)
+                    .where(BlogArticle.id == article_id))
+        return self._language_of[article_id]
+
+    def record(self, view_id, article_id, timestamp):
+        """Counts a committed view in memory. Views that were already
+        flushed are ignored."""
+        key = (article_id, self._language(article_id), timestamp.date())
+        with self._lock:
+            if view_id <= self.last_view_id or view_id in self._pending:
+                return
+            self._pending[view_id] = key
+            self._pending_counts[key] += 1
+            self._articles[article_id] += 1
+            self._languages[key[1]] += 1
+            self._days[key[2]] += 1
+
+    def flush(self):
+        """Adds the views stored since the last flush to the counters table.
+        Returns the number of views that were added."""
+        with self.Session.begin() as session:
+            last_view_id = session.scalar(
+                select(BlogViewCounterState.last_view_id)) or 0
+            max_view_id = session.scalar(select(func.max(BlogView.id))) or 0
+            if max_view_id <= last_view_id:
+                return 0
+            rows = _count_by_day(session, BlogView.id > last_view_id,
+                                 BlogView.id <= max_view_id)
+            stmt = insert(BlogViewCounter)
+            if rows:
+                session.execute(stmt.on_conflict_do_update(
+                    index_elements=[BlogViewCounter.article_id,
+                                    BlogViewCounter.day],
+                    set_={"views": BlogViewCounter.views + stmt.excluded.views,
+                          "language_id": stmt.excluded.language_id}),
+                    [{"article_id": article_id, "language_id": language_id,
+                      "day": day, "views": views}
+                     for article_id, language_id, day, views in rows])
+            stmt = insert(BlogViewCounterState)
+            session.execute(stmt.values(id=1, last_view_id=max_view_id)
+                            .on_conflict_do_update(
+                                index_elements=[BlogViewCounterState.id],
+                                set_={"last_view_id": max_view_id}))
+
+        with self._lock:
+            # The views that are now in the table replace the pending views
+            # up to the same id. The totals already include the pending
+            # views, so only the counts of the other views are added.
+            flushed = Counter()
+            for view_id in [i for i in self._pending if i <= max_view_id]:
+                flushed[self._pending.pop(view_id)] += 1
+            self._pending_counts -= flushed
+            for article_id, language_id, day, views in rows:
+                key = (article_id, language_id, day)
+                pending = flushed.pop(key, 0)
+                self._add(key, views - pending)
+                self._counts[key] += pending
+                self._language_of.setdefault(article_id, language_id)
+            for key, views in flushed.items():
+                # Pending views of an article whose language has changed
+                # since, they were counted with the new language.
+                self._add(key, -views)
+                self._counts[key] += views
+            self.last_view_id = max_view_id
+        return sum(views for *_, views in rows)
+
+    def views(self, article_id=None, language_id=None, start=None, end=None):
+        """Returns the number of views from `start` up to, but not including,
+        `end`, of an article or a language, or of all articles."""
+        with self._lock:
+            if start is None and end is None:
+                if article_id is not None and language_id is None:
+                    return self._articles[article_id]
+                if article_id is None and language_id is not None:
+                    return self._languages[language_id]
+                if article_id is None:
+                    return self._days.total()
+            return sum(
+                views
+                for counts in (self._counts, self._pending_counts)
+                for (a, l, day), views in counts.items()
+                if (article_id is None or a == article_id)
+                and (language_id is None or l == language_id)
+                and (start is None or day >= start)
+                and (end is None or day < end))
+
+    def daily_views(self, start=None, end=None):
+        """Returns {day: views} of the days from `start` up to `end`."""
+        with self._lock:
+            return {day: views for day, views in sorted(self._days.items())
+                    if views and (start is None or day >= start)
+                    and (end is None or day < end)}
+
+    def popular_articles(self, n=10):
+        """Returns (article id, views) of the `n` most viewed articles."""
+        with self._lock:
+            return self._articles.most_common(n)
+
+    def reconcile(self):
+        """Compares the counters table with the views it includes, and with
+        the flushed counts in memory. Returns the differences as
+        ((article id, language id, day), counted, actual) tuples, an empty
+        list when everything matches."""
+        with self.Session() as session:
+            last_view_id = session.scalar(
+                select(BlogViewCounterState.last_view_id)) or 0
+            actual = {(a, l, day): n for a, l, day, n in _count_by_day(
+                session, BlogView.id <= last_view_id)}
+            stored = {(a, l, day): n for a, l, day, n in session.execute(
+                select(BlogViewCounter.article_id,
+                       BlogViewCounter.language_id, BlogViewCounter.day,
+                       BlogViewCounter.views))}
+        with self._lock:
+            in_memory = {key: n for key, n in self._counts.items() if n}
+        differences = []
+        for counted in (stored, in_memory):
+            for key in sorted(counted.keys() | actual.keys(),
+                              key=lambda k: (k[0], k[2])):
+                if counted.get(key, 0) != actual.get(key, 0):
+                    differences.append(
+                        (key, counted.get(key, 0), actual.get(key, 0)))
+        return differences
+
+    def rebuild(self):
+        """Counts all the views again, after views have been deleted."""
+        with self.Session.begin() as session:
+            session.execute(delete(BlogViewCounter))
+            session.execute(delete(BlogViewCounterState))
+        with self._lock:
+            self._pending.clear()
+            self._pending_counts.clear()
+        self.load()
+
+    # Counting the views committed by sessions.
+
+    def _after_flush(self, session, flush_context):
+        views = [(obj.id, obj.article_id, obj.timestamp)
+                 for obj in session.new if isinstance(obj, BlogView)]
+        if views:
+            session.info.setdefault("new_views", []).extend(views)
+
+    def _after_commit(self, session):
+        for view in session.info.pop("new_views", ()):
+            self.record(*view)
+
+    def _after_rollback(self, session):
+        session.info.pop("new_views", None)
+
+    def install(self, session_class=Session):
+        """Counts the views committed by the sessions of `session_class`,
+        every session by default."""
+        event.listen(session_class, "after_flush", self._after_flush)
+        event.listen(session_class, "after_commit", self._after_commit)
+        event.listen(session_class, "after_rollback", self._after_rollback)
+
+    def uninstall(self, session_class=Session):
+        event.remove(session_class, "after_flush", self._after_flush)
+        event.remove(session_class, "after_commit", self._after_commit)
+        event.remove(session_class, "after_rollback", self._after_rollback)
+
+    def start(self, interval):
+        """Flushes the counters every `interval` seconds in a background
+        thread, until `stop()` is called."""
+        self._stop = threading.Event()
+
+        def run(stop):
+            while not stop.wait(interval):
+                self.flush()
+
+        threading.Thread(target=run, args=(self._stop,), daemon=True).start()
+
+    def stop(self):
+        """Stops the background flushes, and flushes the views counted
+        since the last one."""
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+        self.flush()
+
+
+def main():
+    import random
+    import time
+
+    from db import Session
+    from models import BlogSession, BlogUser
+
+    counters = ViewCounters()
+    start = time.perf_counter()
+    counters.load()
+    print(f"Loaded the counters in {time.perf_counter() - start:.3f} s, "
+          f"{counters.views()} views")
+    counters.install()
+
+    # Views from sessions, counted in memory when they are committed.
+    with Session() as session:
+        article_ids = session.scalars(select(BlogArticle.id)).all()
+        user = BlogUser()
+        blog_session = BlogSession(user=user)
+        session.add(blog_session)
+        for _ in range(1000):
+            session.add(BlogView(article_id=random.choice(article_ids),
+                                 session=blog_session))
+        session.commit()
+    article_id = counters.popular_articles(1)[0][0]
+
+    def count_views():
+        with Session() as session:
+            return session.scalar(select(func.count(BlogView.id))
+                                  .where(BlogView.article_id == article_id))
+
+    runs = 200
+    start = time.perf_counter()
+    for _ in range(runs):
+        counted = counters.views(article_id=article_id)
+    in_memory = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    for _ in range(runs):
+        actual = count_views()
+    query = (time.perf_counter() - start) / runs
+    print(f"Views of article {article_id}: {counted} counted in "
+          f"{in_memory * 1e6:.1f} us, {actual} counted with a query in "
+          f"{query * 1e6:.1f} us")
+
+    print(f"Flushed {counters.flush()} views, "
+          f"{len(counters.reconcile())} differences after the flush")
+
+    # A "crash": views committed while no counters are installed, and not
+    # flushed. A new instance counts them when it is loaded.
+    counters.uninstall()
+    with Session() as session:
+        blog_session = BlogSession(user=BlogUser())
+        session.add_all(BlogView(article_id=article_id, session=blog_session)
+                        for _ in range(100))
+        session.commit()
+    restarted = ViewCounters()
+    restarted.load()
+    print(f"After a restart: {restarted.views(article_id=article_id)} views "
+          f"of article {article_id}, {count_views()} in blog_views, "
+          f"{len(restarted.reconcile())} differences")
+
+
+if __name__ == "__main__":
+    main()
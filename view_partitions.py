@@ -0,0 +1,293 @@
+"""Monthly partitioning of the blog page views.
+
+`blog_views` grows with every page view, and the page view reports always
+filter on a range of dates. SQLite has no built in partitioning, so this
+module stores the views in one table per month instead, named
+`blog_views_YYYYMM`, with the same columns as `blog_views`:
+
+- `add_views()` routes new views to the table of their month, creating the
+  table the first time a month is seen. The views are inserted in
+  `blog_views` first and then moved, so that all the views get their ids
+  from `blog_views` and the ids are unique over all the tables,
+- `views_between()` returns a UNION ALL of only the monthly tables that
+  overlap the requested date range, so a report on March 2022 reads one
+  small table instead of the whole history (partition pruning), and of the
+  views in the range that are still in `blog_views`,
+- `drop_month()` removes a whole month with a single DROP TABLE, instead of
+  a DELETE that has to find and remove every row and update the indexes.
+
+The monthly tables are not mapped by the models, so only the queries built
+on `views_between()` see their views. The view counters, the `BlogView`
+queries of the reports and sharding.py read `blog_views` only. For that
+reason `partition_existing_views()` only moves the views that the counters
+have already counted, and the views moved by `add_views()` are not counted
+by view_counters.py. Both functions keep the newest view in `blog_views`, so
+that SQLite does not give the ids of the moved views to new views.
+
+The monthly tables created before the `day_key` and `month_key` columns
+are upgraded by `upgrade_partitions()`. Running this file upgrades them and
+moves the counted rows in `blog_views` to the monthly tables.
+"""
+
+import re
+from datetime import datetime, timezone
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer,
+                        MetaData, Table, Uuid, func, insert, inspect, select,
+                        union_all, update)
+
+from models import (CALENDAR_KEYS_SQL, BlogArticle, BlogView,
+                    BlogViewCounterState, to_day_key, to_month_key)
+from online_rebuild import upgrade_table
+
+PARTITION_NAME = re.compile(r"^blog_views_(\d{4})(\d{2})$")
+
+# The monthly tables are not part of `Model.metadata`, so they are not
+# created by `create_all()` or seen as missing by Alembic. The tables that
+# the foreign keys refer to must be known by this metadata too, only their
+# primary keys are needed.
+metadata = MetaData()
+Table("blog_articles", metadata, Column("id", Integer, primary_key=True))
+Table("blog_sessions", metadata, Column("id", Uuid, primary_key=True))
+
+# The columns of the monthly tables, in the order of `blog_views`.
+VIEW_COLUMNS = ("id", "article_id", "sesion_id", "timestamp", "day_key",
+                "month_key")
+
+
+def partition_name(year, month):
+    return f"blog_views_{year:04d}{month:02d}"
+
+
+def partition_table(year, month):
+    """Returns the table for a month, defining it the first time."""
+    name = partition_name(year, month)
+    if name in metadata.tables:
+        return metadata.tables[name]
+    return Table(
+        name,
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("article_id", Integer, ForeignKey("blog_articles.id"),
+               nullable=False),
+        Column("sesion_id", Uuid, ForeignKey("blog_sessions.id"),
+               nullable=False),
+        Column("timestamp", DateTime, nullable=False),
+        Column("day_key", Integer, nullable=False),
+        Column("month_key", Integer, nullable=False),
+        Index(f"ix_{name}_timestamp", "timestamp"),
+        Index(f"ix_{name}_article_id", "article_id"),
+        Index(f"ix_{name}_day_key_article_id", "day_key", "article_id"),
+    )
+
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _utc(timestamp):
+    """The timestamps are stored in UTC without a time zone, timestamps with
+    a time zone are converted to that."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def _months(start, end):
+    """Yields (year, month) for every month that overlaps [start, end)."""
+    year, month = start.year, start.month
+    while datetime(year, month, 1) < end:
+        yield year, month
+        year, month = _next_month(year, month)
+
+
+def existing_months(session):
+    """Returns (year, month) of the monthly tables in the database."""
+    return _months_of(inspect(session.connection()).get_table_names())
+
+
+def _months_of(table_names):
+    months = []
+    for name in table_names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append((int(match[1]), int(match[2])))
+    return sorted(months)
+
+
+def upgrade_partitions(connection):
+    """Adds the day and month keys, and their index, to the monthly tables
+    created before them. `connection` must not be in a transaction."""
+    months = _months_of(inspect(connection).get_table_names())
+    connection.rollback()
+    for year, month in months:
+        upgrade_table(partition_table(year, month), CALENDAR_KEYS_SQL,
+                      connection)
+
+
+def add_views(session, views):
+    """Inserts `BlogView` objects, or dicts with the same keys, in the
+    tables of their months. The views are inserted in `blog_views` with one
+    multi-row insert, for their ids, and moved to the monthly tables with
+    one INSERT ... SELECT per month. The newest view stays in `blog_views`
+    until `partition_existing_views()` moves it."""
+    rows = []
+    for view in views:
+        if isinstance(view, BlogView):
+            view = {
+                "article_id": view.article_id or view.article.id,
+                "sesion_id": view.sesion_id or view.session.id,
+                "timestamp": view.timestamp or datetime.now(timezone.utc),
+            }
+        ts = _utc(view["timestamp"])
+        view = {**view, "timestamp": ts, "day_key": to_day_key(ts),
+                "month_key": to_month_key(ts)}
+        rows.append(view)
+    if not rows:
+        return
+
+    views = BlogView.__table__
+    connection = session.connection()
+    # The session holds the write lock from the insert on, so the new views
+    # are the ones after the last id before the insert.
+    last_id = session.scalar(select(func.max(views.c.id))) or 0
+    connection.execute(insert(views), rows)
+    newest = session.scalar(select(func.max(views.c.id)))
+    _move(connection, views.c.id > last_id, views.c.id < newest)
+
+
+def views_between(session, start, end):
+    """Returns a subquery with the views from `start` up to, but not
+    including, `end`. Only the monthly tables in the range are read.
+
+    The subquery has the same columns as `blog_views`, and can be used in
+    the place of `BlogView` in queries:
+
+        views = views_between(session, datetime(2022, 3, 1),
+                              datetime(2022, 4, 1))
+        select(views.c.article_id, func.count()).group_by(views.c.article_id)
+    """
+    start, end = _utc(start), _utc(end)
+    existing = set(existing_months(session))
+    views = BlogView.__table__
+    # The views that are not moved to the monthly tables yet.
+    selects = [select(*(views.c[name] for name in VIEW_COLUMNS))
+               .where(views.c.timestamp >= start, views.c.timestamp < end)]
+    for year, month in _months(start, end):
+        if (year, month) not in existing:
+            continue
+        table = partition_table(year, month)
+        q = select(*(table.c[name] for name in VIEW_COLUMNS))
+        # Only the first and the last month can be partly outside the range.
+        if datetime(year, month, 1) < start:
+            q = q.where(table.c.timestamp >= start)
+        if end < datetime(*_next_month(year, month), 1):
+            q = q.where(table.c.timestamp < end)
+        selects.append(q)
+    return union_all(*selects).subquery("views")
+
+
+def view_count_by_article(session, start, end):
+    """Number of views of each article in the range, most viewed first
+    (exercise 5.1)."""
+    views = views_between(session, start, end)
+    view_count = func.count(views.c.id).label(None)
+    q = (select(BlogArticle, view_count)
+         .join(views, views.c.article_id == BlogArticle.id)
+         .group_by(BlogArticle)
+         .order_by(view_count.desc()))
+    return session.execute(q).all()
+
+
+def daily_view_count(session, start, end):
+    """Number of views per day in the range (exercise 5.6)."""
+    views = views_between(session, start, end)
+    day = func.date(views.c.timestamp).label(None)
+    q = select(day, func.count()).group_by(day).order_by(day)
+    return session.execute(q).all()
+
+
+def drop_month(session, year, month):
+    """Deletes all the views of a month by dropping its table."""
+    partition_table(year, month).drop(session.connection(), checkfirst=True)
+
+
+def partition_existing_views(session):
+    """Moves the rows of `blog_views` to the monthly tables, one month at a
+    time with INSERT ... SELECT, and returns the number of moved rows.
+
+    Only the views up to the last view counted by view_counters.py are
+    moved, so the counters do not miss them, and the newest view is always
+    kept, so that SQLite does not give the ids of the moved views to new
+    views. The moved views keep their ids."""
+    views = BlogView.__table__
+    last_view_id = min(
+        session.scalar(select(BlogViewCounterState.last_view_id)) or 0,
+        (session.scalar(select(func.max(views.c.id))) or 0) - 1)
+    return _move(session.connection(), views.c.id <= last_view_id)
+
+
+def _move(connection, *where):
+    """Moves the rows of `blog_views` in `where` to their monthly tables,
+    with their ids, and returns the number of moved rows."""
+    views = BlogView.__table__
+    moved = 0
+    month_keys = connection.scalars(
+        select(views.c.month_key).where(*where).distinct()).all()
+    for month_key in month_keys:
+        table = partition_table(month_key // 100, month_key % 100)
+        table.create(connection, checkfirst=True)
+        in_month = (views.c.month_key == month_key, *where)
+        rows = select(*(views.c[name] for name in VIEW_COLUMNS)).where(
+            *in_month)
+        moved += connection.execute(
+            insert(table).from_select(VIEW_COLUMNS, rows)).rowcount
+        connection.execute(views.delete().where(*in_month))
+    return moved
+
+
+def _check_ids(session):
+    """Adds views with `add_views()` to a month that has moved views, moves
+    the views again and checks that the ids of all the views are unique.
+    The changes are rolled back."""
+    views = BlogView.__table__
+    try:
+        article_id, sesion_id, timestamp = session.execute(
+            select(views.c.article_id, views.c.sesion_id,
+                   views.c.timestamp).limit(1)).one()
+        add_views(session, [{"article_id": article_id,
+                             "sesion_id": sesion_id,
+                             "timestamp": timestamp}] * 3)
+        session.execute(insert(views).values(
+            article_id=article_id, sesion_id=sesion_id, timestamp=timestamp))
+        # The new views are counted, so they are moved too.
+        session.execute(update(BlogViewCounterState).values(
+            last_view_id=select(func.max(views.c.id)).scalar_subquery()))
+        partition_existing_views(session)
+        tables = [views] + [partition_table(year, month)
+                            for year, month in existing_months(session)]
+        ids = union_all(*(select(table.c.id) for table in tables)).subquery()
+        count, unique = session.execute(
+            select(func.count(ids.c.id), func.count(ids.c.id.distinct()))
+        ).one()
+        assert count == unique, f"{count - unique} duplicate ids"
+    finally:
+        session.rollback()
+
+
+def main():
+    from db import Session, engine
+
+    with engine.connect() as connection:
+        upgrade_partitions(connection)
+    with Session() as session:
+        with session.begin():
+            moved = partition_existing_views(session)
+        print(f"Moved {moved} views to "
+              f"{len(existing_months(session))} monthly tables")
+        _check_ids(session)
+        print("The ids of the views are unique after add_views()")
+
+
+if __name__ == "__main__":
+    main()